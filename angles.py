@@ -0,0 +1,293 @@
+"""
+Vectorized joint-angle engine.
+
+Joint angles are described by a declarative table mapping a joint name to the
+three landmarks that form it (first point, vertex, last point). Landmarks for
+every frame are copied into one (N, 33, 4) array of x, y, z and visibility, and
+all configured angles are computed for all frames in a single NumPy pass.
+"""
+
+import numpy as np
+
+# Number of landmarks produced by MediaPipe Pose
+NUM_LANDMARKS = 33
+
+# MediaPipe pose landmark indices
+POSE_LANDMARKS = {
+    "NOSE": 0,
+    "LEFT_EYE_INNER": 1,
+    "LEFT_EYE": 2,
+    "LEFT_EYE_OUTER": 3,
+    "RIGHT_EYE_INNER": 4,
+    "RIGHT_EYE": 5,
+    "RIGHT_EYE_OUTER": 6,
+    "LEFT_EAR": 7,
+    "RIGHT_EAR": 8,
+    "MOUTH_LEFT": 9,
+    "MOUTH_RIGHT": 10,
+    "LEFT_SHOULDER": 11,
+    "RIGHT_SHOULDER": 12,
+    "LEFT_ELBOW": 13,
+    "RIGHT_ELBOW": 14,
+    "LEFT_WRIST": 15,
+    "RIGHT_WRIST": 16,
+    "LEFT_PINKY": 17,
+    "RIGHT_PINKY": 18,
+    "LEFT_INDEX": 19,
+    "RIGHT_INDEX": 20,
+    "LEFT_THUMB": 21,
+    "RIGHT_THUMB": 22,
+    "LEFT_HIP": 23,
+    "RIGHT_HIP": 24,
+    "LEFT_KNEE": 25,
+    "RIGHT_KNEE": 26,
+    "LEFT_ANKLE": 27,
+    "RIGHT_ANKLE": 28,
+    "LEFT_HEEL": 29,
+    "RIGHT_HEEL": 30,
+    "LEFT_FOOT_INDEX": 31,
+    "RIGHT_FOOT_INDEX": 32,
+}
+
+# Pseudo landmark for a point straight above the vertex, used for angles
+# measured against the vertical (e.g. trunk lean)
+VERTICAL = -1
+
+_L = POSE_LANDMARKS
+
+# Joint table: name -> (first point, vertex, last point)
+JOINTS = {
+    "leftElbow": (_L["LEFT_SHOULDER"], _L["LEFT_ELBOW"], _L["LEFT_WRIST"]),
+    "rightElbow": (_L["RIGHT_SHOULDER"], _L["RIGHT_ELBOW"], _L["RIGHT_WRIST"]),
+    "leftShoulder": (_L["LEFT_HIP"], _L["LEFT_SHOULDER"], _L["LEFT_ELBOW"]),
+    "rightShoulder": (_L["RIGHT_HIP"], _L["RIGHT_SHOULDER"], _L["RIGHT_ELBOW"]),
+    "leftKnee": (_L["LEFT_HIP"], _L["LEFT_KNEE"], _L["LEFT_ANKLE"]),
+    "rightKnee": (_L["RIGHT_HIP"], _L["RIGHT_KNEE"], _L["RIGHT_ANKLE"]),
+    "leftHip": (_L["LEFT_SHOULDER"], _L["LEFT_HIP"], _L["LEFT_KNEE"]),
+    "rightHip": (_L["RIGHT_SHOULDER"], _L["RIGHT_HIP"], _L["RIGHT_KNEE"]),
+    "leftAnkle": (_L["LEFT_KNEE"], _L["LEFT_ANKLE"], _L["LEFT_FOOT_INDEX"]),
+    "rightAnkle": (_L["RIGHT_KNEE"], _L["RIGHT_ANKLE"], _L["RIGHT_FOOT_INDEX"]),
+    "leftWrist": (_L["LEFT_ELBOW"], _L["LEFT_WRIST"], _L["LEFT_INDEX"]),
+    "rightWrist": (_L["RIGHT_ELBOW"], _L["RIGHT_WRIST"], _L["RIGHT_INDEX"]),
+    "leftTrunk": (_L["LEFT_SHOULDER"], _L["LEFT_HIP"], VERTICAL),
+    "rightTrunk": (_L["RIGHT_SHOULDER"], _L["RIGHT_HIP"], VERTICAL),
+}
+
+# Short labels used when drawing angles on video frames
+JOINT_LABELS = {
+    "leftElbow": "L Elbow",
+    "rightElbow": "R Elbow",
+    "leftShoulder": "L Shoulder",
+    "rightShoulder": "R Shoulder",
+    "leftKnee": "L Knee",
+    "rightKnee": "R Knee",
+    "leftHip": "L Hip",
+    "rightHip": "R Hip",
+    "leftAnkle": "L Ankle",
+    "rightAnkle": "R Ankle",
+    "leftWrist": "L Wrist",
+    "rightWrist": "R Wrist",
+    "leftTrunk": "L Trunk",
+    "rightTrunk": "R Trunk",
+}
+
+# Joints reported when no joint set is requested
+DEFAULT_JOINTS = ("leftElbow", "rightElbow", "leftShoulder",
+                  "rightShoulder", "leftKnee", "rightKnee")
+
+
+def validate_joints(joints):
+    """
+    Check a requested joint set against the joint table.
+
+    Args:
+        joints: Iterable of joint names, or None for the default set
+
+    Returns:
+        A tuple of joint names
+
+    Raises:
+        ValueError: If a joint name is not in the joint table
+    """
+    if joints is None:
+        return DEFAULT_JOINTS
+    joints = tuple(joints)
+    unknown = [name for name in joints if name not in JOINTS]
+    if unknown:
+        raise ValueError(f"Unknown joints: {', '.join(unknown)}")
+    if not joints:
+        raise ValueError("No joints requested")
+    return joints
+
+
+class LandmarkBuffer:
+    """
+    Growable (N, 33, 4) float32 array of per-frame landmarks.
+
+    Rows for frames without a detection are left as NaN and flagged in
+    `detected`. Frames are addressed by their index in the video; `release`
+    forgets the oldest ones, so a buffer that is released as it goes only
+    holds a window of the video.
+
+    Args:
+        capacity: Initial number of frames to allocate
+    """
+
+    def __init__(self, capacity=1024):
+        capacity = max(int(capacity), 1)
+        self.landmarks = np.full((capacity, NUM_LANDMARKS, 4), np.nan, dtype=np.float32)
+        self.detected = np.zeros(capacity, dtype=bool)
+        self.size = 0
+        # Index of the frame stored in the first row
+        self.start = 0
+
+    def _grow(self):
+        # Double the capacity, keeping the frames already stored
+        stored = self.size - self.start
+        capacity = len(self.landmarks) * 2
+        landmarks = np.full((capacity, NUM_LANDMARKS, 4), np.nan, dtype=np.float32)
+        landmarks[:stored] = self.landmarks[:stored]
+        detected = np.zeros(capacity, dtype=bool)
+        detected[:stored] = self.detected[:stored]
+        self.landmarks = landmarks
+        self.detected = detected
+
+    def release(self, before):
+        """Forget the frames before index `before`."""
+        count = min(before, self.size) - self.start
+        if count <= 0:
+            return
+        stored = self.size - self.start
+        kept = stored - count
+        self.landmarks[:kept] = self.landmarks[count:stored]
+        self.detected[:kept] = self.detected[count:stored]
+        # Freed rows must be empty again for frames without a detection
+        self.landmarks[kept:stored] = np.nan
+        self.detected[kept:stored] = False
+        self.start += count
+
+    def rows(self, start, end=None):
+        """Landmarks of frames [start, end) (default: to the last one stored)."""
+        end = self.size if end is None else end
+        return self.landmarks[start - self.start:end - self.start]
+
+    def append(self, pose_landmarks):
+        """
+        Store the landmarks of one frame.
+
+        Args:
+            pose_landmarks: MediaPipe `results.pose_landmarks`, or None when
+                nothing was detected
+
+        Returns:
+            The row index of the frame
+        """
+        if self.size - self.start == len(self.landmarks):
+            self._grow()
+        row = self.size
+        if pose_landmarks is not None:
+            self.landmarks[row - self.start] = [(lm.x, lm.y, lm.z, lm.visibility)
+                                                for lm in pose_landmarks.landmark]
+            self.detected[row - self.start] = True
+        self.size += 1
+        return row
+
+    def detections(self, start, end=None):
+        """Detection flags of frames [start, end), like rows."""
+        end = self.size if end is None else end
+        return self.detected[start - self.start:end - self.start]
+
+    def view(self):
+        """Return the (landmarks, detected) arrays for the stored frames."""
+        stored = self.size - self.start
+        return self.landmarks[:stored], self.detected[:stored]
+
+
+class AngleEngine:
+    """
+    Computes a configured set of joint angles for many frames at once.
+
+    Args:
+        joints: Joint names from JOINTS, or None for DEFAULT_JOINTS
+        min_visibility: If set, angles whose three landmarks are not all above
+            this visibility are reported as NaN
+    """
+
+    def __init__(self, joints=None, min_visibility=None):
+        self.names = validate_joints(joints)
+        self.min_visibility = min_visibility
+
+        triples = np.array([JOINTS[name] for name in self.names])
+        self._vertical = triples[:, 2] == VERTICAL
+        # Gather the vertex for VERTICAL points; it is shifted upwards later
+        self._first = triples[:, 0]
+        self._vertex = triples[:, 1]
+        self._last = np.where(self._vertical, triples[:, 1], triples[:, 2])
+
+    def vertices(self, landmarks):
+        """
+        Get the vertex position of every joint.
+
+        Args:
+            landmarks: (N, 33, 4) landmark array
+
+        Returns:
+            (N, J, 2) array of normalized x, y vertex coordinates
+        """
+        return landmarks[:, self._vertex, :2].astype(np.float64)
+
+    def compute(self, landmarks):
+        """
+        Compute every configured angle for every frame.
+
+        Args:
+            landmarks: (N, 33, 4) landmark array; rows of NaN give NaN angles
+
+        Returns:
+            (N, J) float64 array of angles in degrees, columns in `names` order
+        """
+        points = landmarks[..., :2].astype(np.float64)
+        a = points[:, self._first]
+        b = points[:, self._vertex]
+        c = points[:, self._last]
+        if self._vertical.any():
+            c[:, self._vertical, 1] -= 1.0
+
+        ba = a - b
+        bc = c - b
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cosine = np.einsum("njk,njk->nj", ba, bc) / (
+                np.linalg.norm(ba, axis=-1) * np.linalg.norm(bc, axis=-1))
+            angles = np.arccos(np.clip(cosine, -1.0, 1.0)) * 180.0 / np.pi
+
+        if self.min_visibility is not None:
+            visibility = landmarks[..., 3]
+            visible = ((visibility[:, self._first] > self.min_visibility) &
+                       (visibility[:, self._vertex] > self.min_visibility) &
+                       (self._vertical | (visibility[:, self._last] > self.min_visibility)))
+            angles[~visible] = np.nan
+
+        return angles
+
+    def to_frame_dicts(self, angles, timestamps):
+        """
+        Convert an angle matrix to the per-frame dicts returned by the API.
+
+        Args:
+            angles: (N, J) array from compute
+            timestamps: (N,) array of frame times in seconds
+
+        Returns:
+            A list of {"timestamp": t, joint: angle, ...} dicts; joints with
+            no valid angle are left out
+        """
+        finite = np.isfinite(angles).tolist()
+        values = angles.tolist()
+        frames = []
+        for t, row, ok in zip(timestamps.tolist(), values, finite):
+            frame_angles = {"timestamp": t}
+            for name, value, valid in zip(self.names, row, ok):
+                if valid:
+                    frame_angles[name] = value
+            frames.append(frame_angles)
+        return frames
@@ -1,14 +1,34 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, send_file, stream_with_context
+import io
+import json
 import os
-import cv2
-import numpy as np
-import mediapipe as mp
 import tempfile
+import time
 import uuid
 import logging
+import multiprocessing
+import re
+from urllib.parse import urlencode, urlsplit
 from werkzeug.utils import secure_filename
 from flask_cors import CORS
 
+from jobs import JobManager, QueueFullError
+from angles import validate_joints
+from cache import ResultCache, save_upload, adopt_file, hash_file, make_key
+from columnar import AngleColumns
+from ingest import UploadStore, UploadError, OffsetMismatch
+from remote import RemoteStore, DownloadError, streamable
+from profiles import PROFILES, validate_profile
+from delivery import send_video
+from video_io import VIDEO_ENCODER, PREVIEW_MAX_DIMENSION, output_extension
+from metrics import REGISTRY
+from spill import SpillReader, prune_spills
+from landmark_store import LandmarkReader, reanalyze, EXTENSION as LANDMARK_EXTENSION
+from summary import summarize, DEFAULT_POINTS, REP_MIN_SWING
+from multiperson import DETECT_EVERY, MAX_PEOPLE
+from parallel import MAX_SEGMENT_WORKERS
+from processing import POSE_POOL_SIZE
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,289 +45,400 @@ MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB limit
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
+# Configure background analysis jobs
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))  # Concurrent analyses
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 8))  # Jobs allowed to wait
+
+# Profiles whose pose models the workers load when the server starts, e.g.
+# "accurate,fast"; empty starts workers (and loads models) on the first job
+WARM_UP_PROFILES = [validate_profile(name.strip())
+                    for name in os.environ.get("WARM_UP_PROFILES", "").split(",") if name.strip()]
+
+# Longest a request waits for an analysis it blocks on (wait=true uploads and
+# /api/analyze); the client then gets the job id to poll instead
+REQUEST_TIMEOUT_SECONDS = int(os.environ.get("REQUEST_TIMEOUT_SECONDS", 10 * 60))
+
+# WSGI environ key of a threading.Event the ASGI server (asgi.py) sets when the
+# client disconnects; an analysis the request was waiting for is cancelled
+DISCONNECTED_KEY = "joint_angle.disconnected"
+
+app.config['JOB_WORKERS'] = JOB_WORKERS
+app.config['JOB_QUEUE_SIZE'] = JOB_QUEUE_SIZE
+app.config['REQUEST_TIMEOUT_SECONDS'] = REQUEST_TIMEOUT_SECONDS
+app.config['WARM_UP_PROFILES'] = WARM_UP_PROFILES
+
+# Configure the result cache (total bytes of cached videos and results);
+# uploads (also chunked or downloaded ones), processed videos and landmarks no
+# cached result refers to are deleted UPLOAD_RETENTION_SECONDS after they were
+# written
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+UPLOAD_RETENTION_SECONDS = int(os.environ.get("UPLOAD_RETENTION_SECONDS", 24 * 60 * 60))
+
+app.config['RESULT_CACHE_MAX_BYTES'] = RESULT_CACHE_MAX_BYTES
+app.config['UPLOAD_RETENTION_SECONDS'] = UPLOAD_RETENTION_SECONDS
+
+# Configure chunked uploads, which are streamed to disk and so can be larger
+# than MAX_CONTENT_LENGTH (which then only limits a single chunk)
+CHUNKED_UPLOAD_MAX_BYTES = int(os.environ.get("CHUNKED_UPLOAD_MAX_BYTES", 4 * 1024 ** 3))
+STREAM_START_BYTES = int(os.environ.get("STREAM_START_BYTES", 1024 * 1024))  # Data needed before streamed analysis starts
+
+app.config['CHUNKED_UPLOAD_MAX_BYTES'] = CHUNKED_UPLOAD_MAX_BYTES
+app.config['STREAM_START_BYTES'] = STREAM_START_BYTES
+
+# Configure videos /api/analyze downloads from URLs; REMOTE_ALLOWED_HOSTS is a
+# comma-separated list of the hosts allowed (e.g. the object store), "*" allows
+# any host with a public address, and URLs are refused while it is empty
+REMOTE_MAX_BYTES = int(os.environ.get("REMOTE_MAX_BYTES", 4 * 1024 ** 3))
+REMOTE_ALLOWED_HOSTS = [host.strip() for host in os.environ.get("REMOTE_ALLOWED_HOSTS", "").split(",")
+                        if host.strip()]
+
+app.config['REMOTE_MAX_BYTES'] = REMOTE_MAX_BYTES
+app.config['REMOTE_ALLOWED_HOSTS'] = REMOTE_ALLOWED_HOSTS
+
+# Configure video delivery: "" sends files from Python, "x-accel" (nginx) or
+# "x-sendfile" (Apache, lighttpd) leaves the bytes to the reverse proxy; the
+# nginx internal location for the upload folder is VIDEO_ACCEL_PREFIX
+VIDEO_DELIVERY = os.environ.get("VIDEO_DELIVERY", "")
+VIDEO_ACCEL_PREFIX = os.environ.get("VIDEO_ACCEL_PREFIX", "/protected-videos/")
+
+app.config['VIDEO_DELIVERY'] = VIDEO_DELIVERY
+app.config['VIDEO_ACCEL_PREFIX'] = VIDEO_ACCEL_PREFIX
+
+# Configure spilled results (spill=true), which are written to disk while a
+# long video is analyzed and read back a window at a time; they are deleted
+# SPILL_RETENTION_SECONDS after they were written
+SPILL_FOLDER = os.path.join(UPLOAD_FOLDER, 'spills')
+SPILL_RETENTION_SECONDS = int(os.environ.get("SPILL_RETENTION_SECONDS", 24 * 60 * 60))
+SPILL_PAGE_FRAMES = 1000  # Frames per page of /api/results/<id>/angles
+SPILL_MAX_PAGE_FRAMES = 100000
+
+app.config['SPILL_RETENTION_SECONDS'] = SPILL_RETENTION_SECONDS
+
 # Create upload folder if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Initialize MediaPipe pose
-mp_pose = mp.solutions.pose
-mp_drawing = mp.solutions.drawing_utils
-mp_drawing_styles = mp.solutions.drawing_styles
+# Initialize the result cache shared by every worker using the upload folder
+result_cache = ResultCache(UPLOAD_FOLDER, RESULT_CACHE_MAX_BYTES)
+
+# Initialize the chunked upload sessions (metadata in a subfolder, data next
+# to the other uploads so it can be served while it arrives)
+upload_store = UploadStore(os.path.join(UPLOAD_FOLDER, 'sessions'), UPLOAD_FOLDER,
+                           CHUNKED_UPLOAD_MAX_BYTES)
+
+# Initialize the URL downloads (state in a subfolder, data next to the uploads)
+remote_store = RemoteStore(os.path.join(UPLOAD_FOLDER, 'downloads'), UPLOAD_FOLDER,
+                           REMOTE_MAX_BYTES, REMOTE_ALLOWED_HOSTS)
+
+# Initialize the job manager; worker processes start on the first job unless
+# warm-up profiles are configured
+job_manager = JobManager(max_workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE,
+                         warm_profiles=WARM_UP_PROFILES or [None])
+job_manager.export_metrics()
+# (Job workers import this module too when it is run as a script; only the
+# server process starts a pool)
+if WARM_UP_PROFILES and multiprocessing.parent_process() is None:
+    job_manager.warm_up()
 
 # Helper function to check if file extension is allowed
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Calculate angle between three points
-def calculate_angle(a, b, c):
-    # Convert points to numpy arrays
-    a = np.array(a)
-    b = np.array(b)
-    c = np.array(c)
+# Parse a requested joint set from a comma-separated string or a list
+def parse_joints(value):
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = [name.strip() for name in value.split(',') if name.strip()]
+    return list(validate_joints(value))
+
+# Options that change the analysis result, used in the cache key
+def cache_options(skeleton_mode, save_data, joints, inference=None):
+    inference = dict(inference or {})
+    profile = validate_profile(inference.pop("profile", None))
+    return {
+        "annotated": save_data,
+        "skeleton_mode": skeleton_mode and save_data,
+        "encoder": VIDEO_ENCODER if save_data else None,
+        "joints": list(validate_joints(joints)),
+        # The profile's settings, so editing a profile invalidates its results
+        "profile": {"name": profile, **PROFILES[profile]},
+        **inference
+    }
+
+# Parse a flag from a form field or JSON; strings count as set only if they
+# are "true", like the form fields of /api/upload
+def parse_flag(value):
+    if isinstance(value, str):
+        return value.lower() == 'true'
+    return bool(value)
+
+# Parse the requested number of parallel segment workers
+def parse_workers(value):
+    if value in (None, ''):
+        return 1
+    workers = int(value)
+    if not 1 <= workers <= MAX_SEGMENT_WORKERS:
+        raise ValueError(f"workers must be between 1 and {MAX_SEGMENT_WORKERS}")
+    return workers
+
+# Parse the options that control pose inference from form fields or JSON: the
+# processing profile, inference resolution, frame sampling and ROI crops, as
+# process_video keyword arguments
+def parse_inference(values):
+    inference = {"profile": validate_profile(values.get('profile') or None)}
+    max_dimension = values.get('maxDimension')
+    if max_dimension not in (None, ''):
+        max_dimension = int(max_dimension)
+        if max_dimension < 64:
+            raise ValueError("maxDimension must be at least 64")
+        inference["max_dimension"] = max_dimension
+    sample_fps = values.get('sampleFps')
+    if sample_fps not in (None, ''):
+        sample_fps = float(sample_fps)
+        if sample_fps <= 0:
+            raise ValueError("sampleFps must be positive")
+        inference["sample_fps"] = sample_fps
+    adaptive = values.get('adaptiveSampling', False)
+    if isinstance(adaptive, str):
+        adaptive = adaptive.lower() == 'true'
+    if adaptive:
+        inference["adaptive_sampling"] = True
+    multi_person = values.get('multiPerson', False)
+    if isinstance(multi_person, str):
+        multi_person = multi_person.lower() == 'true'
+    roi = values.get('roi', False)
+    if isinstance(roi, str):
+        roi = roi.lower() == 'true'
+    if roi:
+        if multi_person:
+            raise ValueError("roi can't be combined with multiPerson, which crops every person")
+        if POSE_POOL_SIZE < 2:
+            raise ValueError("roi needs a POSE_POOL_SIZE of at least 2")
+        inference["roi"] = True
+    if multi_person:
+        if sample_fps not in (None, '') or adaptive:
+            raise ValueError("multiPerson can't be combined with frame sampling")
+        detect_every = int(values.get('detectEvery') or DETECT_EVERY)
+        if detect_every < 1:
+            raise ValueError("detectEvery must be at least 1")
+        max_people = int(values.get('maxPeople') or MAX_PEOPLE)
+        if not 1 <= max_people <= POSE_POOL_SIZE:
+            raise ValueError(f"maxPeople must be between 1 and {POSE_POOL_SIZE}")
+        inference.update(multi_person=True, detect_every=detect_every, max_people=max_people)
+    return inference
+
+# Parse the spill flag; spills hold a single person's angles
+def parse_spill(value, inference):
+    if isinstance(value, str):
+        value = value.lower() == 'true'
+    if value and inference.get("multi_person"):
+        raise ValueError("spill can't be combined with multiPerson")
+    return bool(value)
+
+# Paths of a new processed video of `file_path` and its preview rendition (None
+# if previews are disabled), in the container the encoder writes
+def new_output_paths(file_path, kind="processed"):
+    base_name, extension = os.path.splitext(os.path.basename(file_path))
+    output_id = uuid.uuid4()
+    processed_extension = output_extension(extension)
+    processed_video_path = os.path.join(
+        app.config['UPLOAD_FOLDER'],
+        f"{base_name}_{output_id}_{kind}{processed_extension}")
+    preview_video_path = None
+    if PREVIEW_MAX_DIMENSION:
+        preview_video_path = os.path.join(
+            app.config['UPLOAD_FOLDER'],
+            f"{base_name}_{output_id}_preview{processed_extension}")
+    return processed_video_path, preview_video_path
+
+# Parse a visibility threshold (0 to 1) below which angles count as missing
+def parse_min_visibility(value):
+    if value in (None, ''):
+        return None
+    min_visibility = float(value)
+    if not 0 <= min_visibility <= 1:
+        raise ValueError("minVisibility must be between 0 and 1")
+    return min_visibility
+
+# Queue an analysis of a stored video
+#
+# Returns the job id, the URLs merged into its result and the processed video
+# path. `follow_upload` is the session metadata path of an upload that is still
+# arriving, which the job tails until the upload is complete.
+def submit_analysis(file_path, skeleton_mode, save_data, joints, workers,
+                    cache_key_options, video_hash=None, follow_upload=None, inference=None,
+                    timings=False, spill=False):
+    unique_filename = os.path.basename(file_path)
+    
+    # Generate processed video path if save_data is true
+    processed_video_path = None
+    preview_video_path = None
+    if save_data:
+        processed_video_path, preview_video_path = new_output_paths(file_path)
+        logger.info(f"Will save processed video to {processed_video_path}")
     
-    # Calculate vectors
-    ba = a - b
-    bc = c - b
+    # Build the URLs the client uses to fetch the videos
+    result_extras = {"original_video": f"/api/videos/{unique_filename}"}
+    processed_filename = None
+    preview_filename = None
+    if save_data and processed_video_path:
+        processed_filename = os.path.basename(processed_video_path)
+        result_extras["processed_video"] = f"/api/videos/{processed_filename}"
+    if preview_video_path:
+        preview_filename = os.path.basename(preview_video_path)
+        result_extras["preview_video"] = f"/api/videos/{preview_filename}"
     
-    # Calculate dot product
-    cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc))
+    # Cache the result together with the files it refers to; uploads that were
+    # still arriving when the job started are hashed once they are complete
+    def store_result(result):
+        content_hash = video_hash or hash_file(file_path)
+        result_cache.put(make_key(content_hash, cache_key_options), content_hash, result,
+                         [unique_filename, processed_filename, preview_filename,
+                          landmarks_filename])
     
-    # Ensure value is within valid range for arccos
-    cosine_angle = np.clip(cosine_angle, -1.0, 1.0)
+    # Spilled angles are written to their own directory and served from there
+    # (they expire on their own, so they aren't cached)
+    spill_options = {}
+    if spill:
+        spill_options["spill_path"] = new_spill_path(result_extras)
+        store_result = None
     
-    # Calculate angle in degrees
-    angle = np.arccos(cosine_angle) * 180.0 / np.pi
+    # Keep the raw landmarks for re-analysis
+    landmarks_filename = None
+    if not (inference or {}).get("multi_person"):
+        spill_options["landmarks_path"] = new_landmarks_path(result_extras,
+                                                             spill_options.get("spill_path"))
+        landmarks_filename = os.path.basename(spill_options["landmarks_path"])
     
-    return angle
+    job_id = job_manager.submit(file_path, processed_video_path,
+                                result_extras=result_extras,
+                                on_success=store_result,
+                                timings=timings,
+                                skeleton_mode=skeleton_mode,
+                                joints=joints,
+                                workers=workers,
+                                follow_upload=follow_upload,
+                                preview_path=preview_video_path,
+                                **spill_options,
+                                **(inference or {}))
+    logger.info(f"Queued job {job_id} for {file_path}")
+    return job_id, result_extras, processed_video_path
 
-# Process a video to extract pose landmarks and calculate joint angles
-def process_video(video_path, output_path=None, skeleton_mode=False):
+# Queue an analysis of a complete video, or return the cached result
+def queue_analysis(file_path, video_hash, skeleton_mode, save_data, joints, workers, wait,
+                   inference=None, timings=False, spill=False):
+    # Return a stored result for the same bytes and options right away
+    options = cache_options(skeleton_mode, save_data, joints, inference)
+    if not spill:
+        cached = result_cache.get(make_key(video_hash, options))
+        if cached is not None:
+            logger.info(f"Result cache hit for {file_path}")
+            return jsonify({**cached, "cached": True})
+    result_cache.touch_video(video_hash)
+    
+    # Queue the video for analysis
     try:
-        # Open video file
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            logger.error(f"Error opening video file: {video_path}")
-            return {"error": "Failed to open video file"}
-        
-        # Get video properties
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        job_id, result_extras, processed_video_path = submit_analysis(
+            file_path, skeleton_mode, save_data, joints, workers, options,
+            video_hash=video_hash, inference=inference, timings=timings, spill=spill)
+    except QueueFullError as e:
+        logger.warning(f"Rejected upload, job queue is full: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 503, {"Retry-After": "30"}
+    
+    # Block until the job is done if the client asked for the result inline
+    if wait:
+        pending = wait_for_job(job_id, result_extras)
+        if pending:
+            return pending
+        job = job_manager.get(job_id)
+        if job["status"] != "completed":
+            logger.error(f"Video processing failed: {job['error']}")
+            return jsonify({"success": False, "error": job["error"], "job_id": job_id}), 500
         
-        # Prepare output video if needed
-        if output_path:
-            # Ensure directory exists
-            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
-            # Use a more compatible codec
-            fourcc = cv2.VideoWriter_fourcc(*'XVID')
-            out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-            
-            # Verify VideoWriter was initialized correctly
-            if not out.isOpened():
-                logger.warning(f"Failed to initialize VideoWriter. Output may not be saved.")
+        # Verify the processed video exists
+        if processed_video_path:
+            if os.path.exists(processed_video_path):
+                logger.info(f"Processed video saved successfully at {processed_video_path}")
+            else:
+                logger.warning(f"Processed video was not found at {processed_video_path}")
         
-        # Initialize pose detector with appropriate settings
-        with mp_pose.Pose(
-            static_image_mode=False,
-            model_complexity=2,  # Higher accuracy
-            enable_segmentation=True,  # Always enable segmentation
-            smooth_segmentation=True,
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5) as pose:
-            
-            # Initialize results
-            angle_data = []
-            frame_idx = 0
-            
-            # Process each frame in the video
-            while cap.isOpened():
-                success, frame = cap.read()
-                if not success:
-                    break
-                
-                # Calculate progress
-                progress = (frame_idx / frame_count) * 100
-                
-                # Convert the BGR image to RGB
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                
-                # Process the frame with MediaPipe
-                results = pose.process(frame_rgb)
-                
-                # Initialize angles for this frame
-                frame_angles = {"timestamp": frame_idx / fps}
-                
-                # Check if pose landmarks were detected
-                if results.pose_landmarks:
-                    landmarks = results.pose_landmarks.landmark
-                    
-                    # Prepare a copy of the frame for drawing
-                    if output_path:
-                        # Create a frame for drawing
-                        annotated_frame = frame.copy()
-                        
-                        # Apply skeleton mode if enabled
-                        if skeleton_mode:
-                            # Create a completely black background
-                            annotated_frame = np.zeros_like(frame)
-                            
-                            # Custom drawing specs for better visibility in skeleton mode
-                            landmark_spec = mp_drawing.DrawingSpec(
-                                color=(0, 255, 0),  # Bright green for landmarks
-                                thickness=5,
-                                circle_radius=5
-                            )
-                            connection_spec = mp_drawing.DrawingSpec(
-                                color=(255, 255, 255),  # White for connections
-                                thickness=3
-                            )
-                        else:
-                            # Default drawing specs for normal mode
-                            landmark_spec = mp_drawing.DrawingSpec(
-                                color=(0, 0, 255),  # Blue for landmarks
-                                thickness=3,
-                                circle_radius=3
-                            )
-                            connection_spec = mp_drawing.DrawingSpec(
-                                color=(0, 255, 0),  # Green for connections
-                                thickness=2
-                            )
-                        
-                        # Draw pose landmarks
-                        mp_drawing.draw_landmarks(
-                            image=annotated_frame,
-                            landmark_list=results.pose_landmarks,
-                            connections=mp_pose.POSE_CONNECTIONS,
-                            landmark_drawing_spec=landmark_spec,
-                            connection_drawing_spec=connection_spec)
-                    
-                    # Calculate left elbow angle
-                    left_shoulder = [landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value].x,
-                                    landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value].y]
-                    left_elbow = [landmarks[mp_pose.PoseLandmark.LEFT_ELBOW.value].x,
-                                landmarks[mp_pose.PoseLandmark.LEFT_ELBOW.value].y]
-                    left_wrist = [landmarks[mp_pose.PoseLandmark.LEFT_WRIST.value].x,
-                                landmarks[mp_pose.PoseLandmark.LEFT_WRIST.value].y]
-                    
-                    left_elbow_angle = calculate_angle(left_shoulder, left_elbow, left_wrist)
-                    frame_angles["leftElbow"] = left_elbow_angle
-                    
-                    # Calculate right elbow angle
-                    right_shoulder = [landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER.value].x,
-                                    landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER.value].y]
-                    right_elbow = [landmarks[mp_pose.PoseLandmark.RIGHT_ELBOW.value].x,
-                                landmarks[mp_pose.PoseLandmark.RIGHT_ELBOW.value].y]
-                    right_wrist = [landmarks[mp_pose.PoseLandmark.RIGHT_WRIST.value].x,
-                                 landmarks[mp_pose.PoseLandmark.RIGHT_WRIST.value].y]
-                    
-                    right_elbow_angle = calculate_angle(right_shoulder, right_elbow, right_wrist)
-                    frame_angles["rightElbow"] = right_elbow_angle
-                    
-                    # Calculate left shoulder angle
-                    left_hip = [landmarks[mp_pose.PoseLandmark.LEFT_HIP.value].x,
-                              landmarks[mp_pose.PoseLandmark.LEFT_HIP.value].y]
-                    
-                    left_shoulder_angle = calculate_angle(left_hip, left_shoulder, left_elbow)
-                    frame_angles["leftShoulder"] = left_shoulder_angle
-                    
-                    # Calculate right shoulder angle
-                    right_hip = [landmarks[mp_pose.PoseLandmark.RIGHT_HIP.value].x,
-                               landmarks[mp_pose.PoseLandmark.RIGHT_HIP.value].y]
-                    
-                    right_shoulder_angle = calculate_angle(right_hip, right_shoulder, right_elbow)
-                    frame_angles["rightShoulder"] = right_shoulder_angle
-                    
-                    # Calculate left knee angle
-                    left_hip = [landmarks[mp_pose.PoseLandmark.LEFT_HIP.value].x,
-                              landmarks[mp_pose.PoseLandmark.LEFT_HIP.value].y]
-                    left_knee = [landmarks[mp_pose.PoseLandmark.LEFT_KNEE.value].x,
-                               landmarks[mp_pose.PoseLandmark.LEFT_KNEE.value].y]
-                    left_ankle = [landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value].x,
-                                landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value].y]
-                    
-                    left_knee_angle = calculate_angle(left_hip, left_knee, left_ankle)
-                    frame_angles["leftKnee"] = left_knee_angle
-                    
-                    # Calculate right knee angle
-                    right_hip = [landmarks[mp_pose.PoseLandmark.RIGHT_HIP.value].x,
-                               landmarks[mp_pose.PoseLandmark.RIGHT_HIP.value].y]
-                    right_knee = [landmarks[mp_pose.PoseLandmark.RIGHT_KNEE.value].x,
-                                landmarks[mp_pose.PoseLandmark.RIGHT_KNEE.value].y]
-                    right_ankle = [landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE.value].x,
-                                 landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE.value].y]
-                    
-                    right_knee_angle = calculate_angle(right_hip, right_knee, right_ankle)
-                    frame_angles["rightKnee"] = right_knee_angle
-                    
-                    # Draw angles on the frame if output path is provided
-                    if output_path:
-                        # Set text color based on mode (white for skeleton mode, white with black outline for normal)
-                        text_color = (255, 255, 255) if skeleton_mode else (255, 255, 255)
-                        outline_color = (0, 0, 0)
-                        
-                        # Helper function to draw angle
-                        def draw_angle(frame, point, angle, joint_name):
-                            x = int(point[0] * width)
-                            y = int(point[1] * height)
-                            
-                                                    # Make sure coordinates are within image bounds
-                            if 0 <= x < width and 0 <= y < height:
-                                # Text to display
-                                text = f"{joint_name}: {angle:.1f}°"
-                                
-                                try:
-                                    if not skeleton_mode:
-                                        # Draw black outline in normal mode
-                                        cv2.putText(frame, text, (x, y), 
-                                                  cv2.FONT_HERSHEY_SIMPLEX, 0.5,
-                                                  outline_color, 4, cv2.LINE_AA)
-                                    
-                                    # Draw text
-                                    cv2.putText(frame, text, (x, y), 
-                                              cv2.FONT_HERSHEY_SIMPLEX, 0.5,
-                                              text_color, 2, cv2.LINE_AA)
-                                except Exception as text_error:
-                                    logger.warning(f"Error drawing text: {text_error}")
-                            
-                            # Draw angle arc with color based on mode
-                            arc_color = (0, 255, 0) if skeleton_mode else (0, 255, 0)
-                            radius = 30
-                            
-                            # Make sure coordinates are within image bounds
-                            if 0 <= x < width and 0 <= y < height:
-                                try:
-                                    cv2.ellipse(frame, (x, y), (radius, radius), 0, 0, angle,
-                                              arc_color, 2, cv2.LINE_AA)
-                                except Exception as arc_error:
-                                    logger.warning(f"Error drawing arc: {arc_error}")
-                        
-                        # Draw all angles
-                        draw_angle(annotated_frame, left_elbow, left_elbow_angle, "L Elbow")
-                        draw_angle(annotated_frame, right_elbow, right_elbow_angle, "R Elbow")
-                        draw_angle(annotated_frame, left_shoulder, left_shoulder_angle, "L Shoulder")
-                        draw_angle(annotated_frame, right_shoulder, right_shoulder_angle, "R Shoulder")
-                        draw_angle(annotated_frame, left_knee, left_knee_angle, "L Knee")
-                        draw_angle(annotated_frame, right_knee, right_knee_angle, "R Knee")
-                        
-                        # Add timestamp with appropriate visibility
-                        time_text = f"Time: {frame_idx / fps:.2f}s"
-                        if not skeleton_mode:
-                            # Add outline in normal mode
-                            cv2.putText(annotated_frame, time_text, (10, 30),
-                                      cv2.FONT_HERSHEY_SIMPLEX, 1, outline_color, 4, cv2.LINE_AA)
-                        
-                        cv2.putText(annotated_frame, time_text, (10, 30),
-                                  cv2.FONT_HERSHEY_SIMPLEX, 1, text_color, 2, cv2.LINE_AA)
-                        
-                        # Write the frame to output video
-                        out.write(annotated_frame)
-                
-                # Add angles data to results
-                angle_data.append(frame_angles)
-                
-                # Increment frame counter
-                frame_idx += 1
-            
-            # Release resources
-            cap.release()
-            if output_path:
-                out.release()
-            
-            return {
-                "success": True,
-                "data": angle_data,
-                "video_info": {
-                    "frame_count": frame_count,
-                    "fps": fps,
-                    "width": width,
-                    "height": height,
-                    "duration": frame_count / fps
-                }
-            }
+        return jsonify(job["result"])
     
-    except Exception as e:
-        logger.error(f"Error processing video: {str(e)}")
-        return {"success": False, "error": str(e)}
+    return jsonify(job_accepted(job_id, result_extras)), 202
+
+# Wait for the job a request is blocked on. Returns None once it has
+# finished, or the 504 response to send if it didn't in time (it keeps
+# running) or the client went away (it is cancelled)
+def wait_for_job(job_id, result_extras=None):
+    job = job_manager.wait(job_id, timeout=REQUEST_TIMEOUT_SECONDS,
+                           abandon=request.environ.get(DISCONNECTED_KEY))
+    if job["finished_at"] is not None:
+        return None
+    return jsonify({
+        **job_accepted(job_id, result_extras),
+        "success": False,
+        "error": f"The analysis didn't finish within {REQUEST_TIMEOUT_SECONDS} seconds"
+    }), 504
+
+# Reserve a directory for a spilled result and add its URLs to `result_extras`
+def new_spill_path(result_extras):
+    prune_spills(SPILL_FOLDER, app.config['SPILL_RETENTION_SECONDS'])
+    os.makedirs(SPILL_FOLDER, exist_ok=True)
+    result_id = uuid.uuid4().hex
+    result_extras["result_id"] = result_id
+    result_extras["angles_url"] = f"/api/results/{result_id}/angles"
+    return os.path.join(SPILL_FOLDER, result_id)
+
+# Reserve a landmark file for an analysis and add its URLs to `result_extras`
+#
+# Landmarks are stored next to the upload (and cached and evicted with the
+# result, or pruned like the upload if there is none), or for a spilled result
+# in its spill directory, which expires with it; either way they are found by
+# their id.
+def new_landmarks_path(result_extras, spill_path=None):
+    if spill_path:
+        landmarks_id = result_extras["result_id"]
+        path = os.path.join(spill_path, f"landmarks{LANDMARK_EXTENSION}")
+    else:
+        landmarks_id = uuid.uuid4().hex
+        path = os.path.join(UPLOAD_FOLDER, f"{landmarks_id}{LANDMARK_EXTENSION}")
+    result_extras["landmarks_id"] = landmarks_id
+    result_extras["landmarks_url"] = f"/api/landmarks/{landmarks_id}"
+    return path
+
+# Open a landmark file by id, or None
+def open_landmarks(landmarks_id):
+    if not re.fullmatch(r"[0-9a-f]{32}", landmarks_id):
+        return None
+    for path in (os.path.join(UPLOAD_FOLDER, f"{landmarks_id}{LANDMARK_EXTENSION}"),
+                 os.path.join(SPILL_FOLDER, landmarks_id, f"landmarks{LANDMARK_EXTENSION}")):
+        try:
+            return LandmarkReader(path)
+        except FileNotFoundError:
+            continue
+    return None
+
+# Open a finished spilled result by id, or None
+def open_spill(result_id):
+    if not re.fullmatch(r"[0-9a-f]{32}", result_id):
+        return None
+    try:
+        return SpillReader(os.path.join(SPILL_FOLDER, result_id))
+    except FileNotFoundError:
+        return None
+
+# Response body for a job that was queued
+def job_accepted(job_id, result_extras=None):
+    return {
+        "success": True,
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/jobs/{job_id}",
+        "result_url": f"/api/jobs/{job_id}/result",
+        "binary_result_url": f"/api/jobs/{job_id}/result.npz",
+        "stream_url": f"/api/jobs/{job_id}/stream",
+        **(result_extras or {})
+    }
 
 # API Routes
 @app.route('/')
@@ -327,16 +458,25 @@ def upload_video():
     if not allowed_file(file.filename):
         return jsonify({"success": False, "error": "File type not allowed"}), 400
     
+    # Get the joint set to measure (default: elbows, shoulders and knees), how
+    # many processes may split the video between them and the inference options
+    # (processing profile and frame sampling)
     try:
-        # Generate unique filename
+        joints = parse_joints(request.form.get('joints'))
+        workers = parse_workers(request.form.get('workers'))
+        inference = parse_inference(request.form)
+        spill = parse_spill(request.form.get('spill', 'false'), inference)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    try:
+        # Save the uploaded file under the hash of its contents, so the same
+        # clip uploaded again shares one file and one cache entry
         filename = secure_filename(file.filename)
-        unique_id = str(uuid.uuid4())
         base_name, extension = os.path.splitext(filename)
-        unique_filename = f"{base_name}_{unique_id}{extension}"
-        
-        # Save uploaded file
+        result_cache.prune_orphans(app.config['UPLOAD_RETENTION_SECONDS'])
+        video_hash, unique_filename = save_upload(file, app.config['UPLOAD_FOLDER'], extension)
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
         
         # Log file details for debugging
         logger.info(f"Saved file to {file_path}")
@@ -350,44 +490,508 @@ def upload_video():
         save_data = save_data_str.lower() == 'true'
         logger.info(f"Save data: {save_data} (from value: {save_data_str})")
         
-        # Generate processed video path if save_data is true
-        processed_video_path = None
-        if save_data:
-            processed_video_path = os.path.join(
-                app.config['UPLOAD_FOLDER'], 
-                f"{base_name}_{unique_id}_processed{extension}"
-            )
-            logger.info(f"Will save processed video to {processed_video_path}")
-        
-        # Process the video
-        result = process_video(file_path, processed_video_path, skeleton_mode)
-        
-        if not result.get("success", False):
-            logger.error(f"Video processing failed: {result.get('error', 'Unknown error')}")
-            return jsonify(result), 500
-        
-        # Add file paths to result
-        result["original_video"] = f"/api/videos/{unique_filename}"
-        
-        if save_data and processed_video_path:
-            processed_filename = os.path.basename(processed_video_path)
-            result["processed_video"] = f"/api/videos/{processed_filename}"
+        wait = request.form.get('wait', 'false').lower() == 'true'
+        timings = request.form.get('timings', 'false').lower() == 'true'
+        return queue_analysis(file_path, video_hash, skeleton_mode, save_data, joints,
+                              workers, wait, inference, timings, spill)
+    
+    except Exception as e:
+        logger.error(f"Error in upload_video: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+# Serialize the public state of an upload session
+def upload_status(session):
+    return {
+        "success": True,
+        "upload_id": session["id"],
+        "offset": session["offset"],
+        "size": session["size"],
+        "complete": session["complete"],
+        "stream": session["stream"],
+        "job_id": session["job_id"],
+        "upload_url": f"/api/uploads/{session['id']}"
+    }
+
+# Start the analysis of a streamed upload before all of it has arrived
+def start_streamed_analysis(session):
+    options = session["options"]
+    job_id, result_extras, _ = submit_analysis(
+        upload_store.data_path(session), options["skeleton_mode"], options["save_data"],
+        options["joints"], 1,
+        cache_options(options["skeleton_mode"], options["save_data"], options["joints"],
+                      options.get("inference")),
+        follow_upload=upload_store.meta_path(session["id"]), inference=options.get("inference"),
+        timings=options.get("timings", False), spill=options.get("spill", False))
+    upload_store.update(session["id"], job_id=job_id, result_extras=result_extras)
+    return job_id, result_extras
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    data = request.get_json() or {}
+    filename = secure_filename(data.get('filename', ''))
+    if not filename or not allowed_file(filename):
+        return jsonify({"success": False, "error": "File type not allowed"}), 400
+    
+    try:
+        inference = parse_inference(data)
+        options = {
+            "skeleton_mode": parse_flag(data.get('skeletonMode', False)),
+            "save_data": parse_flag(data.get('saveData', False)),
+            "joints": parse_joints(data.get('joints')),
+            "workers": parse_workers(data.get('workers')),
+            "inference": inference,
+            "timings": parse_flag(data.get('timings', False)),
+            "spill": parse_spill(data.get('spill', False), inference)
+        }
+        size = data.get('size')
+        session = upload_store.create(filename, size=int(size) if size is not None else None,
+                                      stream=parse_flag(data.get('stream', False)),
+                                      options=options)
+    except (ValueError, UploadError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    logger.info(f"Opened upload {session['id']} for {filename}")
+    return jsonify(upload_status(session)), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'HEAD'])
+def get_upload(upload_id):
+    session = upload_store.get(upload_id)
+    if session is None:
+        return jsonify({"success": False, "error": "Upload not found"}), 404
+    
+    # Clients resume from the offset reported here
+    return jsonify(upload_status(session)), 200, {"Upload-Offset": str(session["offset"])}
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+def append_upload(upload_id):
+    session = upload_store.get(upload_id)
+    if session is None:
+        return jsonify({"success": False, "error": "Upload not found"}), 404
+    
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({"success": False, "error": "Upload-Offset header required"}), 400
+    
+    # Copy the body straight to disk without buffering it
+    try:
+        offset = upload_store.append(upload_id, offset, request.stream)
+    except OffsetMismatch as e:
+        return (jsonify({"success": False, "error": str(e), "offset": e.offset}), 409,
+                {"Upload-Offset": str(e.offset)})
+    except UploadError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    response = {"success": True, "upload_id": upload_id, "offset": offset,
+                "job_id": session["job_id"]}
+    
+    # Start analyzing a streamed upload once enough of it has arrived, if it
+    # can be decoded from its start; otherwise (e.g. an MP4 with its moov box
+    # at the end) it is analyzed once complete, like any other upload
+    if (session["stream"] and session["job_id"] is None
+            and offset >= app.config['STREAM_START_BYTES']):
+        with open(upload_store.data_path(session), "rb") as f:
+            head = f.read(app.config['STREAM_START_BYTES'])
+        if not streamable(head):
+            logger.info(f"Upload {upload_id} can't be decoded while it arrives, "
+                        f"analyzing it once complete")
+            upload_store.update(upload_id, stream=False)
+            response["stream"] = False
+        else:
+            try:
+                job_id, result_extras = start_streamed_analysis(session)
+                response.update(job_accepted(job_id, result_extras))
+                response["offset"] = offset
+            except QueueFullError as e:
+                # The upload continues; analysis is tried again with the next chunk
+                logger.warning(f"Could not start streamed analysis yet: {str(e)}")
+    
+    return jsonify(response), 200, {"Upload-Offset": str(offset)}
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    session = upload_store.get(upload_id)
+    if session is None:
+        return jsonify({"success": False, "error": "Upload not found"}), 404
+    
+    try:
+        session = upload_store.complete(upload_id)
+    except UploadError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    data = request.get_json(silent=True) or {}
+    wait = parse_flag(data.get('wait', False))
+    options = session["options"]
+    
+    try:
+        # A streamed upload that finished before its analysis started (small,
+        # not decodable while arriving, or the queue was full) is analyzed
+        # like a regular one below
+        if session["stream"] and session["job_id"] is not None:
+            job_id = session["job_id"]
+            result_extras = session["result_extras"]
             
-            # Verify the processed video exists
-            if os.path.exists(processed_video_path):
-                logger.info(f"Processed video saved successfully at {processed_video_path}")
-            else:
-                logger.warning(f"Processed video was not found at {processed_video_path}")
+            # Removing the session tells the job that no more data is coming
+            upload_store.discard(session)
+            if wait:
+                pending = wait_for_job(job_id, result_extras)
+                if pending:
+                    return pending
+                job = job_manager.get(job_id)
+                if job["status"] != "completed":
+                    return jsonify({"success": False, "error": job["error"], "job_id": job_id}), 500
+                return jsonify(job["result"])
+            return jsonify(job_accepted(job_id, result_extras)), 202
         
-        return jsonify(result)
+        # A complete upload is stored and analyzed just like /api/upload
+        extension = os.path.splitext(session["data_filename"])[1]
+        result_cache.prune_orphans(app.config['UPLOAD_RETENTION_SECONDS'])
+        video_hash, unique_filename = adopt_file(upload_store.data_path(session),
+                                                 app.config['UPLOAD_FOLDER'], extension)
+        upload_store.discard(session)
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+        logger.info(f"Completed upload {upload_id} as {file_path}")
+        return queue_analysis(file_path, video_hash, options["skeleton_mode"],
+                              options["save_data"], options["joints"], options["workers"], wait,
+                              options.get("inference"), options.get("timings", False),
+                              options.get("spill", False))
     
     except Exception as e:
-        logger.error(f"Error in upload_video: {str(e)}")
+        logger.error(f"Error in complete_upload: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+# Serialize the public state of a job
+def job_status(job):
+    return {
+        "success": True,
+        "job_id": job["id"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"]
+    }
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    
+    return jsonify(job_status(job))
+
+@app.route('/api/jobs/<job_id>/result')
+def get_job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    
+    # Not finished yet, report the current status instead
+    if job["status"] in ("queued", "running"):
+        return jsonify(job_status(job)), 202
+    
+    if job["status"] in ("failed", "cancelled"):
+        return jsonify({"success": False, "job_id": job_id, "error": job["error"]}), 500
+    
+    return jsonify(job["result"])
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    if job_manager.get(job_id) is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    if not job_manager.cancel(job_id):
+        return jsonify({"success": False, "error": "Job has already finished"}), 409
+    return jsonify(job_status(job_manager.get(job_id))), 202
+
+# Seconds between keep-alive comments on an idle angle stream
+STREAM_KEEPALIVE_SECONDS = 15
+
+@app.route('/api/jobs/<job_id>/stream')
+def stream_job(job_id):
+    if job_manager.get(job_id) is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    
+    # Resume after the last frame a reconnecting EventSource has seen
+    try:
+        cursor = int(request.headers.get('Last-Event-ID') or request.args.get('from', 0))
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid stream position"}), 400
+    
+    def events():
+        position = cursor
+        progress = None
+        while True:
+            update = job_manager.stream(job_id, position, timeout=STREAM_KEEPALIVE_SECONDS)
+            if update is None:
+                break
+            
+            sent = False
+            if update["frames"]:
+                position = update["cursor"]
+                yield f"id: {position}\nevent: angles\ndata: {json.dumps(update['frames'])}\n\n"
+                sent = True
+            if update["progress"] != progress:
+                progress = update["progress"]
+                yield (f"event: progress\ndata: "
+                       f"{json.dumps({'status': update['status'], 'progress': progress})}\n\n")
+                sent = True
+            
+            # Finish once the job is done and every frame has been sent
+            if update["status"] in ("completed", "failed", "cancelled") and not update["pending"]:
+                done = {"status": update["status"], "error": update["error"], "frames": position}
+                yield f"event: done\ndata: {json.dumps(done)}\n\n"
+                break
+            
+            if not sent:
+                yield ": keep-alive\n\n"
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/api/jobs/<job_id>/result.npz')
+def get_job_result_binary(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    
+    # Not finished yet, report the current status instead
+    if job["status"] in ("queued", "running"):
+        return jsonify(job_status(job)), 202
+    
+    if job["status"] in ("failed", "cancelled"):
+        return jsonify({"success": False, "job_id": job_id, "error": job["error"]}), 500
+    
+    # Serve the angles as an .npz archive with one array per joint
+    try:
+        source = job_angles(job, request.args.get('person'))
+    except LookupError as e:
+        return jsonify({"success": False, "error": e.args[0]}), e.args[1]
+    columns = source.window() if isinstance(source, SpillReader) else source
+    body = io.BytesIO()
+    columns.save(body)
+    body.seek(0)
+    return send_file(body, mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f"joint_angles_{job_id}.npz")
+
+# Angles of a completed job: its AngleColumns, a SpillReader for a spilled
+# result, or one person's angles of a multi-person result
+#
+# Raises LookupError with the error message (and status) if there are none.
+def job_angles(job, person=None):
+    result = job["result"]
+    if job["columns"] is not None:
+        return job["columns"]
+    if "spill" in result:
+        reader = open_spill(result["result_id"])
+        if reader is None:
+            raise LookupError("Result has expired", 410)
+        return reader
+    if "people" in result:
+        if person not in result["people"]:
+            raise LookupError(f"Send person (one of {', '.join(result['people']) or 'none'}) "
+                              f"for a multi-person result", 404)
+        return AngleColumns.from_frame_dicts(result["people"][person]["data"])
+    return AngleColumns.from_frame_dicts(result["data"])
+
+# Summarize angles with the options in the query string
+def summary_response(source):
+    try:
+        rep_swing = query_number('repSwing')
+        summary = summarize(source,
+                            points=query_number('points', int) or DEFAULT_POINTS,
+                            smoothing=request.args.get('smoothing') or None,
+                            joints=parse_joints(request.args.get('joints')),
+                            rep_swing=REP_MIN_SWING if rep_swing is None else rep_swing)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, **summary})
+
+@app.route('/api/jobs/<job_id>/summary')
+def get_job_summary(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    
+    if job["status"] in ("queued", "running"):
+        return jsonify(job_status(job)), 202
+    
+    if job["status"] in ("failed", "cancelled"):
+        return jsonify({"success": False, "job_id": job_id, "error": job["error"]}), 500
+    
+    try:
+        source = job_angles(job, request.args.get('person'))
+    except LookupError as e:
+        return jsonify({"success": False, "error": e.args[0]}), e.args[1]
+    return summary_response(source)
+
+# Parse an optional number from the query string
+def query_number(name, cast=float):
+    value = request.args.get(name)
+    return None if value in (None, '') else cast(value)
+
+@app.route('/api/results/<result_id>/angles')
+def get_result_angles(result_id):
+    reader = open_spill(result_id)
+    if reader is None:
+        return jsonify({"success": False, "error": "Result not found"}), 404
+    
+    # Select a time window (seconds) and joints, then a page of its frames
+    try:
+        start = query_number('start')
+        end = query_number('end')
+        joints = parse_joints(request.args.get('joints'))
+        offset = query_number('offset', int) or 0
+        limit = query_number('limit', int)
+        limit = SPILL_PAGE_FRAMES if limit is None else limit
+        if offset < 0 or not 0 < limit <= SPILL_MAX_PAGE_FRAMES:
+            raise ValueError(f"offset must be positive and limit between 1 and "
+                             f"{SPILL_MAX_PAGE_FRAMES}")
+        first, stop = reader.frame_range(start, end)
+        page_first = first + offset
+        page_stop = min(page_first + limit, stop)
+        columns = reader.window(page_first, page_stop, joints)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    if request.args.get('format') == 'npz':
+        body = io.BytesIO()
+        columns.save(body)
+        body.seek(0)
+        return send_file(body, mimetype='application/octet-stream', as_attachment=True,
+                         download_name=f"joint_angles_{result_id}_{page_first}.npz")
+    
+    # Link the next page of the same window, if there is one
+    next_url = None
+    if page_stop < stop:
+        args = request.args.to_dict()
+        args["offset"] = str(offset + len(columns))
+        next_url = f"/api/results/{result_id}/angles?{urlencode(args)}"
+    return jsonify({
+        "success": True,
+        "result_id": result_id,
+        "total_frames": reader.frames,
+        "window_frames": stop - first,
+        "first_frame": page_first,
+        "joints": list(columns.joints),
+        "data": columns.to_frame_dicts(),
+        "next_url": next_url
+    })
+
+@app.route('/api/results/<result_id>/summary')
+def get_result_summary(result_id):
+    reader = open_spill(result_id)
+    if reader is None:
+        return jsonify({"success": False, "error": "Result not found"}), 404
+    return summary_response(reader)
+
+@app.route('/api/landmarks/<landmarks_id>')
+def get_landmarks(landmarks_id):
+    reader = open_landmarks(landmarks_id)
+    if reader is None:
+        return jsonify({"success": False, "error": "Landmarks not found"}), 404
+    return jsonify({
+        "success": True,
+        "landmarks_id": landmarks_id,
+        "frames": reader.frames,
+        "fps": reader.fps,
+        "width": reader.width,
+        "height": reader.height,
+        "profile": reader.meta.get("profile"),
+        "sampled": reader.sampled is not None,
+        "angles_url": f"/api/landmarks/{landmarks_id}/angles",
+        "render_url": f"/api/landmarks/{landmarks_id}/render"
+    })
+
+@app.route('/api/landmarks/<landmarks_id>/angles')
+def get_landmark_angles(landmarks_id):
+    reader = open_landmarks(landmarks_id)
+    if reader is None:
+        return jsonify({"success": False, "error": "Landmarks not found"}), 404
+    
+    # Recompute the angles of a time window (seconds) with any joint set,
+    # visibility threshold and smoothing
+    try:
+        joints = parse_joints(request.args.get('joints'))
+        min_visibility = parse_min_visibility(request.args.get('minVisibility'))
+        first, stop = reader.frame_range(query_number('start'), query_number('end'))
+        columns = reanalyze(reader, joints, min_visibility,
+                            request.args.get('smoothing') or None, first, stop)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    if request.args.get('format') == 'npz':
+        body = io.BytesIO()
+        columns.save(body)
+        body.seek(0)
+        return send_file(body, mimetype='application/octet-stream', as_attachment=True,
+                         download_name=f"joint_angles_{landmarks_id}_{first}.npz")
+    return jsonify({
+        "success": True,
+        "landmarks_id": landmarks_id,
+        "joints": list(columns.joints),
+        "first_frame": first,
+        "frames": len(columns),
+        "data": columns.to_frame_dicts()
+    })
+
+@app.route('/api/landmarks/<landmarks_id>/render', methods=['POST'])
+def render_landmarks(landmarks_id):
+    reader = open_landmarks(landmarks_id)
+    if reader is None:
+        return jsonify({"success": False, "error": "Landmarks not found"}), 404
+    video_path = os.path.join(UPLOAD_FOLDER, os.path.basename(reader.meta["video"]))
+    if not os.path.isfile(video_path):
+        return jsonify({"success": False, "error": "The original video is no longer available"}), 410
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        joints = parse_joints(data.get('joints'))
+        min_visibility = parse_min_visibility(data.get('minVisibility'))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    # Redraw the annotated video on a job worker, without inference
+    processed_video_path, preview_video_path = new_output_paths(video_path, "rendered")
+    result_extras = {
+        "original_video": f"/api/videos/{os.path.basename(video_path)}",
+        "processed_video": f"/api/videos/{os.path.basename(processed_video_path)}",
+        "landmarks_id": landmarks_id
+    }
+    if preview_video_path:
+        result_extras["preview_video"] = f"/api/videos/{os.path.basename(preview_video_path)}"
+    try:
+        job_id = job_manager.submit(video_path, processed_video_path,
+                                    result_extras=result_extras,
+                                    timings=bool(data.get('timings', False)),
+                                    render_from=reader.path,
+                                    skeleton_mode=bool(data.get('skeletonMode', False)),
+                                    joints=joints, min_visibility=min_visibility,
+                                    preview_path=preview_video_path)
+    except QueueFullError as e:
+        logger.warning(f"Rejected render, job queue is full: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 503, {"Retry-After": "30"}
+    return jsonify(job_accepted(job_id, result_extras)), 202
+
+@app.route('/api/cache')
+def get_cache_stats():
+    return jsonify({"success": True, **result_cache.stats()})
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/videos/<filename>')
 def get_video(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_video(app.config['UPLOAD_FOLDER'], filename,
+                      app.config['VIDEO_DELIVERY'], app.config['VIDEO_ACCEL_PREFIX'])
+
+# Start, join or reuse the download of a video URL (see remote.py)
+def open_download(url, refresh=False):
+    extension = os.path.splitext(urlsplit(url).path)[1].lower()
+    if extension[1:] not in ALLOWED_EXTENSIONS:
+        extension = ".mp4"
+    return remote_store.open(url, extension, refresh)
 
 @app.route('/api/analyze', methods=['POST'])
 def analyze_video():
@@ -399,21 +1003,102 @@ def analyze_video():
         if not video_path:
             return jsonify({"success": False, "error": "No video path provided"}), 400
         
-        # If the path is a URL, download the video first
+        # If the path is a URL, download the video first, or while it is
+        # analyzed when its container can be decoded as it arrives
+        download = None
+        video_hash = None
+        follow_download = None
         if video_path.startswith('http'):
-            # Download logic here
-            pass
+            try:
+                download = open_download(video_path, bool(data.get('refresh', False)))
+            except DownloadError as e:
+                return jsonify({"success": False, "error": str(e)}), 400
+            
+            deadline = time.monotonic() + REQUEST_TIMEOUT_SECONDS
+            streaming = False
+            if download.wait(STREAM_START_BYTES, timeout=REQUEST_TIMEOUT_SECONDS) \
+                    and not download.complete and download.error is None:
+                streaming = streamable(download.head(STREAM_START_BYTES))
+            if not streaming:
+                download.wait(timeout=max(deadline - time.monotonic(), 0))
+            if download.error is not None:
+                return jsonify({"success": False, "error": download.error}), 502
+            if not streaming and not download.complete:
+                # The download carries on; asking again joins it
+                return jsonify({"success": False,
+                                "error": "The video is still downloading, try again later"}), \
+                    504, {"Retry-After": "30"}
+            
+            video_path = download.path
+            if download.complete:
+                video_hash = download.video_hash
+            else:
+                follow_download = download.meta_path
+                logger.info(f"Analyzing {download.url} while it downloads")
         else:
             # If it's a path to a local file, ensure it's in the upload folder
             video_path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(video_path))
         
         # Get processing options
         skeleton_mode = data.get('skeletonMode', False)
+        try:
+            joints = parse_joints(data.get('joints'))
+            workers = parse_workers(data.get('workers'))
+            inference = parse_inference(data)
+            spill = parse_spill(data.get('spill', False), inference)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        
+        # Return a stored result if this file was analyzed before; a video
+        # still downloading is hashed once it is complete
+        store_result = None
+        if (follow_download or os.path.isfile(video_path)) and not spill:
+            options = cache_options(skeleton_mode, False, joints, inference)
+            if follow_download is None:
+                video_hash = video_hash or hash_file(video_path)
+                cached = result_cache.get(make_key(video_hash, options))
+                if cached is not None:
+                    return jsonify({**cached, "cached": True})
+            
+            def store_result(result):
+                content_hash = video_hash or hash_file(video_path)
+                result_cache.put(make_key(content_hash, options), content_hash, result,
+                                 [os.path.basename(video_path), landmarks_filename])
+        
+        # Queue the video for analysis
+        result_extras = {}
+        if download is not None:
+            result_extras["original_video"] = f"/api/videos/{os.path.basename(video_path)}"
+        spill_options = {"spill_path": new_spill_path(result_extras)} if spill else {}
+        landmarks_filename = None
+        if not inference.get("multi_person"):
+            spill_options["landmarks_path"] = new_landmarks_path(result_extras,
+                                                                 spill_options.get("spill_path"))
+            landmarks_filename = os.path.basename(spill_options["landmarks_path"])
+        try:
+            job_id = job_manager.submit(video_path, None, result_extras=result_extras,
+                                        on_success=store_result,
+                                        timings=bool(data.get('timings', False)),
+                                        skeleton_mode=skeleton_mode,
+                                        joints=joints, workers=workers,
+                                        follow_upload=follow_download,
+                                        **spill_options, **inference)
+        except QueueFullError as e:
+            logger.warning(f"Rejected analysis, job queue is full: {str(e)}")
+            return jsonify({"success": False, "error": str(e)}), 503, {"Retry-After": "30"}
+        
+        # Return the job id right away if the client will poll for the result
+        if data.get('async', False):
+            return jsonify(job_accepted(job_id, result_extras)), 202
         
-        # Process the video
-        result = process_video(video_path, None, skeleton_mode)
+        pending = wait_for_job(job_id, result_extras)
+        if pending:
+            return pending
+        job = job_manager.get(job_id)
+        if job["status"] != "completed":
+            return jsonify({"success": False, "error": job["error"], "job_id": job_id}), 500
         
-        return jsonify(result)
+        return jsonify(job["result"])
     
     except Exception as e:
         logger.error(f"Error in analyze_video: {str(e)}")
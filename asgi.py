@@ -0,0 +1,307 @@
+"""
+ASGI entry point: serve the app from an event loop.
+
+    uvicorn asgi:application --timeout-graceful-shutdown 60
+
+Connections are accepted, read and written by the event loop, and each request
+runs the Flask app on a thread (the WSGI app is bridged here rather than
+rewritten). Requests that can take a long time, such as uploads, analyses that
+wait for their result and angle event streams, get a thread pool of their own
+(LONG_REQUEST_THREADS). However many of them are open, pages, videos and
+status polls are served from the other pool (REQUEST_THREADS) without queuing
+behind them. The analyses themselves run on the job worker processes
+(jobs.py) in both serving modes.
+
+Request bodies are handed to the app as it reads them and responses are sent
+as the app produces them, so uploads and event streams aren't buffered.
+
+When a client disconnects mid-request, the event under app.DISCONNECTED_KEY
+in the WSGI environ is set. A request waiting for an analysis then cancels it,
+and a response still being produced is closed. A request that hasn't started
+its response REQUEST_TIMEOUT_SECONDS (plus RESPONSE_GRACE_SECONDS) after it
+arrived gets a 504.
+
+On shutdown, once the server has stopped accepting connections and the open
+requests are done, the job manager stops taking jobs. It waits up to
+SHUTDOWN_DRAIN_SECONDS for the queued and running ones and cancels the rest.
+
+Job state lives in this process, so run one server process and scale with
+JOB_WORKERS.
+"""
+
+import asyncio
+import io
+import logging
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.wsgi import FileWrapper
+
+from app import app, job_manager, DISCONNECTED_KEY, REQUEST_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Threads running short requests and long ones (see _LONG_REQUESTS)
+REQUEST_THREADS = int(os.environ.get("REQUEST_THREADS", 32))
+LONG_REQUEST_THREADS = int(os.environ.get("LONG_REQUEST_THREADS", 64))
+
+# Extra time a request gets past REQUEST_TIMEOUT_SECONDS to send its own
+# timeout response before the server answers with a 504
+RESPONSE_GRACE_SECONDS = 30
+
+# Seconds shutdown waits for queued and running analyses before cancelling them
+SHUTDOWN_DRAIN_SECONDS = int(os.environ.get("SHUTDOWN_DRAIN_SECONDS", 5 * 60))
+
+# Bytes read per chunk of a file response (WSGI servers default to 8 KB)
+FILE_CHUNK_BYTES = 256 * 1024
+
+# Requests that can wait on an analysis, stream for a long time or carry a
+# large body, by method and path
+_LONG_REQUESTS = [
+    ("POST", re.compile(r"/api/(upload|analyze|uploads/[^/]+/complete)")),
+    ("PATCH", re.compile(r"/api/uploads/[^/]+")),
+    ("GET", re.compile(r"/api/jobs/[^/]+/stream")),
+]
+
+
+class _FileWrapper(FileWrapper):
+    # Send files in larger chunks: each one is a hop to the event loop
+    def __init__(self, file, buffer_size=8192):
+        super().__init__(file, max(buffer_size, FILE_CHUNK_BYTES))
+
+
+class _RequestBody(io.RawIOBase):
+    """
+    The request body as a blocking stream for the app's thread.
+
+    Each read waits for the next chunk from the event loop, so the body is
+    never held in memory as a whole.
+
+    Args:
+        receive: The ASGI receive callable
+        loop: The event loop serving the request
+        disconnected: Event to set if the client goes away
+        on_end: Called (on the loop) once the whole body has been read
+    """
+
+    def __init__(self, receive, loop, disconnected, on_end):
+        self._receive = receive
+        self._loop = loop
+        self._disconnected = disconnected
+        self._on_end = on_end
+        self._chunk = memoryview(b"")
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk and not self._done:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message["type"] == "http.disconnect":
+                self._done = True
+                self._disconnected.set()
+                raise ClientDisconnected()
+            self._chunk = memoryview(message.get("body", b""))
+            if not message.get("more_body", False):
+                self._done = True
+                self._loop.call_soon_threadsafe(self._on_end)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+class WsgiBridge:
+    """
+    ASGI application running a WSGI app on thread pools.
+
+    Args:
+        wsgi_app: The WSGI application
+        jobs: JobManager drained on shutdown
+    """
+
+    def __init__(self, wsgi_app, jobs):
+        self.wsgi_app = wsgi_app
+        self.jobs = jobs
+        self._executor = ThreadPoolExecutor(REQUEST_THREADS, thread_name_prefix="request")
+        self._long_executor = ThreadPoolExecutor(LONG_REQUEST_THREADS,
+                                                 thread_name_prefix="long-request")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self._http(scope, receive, send)
+        elif scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+
+    async def _lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                logger.info("Draining analysis jobs before shutting down")
+                cancelled = await loop.run_in_executor(None, self.jobs.drain,
+                                                       SHUTDOWN_DRAIN_SECONDS)
+                if cancelled:
+                    logger.warning(f"Cancelled {cancelled} jobs that didn't finish in time")
+                self._executor.shutdown(wait=False)
+                self._long_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _is_long(self, scope):
+        return any(scope["method"] == method and pattern.fullmatch(scope["path"])
+                   for method, pattern in _LONG_REQUESTS)
+
+    async def _http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        disconnected = threading.Event()
+        watcher = None
+
+        def watch_disconnect():
+            # Once the body has been read, the next message is the disconnect
+            nonlocal watcher
+
+            async def watch():
+                while (await receive())["type"] != "http.disconnect":
+                    pass
+                disconnected.set()
+
+            watcher = loop.create_task(watch())
+
+        headers = dict(scope["headers"])
+        if headers.get(b"content-length", b"0") == b"0" and b"transfer-encoding" not in headers:
+            # No body: consume the empty request message and start watching
+            await receive()
+            body = io.BytesIO()
+            watch_disconnect()
+        else:
+            body = io.BufferedReader(_RequestBody(receive, loop, disconnected, watch_disconnect))
+
+        # The response may only be started once, by the app or by the timeout
+        state = {"started": False, "timed_out": False}
+        lock = threading.Lock()
+        started = asyncio.Event()
+
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            environ = self._environ(scope, body, disconnected)
+            response = {}
+
+            def start_response(status, response_headers, exc_info=None):
+                response["status"] = int(status.split(" ", 1)[0])
+                response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                       for name, value in response_headers]
+
+            def start():
+                with lock:
+                    if state["timed_out"]:
+                        return False
+                    state["started"] = True
+                loop.call_soon_threadsafe(started.set)
+                send_sync({"type": "http.response.start", "status": response["status"],
+                           "headers": response["headers"]})
+                return True
+
+            iterable = self.wsgi_app(environ, start_response)
+            try:
+                sending = None
+                for chunk in iterable:
+                    # Stop producing a response nobody will receive
+                    if disconnected.is_set():
+                        return
+                    if not chunk:
+                        continue
+                    if sending is None:
+                        sending = start()
+                    if not sending:
+                        return
+                    send_sync({"type": "http.response.body", "body": chunk, "more_body": True})
+                if sending is None:
+                    sending = start()
+                if sending and not disconnected.is_set():
+                    send_sync({"type": "http.response.body", "body": b"", "more_body": False})
+            finally:
+                if hasattr(iterable, "close"):
+                    iterable.close()
+
+        executor = self._long_executor if self._is_long(scope) else self._executor
+        worker = loop.run_in_executor(executor, run)
+        try:
+            waiter = loop.create_task(started.wait())
+            await asyncio.wait({worker, waiter}, timeout=REQUEST_TIMEOUT_SECONDS + RESPONSE_GRACE_SECONDS,
+                               return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            with lock:
+                timed_out = state["timed_out"] = not state["started"] and not worker.done()
+            if timed_out:
+                logger.warning(f"{scope['method']} {scope['path']} timed out")
+                await self._send_error(send, 504, b"Request timed out")
+                return
+            await worker
+        except Exception as e:
+            logger.error(f"Error serving {scope['method']} {scope['path']}: {str(e)}")
+            if not state["started"] and not disconnected.is_set():
+                await self._send_error(send, 500, b"Internal server error")
+        finally:
+            if watcher:
+                watcher.cancel()
+
+    async def _send_error(self, send, status, text):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"text/plain"),
+                                (b"content-length", str(len(text)).encode())]})
+        await send({"type": "http.response.body", "body": text})
+
+    def _environ(self, scope, body, disconnected):
+        # Build the WSGI environ of a request (PEP 3333)
+        server = scope.get("server") or ("localhost", 80)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope["query_string"].decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.input_terminated": True,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+            "wsgi.file_wrapper": _FileWrapper,
+            DISCONNECTED_KEY: disconnected,
+        }
+        if scope.get("client"):
+            environ["REMOTE_ADDR"] = scope["client"][0]
+        for name, value in scope["headers"]:
+            name, value = name.decode("latin-1"), value.decode("latin-1")
+            if name == "content-type":
+                environ["CONTENT_TYPE"] = value
+            elif name == "content-length":
+                environ["CONTENT_LENGTH"] = value
+            else:
+                key = "HTTP_" + name.upper().replace("-", "_")
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+
+application = WsgiBridge(app, job_manager)
+
+# Start the server
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(application, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)),
+                timeout_graceful_shutdown=SHUTDOWN_DRAIN_SECONDS)
@@ -0,0 +1,241 @@
+"""
+Batch analysis of many videos from the command line.
+
+Takes a directory (searched recursively) or a manifest file listing one video
+per line, and analyzes the videos on a pool of worker processes, one video per
+process at a time, using the same process_video core as the server. Each video
+gets an .npz angle file (see columnar.py) in the output directory, and
+index.json there summarizes every video of the batch.
+
+Angle files are written atomically, so after a crash or interruption running
+the same command again skips the videos that were finished and only processes
+the rest.
+
+Usage: python batch.py <directory or manifest> <output directory> [options]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import processing
+from angles import validate_joints
+from profiles import PROFILES, validate_profile
+
+# File extensions picked up when scanning a directory
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.webm', '.mkv'}
+
+INDEX_FILENAME = "index.json"
+
+
+def find_videos(source):
+    """
+    List the videos of a batch.
+
+    Args:
+        source: A directory to scan recursively, or a manifest file with one
+            path per line (blank lines and lines starting with # are skipped;
+            relative paths are relative to the manifest)
+
+    Returns:
+        A sorted list of (video path, output name) tuples; the output name is
+        unique within the batch
+    """
+    if os.path.isdir(source):
+        paths = [os.path.join(root, name)
+                 for root, _, names in os.walk(source) for name in names
+                 if os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS]
+        base = source
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source) as f:
+            lines = [line.strip() for line in f]
+        paths = [os.path.join(base, line) for line in lines if line and not line.startswith("#")]
+
+    videos = []
+    for path in sorted(set(paths)):
+        relative = os.path.relpath(path, base)
+        if relative.startswith(os.pardir):
+            relative = os.path.abspath(path).lstrip(os.sep)
+        # Flatten the relative path so videos with the same name don't clash
+        name = os.path.splitext(relative)[0].replace(os.sep, "__")
+        videos.append((path, name))
+    return videos
+
+
+def _analyze(video_path, output_path, options):
+    # Runs in a worker process; writes the angle file and returns its summary
+    start = time.perf_counter()
+    result = processing.process_video(video_path, **options)
+    seconds = time.perf_counter() - start
+    if not result.get("success"):
+        return {"status": "failed", "error": result.get("error"), "seconds": seconds}
+
+    temp_path = output_path + ".tmp.npz"
+    result["columns"].save(temp_path)
+    os.replace(temp_path, output_path)
+    info = result["video_info"]
+    return {
+        "status": "done",
+        "frames": len(result["columns"]),
+        "detected_frames": int(result["columns"].detected.sum()),
+        "fps": info["fps"],
+        "duration": info["duration"],
+        "seconds": seconds
+    }
+
+
+def _write_index(output_dir, entries, totals):
+    path = os.path.join(output_dir, INDEX_FILENAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"videos": entries, "totals": totals}, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def run_batch(source, output_dir, workers=None, force=False, **options):
+    """
+    Analyze every video of a batch that doesn't have an angle file yet.
+
+    Args:
+        source: Directory or manifest, as for find_videos
+        output_dir: Directory for the angle files and index.json
+        workers: Worker processes (default: one per core)
+        force: Reprocess videos that already have an angle file
+        **options: Keyword arguments passed through to process_video
+
+    Returns:
+        The totals written to index.json
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    videos = find_videos(source)
+
+    # Keep what an earlier (possibly interrupted) run recorded
+    previous = {}
+    index_path = os.path.join(output_dir, INDEX_FILENAME)
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            previous = {entry["output"]: entry for entry in json.load(f)["videos"]}
+
+    entries = {}
+    pending = []
+    for video_path, name in videos:
+        output = f"{name}.npz"
+        if not force and os.path.exists(os.path.join(output_dir, output)):
+            entries[output] = previous.get(output, {"video": video_path, "output": output,
+                                                    "status": "done"})
+        else:
+            entries[output] = {"video": video_path, "output": output, "status": "pending"}
+            pending.append((video_path, output))
+
+    print(f"{len(videos)} videos, {len(videos) - len(pending)} already done, "
+          f"{len(pending)} to process")
+
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    frames = 0
+    processed = 0
+    failed = 0
+
+    def totals():
+        elapsed = time.perf_counter() - start
+        return {
+            "videos": len(videos),
+            "processed": processed,
+            "failed": failed,
+            "skipped": len(videos) - len(pending),
+            "frames": frames,
+            "wall_seconds": elapsed,
+            "frames_per_second": frames / elapsed if elapsed > 0 else None,
+            "videos_per_hour": processed / elapsed * 3600 if elapsed > 0 else None,
+            "workers": workers,
+            "options": options
+        }
+
+    _write_index(output_dir, list(entries.values()), totals())
+    if pending:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {executor.submit(_analyze, video_path,
+                                       os.path.join(output_dir, output), options): output
+                       for video_path, output in pending}
+            for future in as_completed(futures):
+                output = futures[future]
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    summary = {"status": "failed", "error": str(e)}
+                entries[output].update(summary)
+                if summary["status"] == "done":
+                    processed += 1
+                    frames += summary["frames"]
+                    print(f"[{processed + failed}/{len(pending)}] {entries[output]['video']}: "
+                          f"{summary['frames']} frames in {summary['seconds']:.1f}s")
+                else:
+                    failed += 1
+                    print(f"[{processed + failed}/{len(pending)}] {entries[output]['video']} "
+                          f"failed: {summary['error']}")
+                _write_index(output_dir, list(entries.values()), totals())
+
+    result = totals()
+    _write_index(output_dir, list(entries.values()), result)
+    if result["frames_per_second"] and processed:
+        print(f"Processed {processed} videos ({frames} frames) in {result['wall_seconds']:.1f}s: "
+              f"{result['frames_per_second']:.1f} frames/sec, "
+              f"{result['videos_per_hour']:.0f} videos/hour")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a directory or manifest of videos.")
+    parser.add_argument("source", help="directory of videos or manifest file")
+    parser.add_argument("output", help="directory for the angle files and index.json")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--profile", choices=list(PROFILES), default=None,
+                        help="processing profile (see profiles.py)")
+    parser.add_argument("--joints", default=None,
+                        help="comma-separated joints to measure (default: elbows, "
+                             "shoulders and knees)")
+    parser.add_argument("--max-dimension", type=int, default=None,
+                        help="longest side of the frames given to the model")
+    parser.add_argument("--sample-fps", type=float, default=None,
+                        help="run pose detection at this rate and interpolate")
+    parser.add_argument("--adaptive-sampling", action="store_true",
+                        help="sample more often when the subject moves fast")
+    parser.add_argument("--roi", action="store_true",
+                        help="crop frames around the subject before inference")
+    parser.add_argument("--force", action="store_true",
+                        help="reprocess videos that already have an angle file")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.source):
+        print(f"Error: {args.source} not found")
+        return 1
+
+    options = {"profile": validate_profile(args.profile)}
+    if args.joints:
+        try:
+            options["joints"] = list(validate_joints(
+                [name.strip() for name in args.joints.split(",") if name.strip()]))
+        except ValueError as e:
+            parser.error(str(e))
+    if args.max_dimension:
+        options["max_dimension"] = args.max_dimension
+    if args.sample_fps:
+        options["sample_fps"] = args.sample_fps
+    if args.adaptive_sampling:
+        options["adaptive_sampling"] = True
+    if args.roi:
+        options["roi"] = True
+
+    result = run_batch(args.source, args.output, workers=args.workers, force=args.force,
+                       **options)
+    return 1 if result["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
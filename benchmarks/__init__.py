@@ -0,0 +1 @@
+"""Performance benchmarks. Run them from the repository root with `python -m benchmarks.<name>`."""
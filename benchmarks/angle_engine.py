@@ -0,0 +1,89 @@
+"""
+Micro-benchmark of the vectorized angle engine against the scalar path.
+
+The scalar path is what process_video used to do per frame: build [x, y] lists
+for each landmark and call calculate_angle once per joint. The vectorized path
+copies landmarks into a LandmarkBuffer and computes all angles in one pass.
+
+Usage: python -m benchmarks.angle_engine [num_frames]
+"""
+
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from angles import AngleEngine, LandmarkBuffer, JOINTS, DEFAULT_JOINTS, NUM_LANDMARKS
+from processing import calculate_angle
+
+
+def make_frames(num_frames, seed=0):
+    """Create synthetic MediaPipe-like pose_landmarks objects."""
+    rng = np.random.default_rng(seed)
+    values = rng.random((num_frames, NUM_LANDMARKS, 4))
+    frames = []
+    for frame in values.tolist():
+        landmark = [SimpleNamespace(x=x, y=y, z=z, visibility=v) for x, y, z, v in frame]
+        frames.append(SimpleNamespace(landmark=landmark))
+    return frames
+
+
+def run_scalar(frames, joints):
+    # One calculate_angle call per joint per frame, as in the original loop
+    triples = [(name, JOINTS[name]) for name in joints]
+    angle_data = []
+    for frame_idx, pose_landmarks in enumerate(frames):
+        landmarks = pose_landmarks.landmark
+        frame_angles = {"timestamp": frame_idx / 30.0}
+        for name, (a, b, c) in triples:
+            frame_angles[name] = calculate_angle([landmarks[a].x, landmarks[a].y],
+                                                 [landmarks[b].x, landmarks[b].y],
+                                                 [landmarks[c].x, landmarks[c].y])
+        angle_data.append(frame_angles)
+    return angle_data
+
+
+def run_vectorized(frames, joints):
+    engine = AngleEngine(joints)
+    buffer = LandmarkBuffer(len(frames))
+    for pose_landmarks in frames:
+        buffer.append(pose_landmarks)
+    landmarks = buffer.view()[0]
+    angles = engine.compute(landmarks)
+    return engine.to_frame_dicts(angles, np.arange(len(landmarks)) / 30.0)
+
+
+def best_of(fn, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    num_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    frames = make_frames(num_frames)
+    limb_joints = tuple(name for name in JOINTS if name not in ("leftTrunk", "rightTrunk"))
+
+    print(f"{num_frames} frames")
+    for label, joints in (("default joints", DEFAULT_JOINTS),
+                          ("limb joints", limb_joints)):
+        scalar = best_of(run_scalar, frames, joints)
+        vectorized = best_of(run_vectorized, frames, joints)
+        print(f"{label:>15}: scalar {scalar / num_frames * 1e6:8.2f} us/frame, "
+              f"vectorized {vectorized / num_frames * 1e6:8.2f} us/frame, "
+              f"speedup {scalar / vectorized:5.1f}x")
+
+    # Check that both paths agree
+    scalar = run_scalar(frames[:100], DEFAULT_JOINTS)
+    vectorized = run_vectorized(frames[:100], DEFAULT_JOINTS)
+    max_diff = max(abs(s[name] - v[name]) for s, v in zip(scalar, vectorized)
+                   for name in DEFAULT_JOINTS)
+    print(f"max difference: {max_diff:.2e} degrees")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Measure the downscaled inference path on a high-resolution clip.
+
+The first seconds of the input video are upscaled to 4K into a temporary file,
+which is then analyzed at full resolution and with frames scaled to
+max_dimension, both with and without annotated output. Reports frames/sec, the
+busy time of the decode and inference stages and the angle deviation from the
+full-resolution run.
+
+Usage: python -m benchmarks.downscale [video_path] [max_dimension] [seconds]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import processing
+
+# Resolution of the synthetic clip
+WIDTH, HEIGHT = 3840, 2160
+
+
+def make_clip(video_path, path, seconds):
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (WIDTH, HEIGHT))
+    for _ in range(int(seconds * fps)):
+        success, frame = cap.read()
+        if not success:
+            break
+        # Letterbox the frame so its aspect ratio (and so its angles) is kept
+        scale = min(WIDTH / frame.shape[1], HEIGHT / frame.shape[0])
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+        canvas = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+        top = (HEIGHT - frame.shape[0]) // 2
+        left = (WIDTH - frame.shape[1]) // 2
+        canvas[top:top + frame.shape[0], left:left + frame.shape[1]] = frame
+        out.write(canvas)
+    cap.release()
+    out.release()
+
+
+def main():
+    video_path = sys.argv[1] if len(sys.argv) > 1 else "input_video.mp4"
+    max_dimension = int(sys.argv[2]) if len(sys.argv) > 2 else 640
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 3.0
+
+    with tempfile.TemporaryDirectory() as directory:
+        clip = os.path.join(directory, "clip_4k.mp4")
+        make_clip(video_path, clip, seconds)
+
+        runs = [("full", None, False), ("scaled", max_dimension, False),
+                ("full+video", None, True), ("scaled+video", max_dimension, True)]
+        baseline = None
+        print(f"{'run':<14} {'scaled by':>9} {'fps':>6} {'decode s':>9} "
+              f"{'inference s':>12} {'mean dev':>9}")
+        for name, dimension, annotated in runs:
+            output_path = os.path.join(directory, f"{name}.avi") if annotated else None
+            start = time.perf_counter()
+            result = processing.process_video(clip, output_path, max_dimension=dimension)
+            elapsed = time.perf_counter() - start
+            angles = result["columns"].angles
+            if baseline is None:
+                baseline = angles
+            deviation = np.abs(angles - baseline)
+            deviation = deviation[np.isfinite(deviation)]
+            stages = result["pipeline"]["stages"]
+            print(f"{name:<14} {str(result['profile']['scaled_by']):>9} "
+                  f"{len(result['data']) / elapsed:>6.1f} "
+                  f"{stages['decode']['busy_seconds']:>9.2f} "
+                  f"{stages['inference']['busy_seconds']:>12.2f} "
+                  f"{deviation.mean() if deviation.size else float('nan'):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Micro-benchmark of the overlay renderer against the per-frame drawing it replaced.
+
+The reference path is what the annotate stage used to do per frame: build new
+MediaPipe DrawingSpecs, draw the landmark proto with draw_landmarks and the
+labels, arcs and timestamp through a nested helper, after blacking out the
+whole frame in skeleton mode. The renderer path draws with an OverlayRenderer
+made once, and in skeleton mode clears only the rectangle it drew last time on
+the buffer. Landmarks come from one analysis of the video; frames are drawn at
+the video's size and scaled up to 1080p and 4K. Reports the annotate time per
+frame of both paths and checks that every frame they draw is identical.
+
+Usage: python -m benchmarks.overlay [video_path] [num_frames]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import zlib
+
+import cv2
+import numpy as np
+import mediapipe as mp
+from mediapipe.framework.formats import landmark_pb2
+
+import processing
+from angles import AngleEngine, JOINT_LABELS
+from landmark_store import LandmarkReader
+from overlay import OverlayRenderer
+
+mp_pose = mp.solutions.pose
+mp_drawing = mp.solutions.drawing_utils
+
+SIZES = [None, (1920, 1080), (3840, 2160)]
+
+
+def draw_reference(frame, pose_landmarks, names, angles, vertices, timestamp, skeleton_mode):
+    # The previous draw_overlay
+    height, width = frame.shape[:2]
+    if skeleton_mode:
+        landmark_spec = mp_drawing.DrawingSpec(color=(0, 255, 0), thickness=5, circle_radius=5)
+        connection_spec = mp_drawing.DrawingSpec(color=(255, 255, 255), thickness=3)
+    else:
+        landmark_spec = mp_drawing.DrawingSpec(color=(0, 0, 255), thickness=3, circle_radius=3)
+        connection_spec = mp_drawing.DrawingSpec(color=(0, 255, 0), thickness=2)
+    mp_drawing.draw_landmarks(image=frame, landmark_list=pose_landmarks,
+                              connections=mp_pose.POSE_CONNECTIONS,
+                              landmark_drawing_spec=landmark_spec,
+                              connection_drawing_spec=connection_spec)
+
+    def draw_angle(frame, point, angle, joint_name):
+        x = int(point[0] * width)
+        y = int(point[1] * height)
+        if 0 <= x < width and 0 <= y < height:
+            text = f"{joint_name}: {angle:.1f}°"
+            if not skeleton_mode:
+                cv2.putText(frame, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                            (0, 0, 0), 4, cv2.LINE_AA)
+            cv2.putText(frame, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                        (255, 255, 255), 2, cv2.LINE_AA)
+            cv2.ellipse(frame, (x, y), (30, 30), 0, 0, angle, (0, 255, 0), 2, cv2.LINE_AA)
+
+    for name, point, angle in zip(names, vertices, angles):
+        if np.isfinite(angle):
+            draw_angle(frame, point, angle, JOINT_LABELS[name])
+    time_text = f"Time: {timestamp:.2f}s"
+    if not skeleton_mode:
+        cv2.putText(frame, time_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1,
+                    (0, 0, 0), 4, cv2.LINE_AA)
+    cv2.putText(frame, time_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1,
+                (255, 255, 255), 2, cv2.LINE_AA)
+
+
+def to_proto(row):
+    landmarks = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z, visibility in row.tolist():
+        landmarks.landmark.add(x=x, y=y, z=z, visibility=visibility)
+    return landmarks
+
+
+def read_frames(video_path, indices):
+    cap = cv2.VideoCapture(video_path)
+    frames = {}
+    index = 0
+    while len(frames) < len(indices):
+        success, frame = cap.read()
+        if not success:
+            break
+        if index in indices:
+            frames[index] = frame
+        index += 1
+    cap.release()
+    return [frames[i] for i in indices if i in frames]
+
+
+def scaled(frames, size):
+    for frame in frames:
+        yield frame if size is None else cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR)
+
+
+def run_reference(frames, size, annotations, skeleton_mode):
+    buffer = None
+    elapsed = 0.0
+    checksums = []
+    for picture, (proto, row, angles, vertices, timestamp) in zip(scaled(frames, size),
+                                                                  annotations):
+        if buffer is None:
+            buffer = np.empty_like(picture)
+        buffer[:] = picture
+        start = time.perf_counter()
+        if skeleton_mode:
+            buffer.fill(0)
+        draw_reference(buffer, proto, annotations.names, angles, vertices, timestamp,
+                       skeleton_mode)
+        elapsed += time.perf_counter() - start
+        checksums.append(zlib.crc32(buffer))
+    return elapsed, checksums
+
+
+def run_renderer(frames, size, annotations, skeleton_mode):
+    renderer = OverlayRenderer(skeleton_mode)
+    buffer = None
+    dirty = None
+    elapsed = 0.0
+    checksums = []
+    for picture, (proto, row, angles, vertices, timestamp) in zip(scaled(frames, size),
+                                                                  annotations):
+        if buffer is None:
+            buffer = np.zeros_like(picture)
+        # Skeleton frames are drawn on a blank buffer, as when re-rendering
+        if not skeleton_mode:
+            buffer[:] = picture
+        start = time.perf_counter()
+        if skeleton_mode and dirty:
+            renderer.clear(buffer, dirty)
+        dirty = renderer.draw(buffer, row, annotations.names, angles, vertices, timestamp)
+        elapsed += time.perf_counter() - start
+        checksums.append(zlib.crc32(buffer))
+    return elapsed, checksums
+
+
+class Annotations(list):
+    names = ()
+
+
+def main():
+    video_path = sys.argv[1] if len(sys.argv) > 1 else "input_video.mp4"
+    num_frames = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    with tempfile.TemporaryDirectory() as directory:
+        landmarks_path = os.path.join(directory, "clip.landmarks")
+        result = processing.process_video(video_path, profile="fast",
+                                          landmarks_path=landmarks_path)
+        if not result.get("success"):
+            raise SystemExit(result.get("error"))
+        reader = LandmarkReader(landmarks_path)
+        engine = AngleEngine()
+        landmarks = np.array(reader.landmarks)
+
+    angles = engine.compute(landmarks)
+    vertices = engine.vertices(landmarks)
+    indices = [i for i in np.flatnonzero(~np.isnan(landmarks[:, 0, 0]))[:num_frames]]
+    annotations = Annotations((to_proto(landmarks[i]), landmarks[i], angles[i], vertices[i],
+                               i / reader.fps) for i in indices)
+    annotations.names = engine.names
+    originals = read_frames(video_path, indices)
+
+    print(f"{len(annotations)} frames with a pose")
+    print(f"{'size':>10} {'mode':>9} {'reference':>12} {'renderer':>12} {'speedup':>8} {'identical':>9}")
+    count = len(originals)
+    for size in SIZES:
+        width, height = size or originals[0].shape[1::-1]
+        for skeleton_mode in (False, True):
+            reference, expected = run_reference(originals, size, annotations, skeleton_mode)
+            rendered, actual = run_renderer(originals, size, annotations, skeleton_mode)
+            print(f"{width:>5}x{height:<4} {'skeleton' if skeleton_mode else 'normal':>9} "
+                  f"{reference / count * 1e3:9.3f} ms {rendered / count * 1e3:9.3f} ms "
+                  f"{reference / rendered:7.1f}x {str(expected == actual):>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Compare segment-parallel processing against the serial path.
+
+Reports wall time for both paths and how far the parallel angles deviate from
+the serial ones, overall and in the frames right after each segment boundary
+where the warm-up overlap matters.
+
+Usage: python -m benchmarks.parallel_segments [video_path] [workers] [overlap_seconds]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+import parallel
+import processing
+from angles import DEFAULT_JOINTS
+
+# Frames after a segment boundary that count as "near the boundary"
+BOUNDARY_WINDOW = 15
+
+# Angles within this many degrees of the serial path count as matching
+TOLERANCE_DEGREES = 5.0
+
+
+def angle_matrix(result):
+    return np.array([[frame.get(name, np.nan) for name in DEFAULT_JOINTS]
+                     for frame in result["data"]])
+
+
+def main():
+    video_path = sys.argv[1] if len(sys.argv) > 1 else "input_video.mp4"
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    overlap = float(sys.argv[3]) if len(sys.argv) > 3 else parallel.DEFAULT_OVERLAP_SECONDS
+
+    start = time.perf_counter()
+    serial = processing.process_video(video_path)
+    serial_time = time.perf_counter() - start
+
+    # Warm the segment pool first so model loading isn't counted
+    parallel.process_video_parallel(video_path, workers=workers, overlap_seconds=overlap)
+    start = time.perf_counter()
+    result = parallel.process_video_parallel(video_path, workers=workers,
+                                             overlap_seconds=overlap)
+    parallel_time = time.perf_counter() - start
+
+    serial_angles = angle_matrix(serial)
+    parallel_angles = angle_matrix(result)
+    deviation = np.abs(serial_angles - parallel_angles)
+
+    info = serial["video_info"]
+    segments = parallel.plan_segments(info["frame_count"], info["fps"], workers, overlap)
+    boundary_rows = [row for _, seg_start, _ in segments[1:]
+                     for row in range(seg_start, min(seg_start + BOUNDARY_WINDOW, len(deviation)))]
+
+    print(f"frames: {len(serial_angles)} (parallel: {len(parallel_angles)}), "
+          f"segments: {result['segments']}, overlap: {overlap}s")
+    print(f"serial {serial_time:.2f}s, parallel {parallel_time:.2f}s, "
+          f"speedup {serial_time / parallel_time:.2f}x")
+    print(f"max deviation: {np.nanmax(deviation):.3f} deg, "
+          f"mean: {np.nanmean(deviation):.4f} deg")
+    within = np.mean(np.nan_to_num(deviation, nan=0.0) <= TOLERANCE_DEGREES) * 100
+    print(f"angles within {TOLERANCE_DEGREES} deg of serial: {within:.1f}%")
+    if boundary_rows:
+        print(f"max deviation near boundaries: {np.nanmax(deviation[boundary_rows]):.3f} deg")
+
+
+if __name__ == "__main__":
+    main()
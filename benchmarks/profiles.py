@@ -0,0 +1,61 @@
+"""
+Compare the processing profiles on speed and angle accuracy.
+
+Every profile analyzes the same clip (angles only, no annotated output) with a
+warm pose detector, so model loading isn't counted. Frames/sec is measured end
+to end; angle deviation is taken against the accurate profile, over the frames
+where both found the joint.
+
+Usage: python -m benchmarks.profiles [video_path] [profile ...]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+import processing
+from profiles import PROFILES
+
+# Profile the others are compared against
+BASELINE = "accurate"
+
+
+def run(video_path, profile):
+    with processing.create_pose(profile) as pose:
+        start = time.perf_counter()
+        result = processing.process_video(video_path, pose=pose, profile=profile)
+        elapsed = time.perf_counter() - start
+    if not result.get("success"):
+        raise RuntimeError(f"{profile}: {result.get('error')}")
+    return result, elapsed
+
+
+def main():
+    video_path = sys.argv[1] if len(sys.argv) > 1 else "input_video.mp4"
+    names = sys.argv[2:] or list(PROFILES)
+    if BASELINE not in names:
+        names.insert(0, BASELINE)
+
+    results = {name: run(video_path, name) for name in names}
+    baseline = results[BASELINE][0]["columns"].angles
+
+    print(f"{'profile':<10} {'input':>10} {'fps':>7} {'speedup':>8} "
+          f"{'detected':>9} {'mean dev':>9} {'p95 dev':>8}")
+    baseline_time = results[BASELINE][1]
+    for name in names:
+        result, elapsed = results[name]
+        frames = len(result["data"])
+        columns = result["columns"]
+        deviation = np.abs(columns.angles - baseline)
+        deviation = deviation[np.isfinite(deviation)]
+        mean = f"{deviation.mean():.2f}" if deviation.size else "n/a"
+        p95 = f"{np.percentile(deviation, 95):.2f}" if deviation.size else "n/a"
+        size = f"{result['profile']['inference_width']}x{result['profile']['inference_height']}"
+        print(f"{name:<10} {size:>10} {frames / elapsed:>7.1f} "
+              f"{baseline_time / elapsed:>7.2f}x {columns.detected.mean() * 100:>8.1f}% "
+              f"{mean:>9} {p95:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Compare ROI crops with full-frame inference on wide-angle footage.
+
+The input video is placed small on a larger gray frame (1080p by default),
+drifting across it so the crop has to follow, which stands in for a patient
+filmed by a wide-angle camera. Each profile analyzes the clip with and without
+roi (angles only, warm pose detector). Reports frames/sec, the inference time
+per frame, the speedup of roi over full frames, how many frames were cropped,
+fell back to the whole frame or moved the crop, how often the input switched
+between crops and whole frames, the mean share of the frame a crop covered and
+the angle deviation from the full-frame run.
+
+Usage: python -m benchmarks.roi [video_path] [width]x[height] [profile ...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import processing
+
+SIZE = (1920, 1080)
+PROFILES = ["fast", "accurate"]
+
+# Gray of the background around the subject
+BACKGROUND = 96
+
+
+def make_clip(video_path, path, size):
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    width, height = size
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    canvas = np.full((height, width, 3), BACKGROUND, dtype=np.uint8)
+    index = 0
+    while True:
+        success, frame = cap.read()
+        if not success:
+            break
+        # Move from the left third of the frame to the right third
+        top = (height - frame.shape[0]) // 2
+        left = int((width - frame.shape[1]) * (0.2 + 0.6 * index / max(frames - 1, 1)))
+        canvas[:] = BACKGROUND
+        canvas[top:top + frame.shape[0], left:left + frame.shape[1]] = frame
+        out.write(canvas)
+        index += 1
+    cap.release()
+    out.release()
+
+
+def run(clip, profile, roi):
+    with processing.create_pose(profile) as pose:
+        start = time.perf_counter()
+        result = processing.process_video(clip, pose=pose, profile=profile, roi=roi)
+        elapsed = time.perf_counter() - start
+    if not result.get("success"):
+        raise RuntimeError(f"{profile}: {result.get('error')}")
+    return result, elapsed
+
+
+def main():
+    video_path = sys.argv[1] if len(sys.argv) > 1 else "input_video.mp4"
+    size = tuple(int(n) for n in sys.argv[2].split("x")) if len(sys.argv) > 2 else SIZE
+    profiles = sys.argv[3:] or PROFILES
+
+    with tempfile.TemporaryDirectory() as directory:
+        clip = os.path.join(directory, "wide.mp4")
+        make_clip(video_path, clip, size)
+
+        print(f"{'profile':<9} {'mode':<5} {'fps':>6} {'infer ms':>9} {'speedup':>8} "
+              f"{'detected':>9} {'cropped':>8} {'fallback':>9} {'moved':>6} {'switch':>7} {'crop':>6} "
+              f"{'mean dev':>9} {'p95 dev':>8}")
+        for profile in profiles:
+            baseline = None
+            for roi in (False, True):
+                result, elapsed = run(clip, profile, roi)
+                frames = len(result["data"])
+                inference = result["pipeline"]["stages"]["inference"]
+                infer_ms = inference["busy_seconds"] / inference["frames"] * 1000
+                columns = result["columns"]
+                if baseline is None:
+                    baseline = (columns.angles, infer_ms)
+                    speedup, mean, p95 = "", "", ""
+                    stats = {"cropped_frames": "", "fallbacks": "", "recenters": "",
+                             "switches": ""}
+                    crop = ""
+                else:
+                    speedup = f"{baseline[1] / infer_ms:.2f}x"
+                    deviation = np.abs(columns.angles - baseline[0])
+                    deviation = deviation[np.isfinite(deviation)]
+                    mean = f"{deviation.mean():.2f}" if deviation.size else "n/a"
+                    p95 = f"{np.percentile(deviation, 95):.2f}" if deviation.size else "n/a"
+                    stats = result["roi"]
+                    crop = (f"{stats['mean_crop_fraction'] * 100:.0f}%"
+                            if stats["mean_crop_fraction"] is not None else "n/a")
+                print(f"{profile:<9} {'roi' if roi else 'full':<5} {frames / elapsed:>6.1f} "
+                      f"{infer_ms:>9.2f} {speedup:>8} {columns.detected.mean() * 100:>8.1f}% "
+                      f"{stats['cropped_frames']:>8} {stats['fallbacks']:>9} "
+                      f"{stats['recenters']:>6} {stats['switches']:>7} {crop:>6} {mean:>9} {p95:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Load test: latency of light requests while blocking analyses run.
+
+Starts the app in a subprocess under each serving mode:
+
+- asgi: uvicorn running asgi.py (event loop, analyses on the job workers)
+- sync: Werkzeug serving one request at a time, like a gunicorn sync worker
+- threaded: Werkzeug with a thread per request
+
+Analysis clients keep POSTing input_video.mp4 to /api/upload with wait=true,
+so each holds its request open for a whole analysis, while light clients
+request the page (GET /) and seek in the uploaded video (range requests on
+/api/videos). The result cache is disabled so every upload is analyzed.
+Reports p50, p95 and max latency of the light routes per mode, and the number
+of analyses finished.
+
+Usage: python -m benchmarks.serving [seconds] [analysis_clients] [light_clients] [modes]
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import numpy as np
+
+VIDEO_PATH = "input_video.mp4"
+MODES = ["asgi", "sync", "threaded"]
+PORT = 5077
+
+# Bytes requested per seek
+SEEK_BYTES = 256 * 1024
+
+
+def serve(mode, port):
+    # Run in the server subprocess
+    if mode == "asgi":
+        import uvicorn
+        uvicorn.run("asgi:application", host="127.0.0.1", port=port, log_level="warning")
+    else:
+        from werkzeug.serving import run_simple
+        import app as server
+        run_simple("127.0.0.1", port, server.app, threaded=mode == "threaded")
+
+
+def start_server(mode):
+    env = dict(os.environ, RESULT_CACHE_MAX_BYTES="0")
+    process = subprocess.Popen([sys.executable, "-m", "benchmarks.serving", "--serve", mode,
+                                str(PORT)], env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    for _ in range(300):
+        try:
+            request("GET", "/")
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"The {mode} server didn't start")
+
+
+def request(method, path, body=None, headers=None, timeout=600):
+    connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=timeout)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def upload_body(video, fields):
+    boundary = uuid.uuid4().hex
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+             .encode() for name, value in fields.items()]
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="video"; '
+                 f'filename="clip.mp4"\r\nContent-Type: video/mp4\r\n\r\n'.encode()
+                 + video + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+def analysis_client(video, stop, finished):
+    body, headers = upload_body(video, {"wait": "true"})
+    while not stop.is_set():
+        status, _ = request("POST", "/api/upload", body, headers)
+        if status == 200:
+            finished.append(time.perf_counter())
+
+
+def light_client(video_path, size, stop, latencies, seed):
+    rng = random.Random(seed)
+    while not stop.is_set():
+        if rng.random() < 0.5:
+            route, args = "page", ("GET", "/")
+        else:
+            offset = rng.randrange(0, size - SEEK_BYTES)
+            route, args = "video", ("GET", video_path, None,
+                                    {"Range": f"bytes={offset}-{offset + SEEK_BYTES - 1}"})
+        start = time.perf_counter()
+        status, _ = request(*args)
+        latencies[route].append(time.perf_counter() - start)
+        if status not in (200, 206):
+            raise RuntimeError(f"Unexpected status {status} for {route}")
+        time.sleep(0.05)
+
+
+def run(mode, video, seconds, analysis_clients, light_clients):
+    process = start_server(mode)
+    try:
+        # Store the upload and load a pose model before measuring
+        body, headers = upload_body(video, {})
+        job_id = json.loads(request("POST", "/api/upload", body, headers)[1])["job_id"]
+        while json.loads(request("GET", f"/api/jobs/{job_id}")[1])["status"] in ("queued",
+                                                                                  "running"):
+            time.sleep(0.5)
+        video_path = f"/api/videos/{hashlib.sha256(video).hexdigest()}.mp4"
+
+        stop = threading.Event()
+        finished = []
+        latencies = {"page": [], "video": []}
+        threads = [threading.Thread(target=analysis_client, args=(video, stop, finished))
+                   for _ in range(analysis_clients)]
+        threads += [threading.Thread(target=light_client,
+                                     args=(video_path, len(video), stop, latencies, seed))
+                    for seed in range(light_clients)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        process.terminate()
+        process.wait()
+    return latencies, len(finished)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        serve(sys.argv[2], int(sys.argv[3]))
+        return
+
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 30
+    analysis_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    light_clients = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    modes = sys.argv[4].split(",") if len(sys.argv) > 4 else MODES
+
+    with open(VIDEO_PATH, "rb") as f:
+        video = f.read()
+
+    print(f"{analysis_clients} analysis clients, {light_clients} light clients, {seconds:.0f}s")
+    print(f"{'mode':>9} {'route':>6} {'requests':>9} {'p50':>10} {'p95':>10} {'max':>10} "
+          f"{'analyses':>9}")
+    for mode in modes:
+        latencies, analyses = run(mode, video, seconds, analysis_clients, light_clients)
+        for route, values in latencies.items():
+            values = np.array(values) * 1000
+            if not len(values):
+                print(f"{mode:>9} {route:>6} {0:>9}")
+                continue
+            print(f"{mode:>9} {route:>6} {len(values):>9} {np.percentile(values, 50):7.1f} ms "
+                  f"{np.percentile(values, 95):7.1f} ms {values.max():7.1f} ms {analyses:>9}")
+
+
+if __name__ == "__main__":
+    main()
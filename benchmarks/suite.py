@@ -0,0 +1,322 @@
+"""
+Benchmark suite for the analysis pipeline, with regression checks.
+
+Runs every mode on input_video.mp4 and on synthetic clips made from it at
+other resolutions, lengths and frame rates:
+
+- angles: process_video without annotated output
+- annotated: process_video writing the overlay video
+- skeleton: process_video writing the skeleton-only video
+- upload: POST /api/upload (wait=true) through the Flask test client, so
+  queueing, the job worker and result serialization are included
+
+Each case runs in a fresh process so its peak RSS is its own (the upload mode
+adds its job worker's). Pose models are loaded before the clock starts.
+Frames/sec, peak RSS and the mean per-frame latency of each pipeline stage are
+written to a JSON file, and compared with a baseline written earlier by
+--save-baseline; a case whose frames/sec drops, or whose RSS or stage
+latencies grow, by more than the thresholds is reported as a regression and
+the exit status is 1.
+
+Synthetic clips are generated once into --clips-dir and reused, so repeated
+runs on one machine measure the same inputs. Baselines are only comparable on
+the machine (and with the ffmpeg/OpenCV build) they were recorded on.
+
+Usage: python -m benchmarks.suite [--clips ...] [--modes ...] [--output results.json]
+                                  [--baseline baseline.json] [--save-baseline]
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+# Synthetic clips: name -> (width, height, fps, seconds); None is the input as is
+CLIPS = {
+    "input": None,
+    "480p30_10s": (854, 480, 30, 10),
+    "720p30_10s": (1280, 720, 30, 10),
+    "1080p60_5s": (1920, 1080, 60, 5),
+    "360p15_60s": (640, 360, 15, 60),
+}
+
+MODES = ("angles", "annotated", "skeleton", "upload")
+
+# Clip used to start the upload mode's job worker before timing
+WARMUP_CLIP = (320, 180, 30, 1)
+
+# Default regression thresholds (fractions of the baseline)
+FPS_THRESHOLD = 0.10
+RSS_THRESHOLD = 0.20
+STAGE_THRESHOLD = 0.25
+
+# Stages below this mean latency are too noisy to compare (milliseconds)
+MIN_STAGE_MS = 1.0
+
+
+def make_clip(video_path, path, width, height, fps, seconds):
+    """
+    Write a synthetic clip made from `video_path`: its frames letterboxed to
+    `width` x `height`, resampled to `fps` and looped to `seconds`.
+    """
+    cap = cv2.VideoCapture(video_path)
+    source_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frames = []
+    while True:
+        success, frame = cap.read()
+        if not success:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        raise RuntimeError(f"Could not read {video_path}")
+
+    scale = min(width / frames[0].shape[1], height / frames[0].shape[0])
+    canvas = np.zeros((height, width, 3), dtype=np.uint8)
+    temp_path = path + ".tmp.mp4"
+    out = cv2.VideoWriter(temp_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for index in range(int(seconds * fps)):
+        frame = frames[int(index * source_fps / fps) % len(frames)]
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        top = (height - frame.shape[0]) // 2
+        left = (width - frame.shape[1]) // 2
+        canvas[top:top + frame.shape[0], left:left + frame.shape[1]] = frame
+        out.write(canvas)
+    out.release()
+    os.replace(temp_path, path)
+
+
+def clip_path(name, spec, video_path, clips_dir):
+    """Path of a benchmark clip, generating it if needed."""
+    if spec is None:
+        return video_path
+    path = os.path.join(clips_dir, f"{name}.mp4")
+    if not os.path.exists(path):
+        print(f"Generating {name}...")
+        make_clip(video_path, path, *spec)
+    return path
+
+
+def peak_rss_bytes(children=False):
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # Kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def _stage_latencies(pipeline):
+    # Mean per-frame latency of each stage and step (milliseconds)
+    return {name: histogram["sum"] / histogram["count"] * 1000
+            for name, histogram in pipeline.get("latency", {}).items() if histogram["count"]}
+
+
+def _run_process_video(path, mode, profile):
+    import processing
+
+    processing.pose_pool.warm([profile])
+    output_path = None
+    if mode != "angles":
+        output_path = os.path.join(tempfile.mkdtemp(), "output.mp4")
+    start = time.perf_counter()
+    result = processing.process_video(path, output_path, skeleton_mode=mode == "skeleton",
+                                      profile=profile)
+    elapsed = time.perf_counter() - start
+    if output_path and os.path.exists(output_path):
+        os.remove(output_path)
+    if not result.get("success"):
+        raise RuntimeError(result.get("error"))
+    return {
+        "frames": len(result["columns"]),
+        "seconds": elapsed,
+        "detected": float(result["columns"].detected.mean()),
+        "bottleneck": result["pipeline"]["bottleneck"],
+        "stages_ms": _stage_latencies(result["pipeline"]),
+        "peak_rss_bytes": peak_rss_bytes()
+    }
+
+
+def _run_upload(path, profile, warmup_path):
+    # One worker and no result cache, so every upload is analyzed
+    os.environ["JOB_WORKERS"] = "1"
+    os.environ["RESULT_CACHE_MAX_BYTES"] = "0"
+    import app as server
+
+    client = server.app.test_client()
+
+    def upload(video_path):
+        with open(video_path, "rb") as f:
+            response = client.post("/api/upload", data={
+                "video": (f, os.path.basename(video_path)), "wait": "true",
+                "timings": "true", "profile": profile or ""})
+        body = response.get_json()
+        if response.status_code != 200 or not body.get("success"):
+            raise RuntimeError(body.get("error"))
+        return body
+
+    try:
+        upload(warmup_path)
+        start = time.perf_counter()
+        body = upload(path)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.job_manager.shutdown()
+    # Frames with no measured angle have only a timestamp
+    detected = [frame for frame in body["data"] if len(frame) > 1]
+    return {
+        "frames": len(body["data"]),
+        "seconds": elapsed,
+        "detected": len(detected) / len(body["data"]) if body["data"] else 0.0,
+        "bottleneck": body["timings"]["bottleneck"],
+        "stages_ms": {name: stage["mean_ms"] for name, stage in body["timings"]["stages"].items()},
+        "queued_seconds": body["timings"]["queued_seconds"],
+        "peak_rss_bytes": peak_rss_bytes() + peak_rss_bytes(children=True)
+    }
+
+
+def run_case(path, mode, profile=None, warmup_path=None):
+    """
+    Benchmark one clip in one mode (call it in a fresh process).
+
+    Returns:
+        A dict with frames, seconds, fps, detection rate, bottleneck,
+        stages_ms (mean per-frame latency of each stage) and peak_rss_bytes
+    """
+    if mode == "upload":
+        case = _run_upload(path, profile, warmup_path)
+    else:
+        case = _run_process_video(path, mode, profile)
+    case["fps"] = case["frames"] / case["seconds"]
+    return case
+
+
+def compare(results, baseline, fps_threshold=FPS_THRESHOLD, rss_threshold=RSS_THRESHOLD,
+            stage_threshold=STAGE_THRESHOLD):
+    """
+    Compare results with a baseline.
+
+    Args:
+        results: Cases of this run, keyed "clip/mode"
+        baseline: Cases of the baseline, keyed the same way
+        fps_threshold: Largest allowed drop in frames/sec (fraction)
+        rss_threshold: Largest allowed growth of peak RSS (fraction)
+        stage_threshold: Largest allowed growth of a stage's mean latency
+            (fraction); stages faster than MIN_STAGE_MS are skipped
+
+    Returns:
+        A list of regression descriptions, empty if there are none
+    """
+    regressions = []
+    for key, case in results.items():
+        before = baseline.get(key)
+        if before is None:
+            continue
+        if case["fps"] < before["fps"] * (1 - fps_threshold):
+            regressions.append(f"{key}: {case['fps']:.1f} fps, baseline {before['fps']:.1f}")
+        if case["peak_rss_bytes"] > before["peak_rss_bytes"] * (1 + rss_threshold):
+            regressions.append(f"{key}: peak RSS {case['peak_rss_bytes'] / 1024 ** 2:.0f} MB, "
+                               f"baseline {before['peak_rss_bytes'] / 1024 ** 2:.0f} MB")
+        for stage, latency in case["stages_ms"].items():
+            previous = before.get("stages_ms", {}).get(stage)
+            if previous is None or previous < MIN_STAGE_MS:
+                continue
+            if latency > previous * (1 + stage_threshold):
+                regressions.append(f"{key}: {stage} {latency:.2f} ms/frame, "
+                                   f"baseline {previous:.2f}")
+    return regressions
+
+
+def environment():
+    import mediapipe
+
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "mediapipe": mediapipe.__version__,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline.")
+    parser.add_argument("--video", default="input_video.mp4",
+                        help="clip the synthetic clips are made from")
+    parser.add_argument("--clips", nargs="+", choices=list(CLIPS), default=list(CLIPS))
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--profile", default=None, help="processing profile (see profiles.py)")
+    parser.add_argument("--clips-dir", default=os.path.join(tempfile.gettempdir(),
+                                                            "joint_angle_benchmarks"))
+    parser.add_argument("--output", default="benchmark_results.json",
+                        help="file the results are written to")
+    parser.add_argument("--baseline", default=os.path.join("benchmarks", "baseline.json"),
+                        help="results to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the results to --baseline instead of comparing")
+    parser.add_argument("--fps-threshold", type=float, default=FPS_THRESHOLD)
+    parser.add_argument("--rss-threshold", type=float, default=RSS_THRESHOLD)
+    parser.add_argument("--stage-threshold", type=float, default=STAGE_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.clips_dir, exist_ok=True)
+    paths = {name: clip_path(name, CLIPS[name], args.video, args.clips_dir)
+             for name in args.clips}
+    warmup_path = clip_path("warmup", WARMUP_CLIP, args.video, args.clips_dir)
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    print(f"{'case':<26} {'frames':>7} {'fps':>7} {'detected':>9} {'peak RSS':>9} "
+          f"{'bottleneck':>11}")
+    for name in args.clips:
+        for mode in args.modes:
+            # (not a multiprocessing.Pool: its daemonic workers can't start
+            # the upload mode's job worker)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                case = executor.submit(run_case, paths[name], mode, args.profile,
+                                       warmup_path).result()
+            key = f"{name}/{mode}"
+            results[key] = case
+            print(f"{key:<26} {case['frames']:>7} {case['fps']:>7.1f} "
+                  f"{case['detected'] * 100:>8.1f}% "
+                  f"{case['peak_rss_bytes'] / 1024 ** 2:>7.0f}MB {case['bottleneck'] or '-':>11}")
+
+    report = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "environment": environment(),
+        "profile": args.profile,
+        "cases": results
+    }
+    output = args.baseline if args.save_baseline else args.output
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    if args.save_baseline:
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; record one with --save-baseline")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("profile") != args.profile:
+        print(f"Baseline was recorded with profile {baseline.get('profile')}, not comparing")
+        return 0
+    regressions = compare(results, baseline["cases"], args.fps_threshold, args.rss_threshold,
+                          args.stage_threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No regressions against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Measure seek latency of /api/videos under concurrent clients.
+
+A content-addressed test file is put in the upload folder and the app is served
+by a threaded Werkzeug server. Each client thread issues range requests for a
+chunk at a random offset, the way a <video> element seeks, and the latency of
+every request is recorded. A full download of the file is timed for comparison.
+
+Usage: python -m benchmarks.video_seek [clients] [seeks_per_client] [file_mb]
+"""
+
+import hashlib
+import http.client
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+from werkzeug.serving import make_server
+
+import app as server
+
+# Bytes requested per seek, about what a browser asks for after seeking
+SEEK_BYTES = 256 * 1024
+
+
+def make_file(folder, size):
+    data = np.random.default_rng(0).integers(0, 256, size, dtype=np.uint8).tobytes()
+    filename = f"{hashlib.sha256(data).hexdigest()}.mp4"
+    with open(os.path.join(folder, filename), "wb") as f:
+        f.write(data)
+    return filename
+
+
+def fetch(port, path, headers=None):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    try:
+        connection.request("GET", path, headers=headers or {})
+        response = connection.getresponse()
+        body = response.read()
+        return response.status, body
+    finally:
+        connection.close()
+
+
+def client(port, path, size, seeks, latencies, seed):
+    rng = random.Random(seed)
+    for _ in range(seeks):
+        offset = rng.randrange(0, size - SEEK_BYTES)
+        start = time.perf_counter()
+        status, body = fetch(port, path,
+                             {"Range": f"bytes={offset}-{offset + SEEK_BYTES - 1}"})
+        latencies.append(time.perf_counter() - start)
+        if status != 206 or len(body) != SEEK_BYTES:
+            raise RuntimeError(f"Unexpected response {status} with {len(body)} bytes")
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seeks = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    size = int(float(sys.argv[3]) * 1024 * 1024) if len(sys.argv) > 3 else 64 * 1024 * 1024
+
+    folder = server.app.config['UPLOAD_FOLDER']
+    filename = make_file(folder, size)
+    path = f"/api/videos/{filename}"
+    http_server = make_server("127.0.0.1", 0, server.app, threaded=True)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    port = http_server.server_port
+
+    try:
+        start = time.perf_counter()
+        status, body = fetch(port, path)
+        full_seconds = time.perf_counter() - start
+        assert status == 200 and len(body) == size
+
+        latencies = []
+        threads = [threading.Thread(target=client,
+                                    args=(port, path, size, seeks, latencies, seed))
+                   for seed in range(clients)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        http_server.shutdown()
+        os.remove(os.path.join(folder, filename))
+
+    latencies = np.array(latencies) * 1000
+    print(f"file: {size / 1024 ** 2:.0f} MB, full download {full_seconds * 1000:.0f} ms")
+    print(f"{clients} clients x {seeks} seeks of {SEEK_BYTES // 1024} KB: "
+          f"{len(latencies) / elapsed:.0f} seeks/sec")
+    print(f"latency p50 {np.percentile(latencies, 50):.1f} ms, "
+          f"p95 {np.percentile(latencies, 95):.1f} ms, max {latencies.max():.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Content-addressed cache of analysis results.
+
+Uploads are stored under the SHA-256 of their bytes, so the same clip uploaded
+twice ends up in the same file. Results are keyed by that hash plus the
+processing options, and a hit returns the stored angle data (and annotated
+video) without decoding a single frame.
+
+The index is a SQLite database in the upload folder, which serializes writers
+across processes, so several gunicorn workers can share one cache. Every entry
+records the files it owns; when their total size goes over the limit the least
+recently used entries are evicted and files no other entry needs are deleted.
+Uploads (whether posted, chunked or downloaded, and the videos and landmarks
+recorded from them) that never made it into an entry, because their analysis
+failed, was cancelled or was spilled or the cache is disabled, are deleted by
+prune_orphans once they are old enough.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Bytes read at a time when hashing uploads
+CHUNK_SIZE = 1024 * 1024
+
+# Files an analysis leaves in the upload folder: the upload and its processed
+# videos, named after the upload's hash, and its landmarks, a chunked upload
+# analyzed while it arrived and a downloaded video, named after a random id
+# or the URL
+_ANALYSIS_FILE = re.compile(r"[0-9a-f]{64}[._]|[0-9a-f]{32}\.")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    video_hash TEXT NOT NULL,
+    result TEXT NOT NULL,
+    files TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE INDEX IF NOT EXISTS entries_video_hash ON entries (video_hash);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def save_upload(file, folder, extension):
+    """
+    Stream an uploaded file to disk under the hash of its contents.
+
+    Args:
+        file: Werkzeug FileStorage (or any object with a `stream`)
+        folder: Directory to store the file in
+        extension: File extension including the dot, e.g. ".mp4"
+
+    Returns:
+        A (video_hash, filename) tuple; if the same bytes were uploaded before
+        the existing file is kept
+    """
+    digest = hashlib.sha256()
+    temp_path = os.path.join(folder, f".upload_{uuid.uuid4()}")
+    try:
+        with open(temp_path, "wb") as f:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+
+        video_hash = digest.hexdigest()
+        filename = f"{video_hash}{extension.lower()}"
+        # Rename into place atomically; identical bytes may already be there
+        os.replace(temp_path, os.path.join(folder, filename))
+        return video_hash, filename
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def adopt_file(path, folder, extension):
+    """
+    Move a complete file into `folder` under the hash of its contents.
+
+    Args:
+        path: File to move
+        folder: Directory to store the file in
+        extension: File extension including the dot, e.g. ".mp4"
+
+    Returns:
+        A (video_hash, filename) tuple, as for save_upload
+    """
+    video_hash = hash_file(path)
+    filename = f"{video_hash}{extension.lower()}"
+    os.replace(path, os.path.join(folder, filename))
+    return video_hash, filename
+
+
+def hash_file(path):
+    """Compute the SHA-256 of a file on disk, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(video_hash, options):
+    """
+    Build the cache key for a video and its processing options.
+
+    Args:
+        video_hash: Hash returned by save_upload or hash_file
+        options: JSON-serializable dict of everything that changes the result
+
+    Returns:
+        A hex string
+    """
+    encoded = json.dumps(options, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{video_hash}:{encoded}".encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of results, shared by every process using `folder`.
+
+    Args:
+        folder: Directory holding the cached files and the index
+        max_bytes: Total size of cached files to keep; 0 disables the cache
+    """
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.path = os.path.join(folder, "result_cache.sqlite3")
+        db = self._connect()
+        try:
+            db.executescript(_SCHEMA)
+        finally:
+            db.close()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _connect(self):
+        # A short-lived connection per call keeps this safe across threads and
+        # forks; SQLite's own locking handles concurrent processes
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def _transaction(self):
+        return _Transaction(self._connect())
+
+    def _count(self, db, name):
+        db.execute("INSERT INTO counters (name, value) VALUES (?, 1) "
+                   "ON CONFLICT (name) DO UPDATE SET value = value + 1", (name,))
+
+    def get(self, key):
+        """
+        Look up a result.
+
+        Args:
+            key: Key from make_key
+
+        Returns:
+            The stored result dict, or None on a miss (including entries whose
+            files have disappeared)
+        """
+        if not self.enabled:
+            return None
+        with self._transaction() as db:
+            row = db.execute("SELECT result, files FROM entries WHERE key = ?",
+                             (key,)).fetchone()
+            if row is not None and all(os.path.exists(os.path.join(self.folder, name))
+                                       for name in json.loads(row[1])):
+                db.execute("UPDATE entries SET last_used = ? WHERE key = ?",
+                           (time.time(), key))
+                self._count(db, "hits")
+                return json.loads(row[0])
+            if row is not None:
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._count(db, "misses")
+            return None
+
+    def touch_video(self, video_hash):
+        """Mark a video as recently used so eviction leaves its file alone."""
+        if not self.enabled:
+            return
+        with self._transaction() as db:
+            db.execute("UPDATE entries SET last_used = ? WHERE video_hash = ?",
+                       (time.time(), video_hash))
+
+    def put(self, key, video_hash, result, files):
+        """
+        Store a result and evict old entries if the cache is over its limit.
+
+        Args:
+            key: Key from make_key
+            video_hash: Hash of the input video
+            result: JSON-serializable result dict
+            files: Names of the files in `folder` the result refers to
+        """
+        if not self.enabled:
+            return
+        files = [name for name in files if name]
+        size = sum(os.path.getsize(os.path.join(self.folder, name))
+                   for name in files if os.path.exists(os.path.join(self.folder, name)))
+        encoded = json.dumps(result)
+        with self._transaction() as db:
+            db.execute("INSERT OR REPLACE INTO entries "
+                       "(key, video_hash, result, files, size, last_used) "
+                       "VALUES (?, ?, ?, ?, ?, ?)",
+                       (key, video_hash, encoded, json.dumps(files),
+                        size + len(encoded), time.time()))
+            self._evict(db)
+
+    def _evict(self, db):
+        # Shared files (e.g. one upload analyzed with several option sets) are
+        # counted once per entry, so the limit errs on the side of evicting
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = db.execute("SELECT key, files, size FROM entries "
+                          "ORDER BY last_used ASC").fetchall()
+        evicted = set()
+        for key, files, size in rows[:-1]:
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._count(db, "evictions")
+            evicted.update(json.loads(files))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        for name in evicted - self._files_in_use(db):
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
+
+    def _files_in_use(self, db):
+        # Names of every file an entry refers to
+        return {name for (files,) in db.execute("SELECT files FROM entries")
+                for name in json.loads(files)}
+
+    def prune_orphans(self, max_age):
+        """
+        Delete uploads, processed videos, landmarks and downloads in `folder`
+        that no entry refers to.
+
+        Args:
+            max_age: Only delete files last modified over this many seconds
+                ago, so the inputs and outputs of running analyses are kept
+
+        Returns:
+            The number of files deleted
+        """
+        cutoff = time.time() - max_age
+        with self._transaction() as db:
+            in_use = self._files_in_use(db)
+            deleted = 0
+            for entry in os.scandir(self.folder):
+                if (not _ANALYSIS_FILE.match(entry.name) or entry.name in in_use
+                        or not entry.is_file()):
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        deleted += 1
+                except OSError:
+                    pass
+        if deleted:
+            logger.info(f"Deleted {deleted} files no cached result refers to")
+        return deleted
+
+    def stats(self):
+        """Return hit/miss/eviction counters and the current size."""
+        with self._transaction() as db:
+            counters = dict(db.execute("SELECT name, value FROM counters").fetchall())
+            entries, size = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        return {
+            "enabled": self.enabled,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else None,
+            "evictions": counters.get("evictions", 0),
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes
+        }
+
+
+class _Transaction:
+    """Runs a block as one immediate transaction and closes the connection."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.db.close()
@@ -0,0 +1,112 @@
+"""
+Columnar representation of analysis results.
+
+Instead of one dict per frame, a result is stored as a timestamp array, a
+detection mask and one contiguous float32 array per joint (NaN where the angle
+could not be measured). It is saved as an `.npz` archive with one entry per
+array, which NumPy, pandas or any zip-aware reader can load without parsing
+JSON.
+"""
+
+import numpy as np
+
+
+class AngleColumns:
+    """
+    Joint angles for every frame of a video, one column per joint.
+
+    Args:
+        joints: Joint names, in column order
+        timestamps: (N,) frame times in seconds
+        angles: (J, N) array of angles in degrees, or a mapping of joint name
+            to (N,) array
+        detected: (N,) bool array, True where a pose was found
+    """
+
+    def __init__(self, joints, timestamps, angles, detected):
+        self.joints = tuple(joints)
+        self.timestamps = np.ascontiguousarray(timestamps, dtype=np.float64)
+        if isinstance(angles, dict):
+            angles = [angles[name] for name in self.joints]
+        self.angles = np.ascontiguousarray(angles, dtype=np.float32).reshape(
+            len(self.joints), len(self.timestamps))
+        self.detected = np.ascontiguousarray(detected, dtype=bool)
+
+    @classmethod
+    def from_angle_matrix(cls, joints, angles, timestamps, detected):
+        """Build columns from the (N, J) matrix returned by AngleEngine.compute."""
+        return cls(joints, timestamps, np.asarray(angles).T, detected)
+
+    @classmethod
+    def from_frame_dicts(cls, frames):
+        """
+        Build columns from the per-frame dicts of a JSON result.
+
+        Args:
+            frames: List of {"timestamp": t, joint: angle, ...} dicts
+
+        Returns:
+            An AngleColumns with every joint that appears in any frame; frames
+            without any angle are marked as not detected
+        """
+        # Joints in the order they first appear
+        joints = list(dict.fromkeys(name for frame in frames for name in frame
+                                    if name != "timestamp"))
+        timestamps = np.array([frame["timestamp"] for frame in frames], dtype=np.float64)
+        angles = np.array([[frame.get(name, np.nan) for frame in frames] for name in joints],
+                          dtype=np.float32).reshape(len(joints), len(frames))
+        detected = np.array([len(frame) > 1 for frame in frames], dtype=bool)
+        return cls(joints, timestamps, angles, detected)
+
+    def to_frame_dicts(self):
+        """
+        Convert back to the per-frame dicts of a JSON result.
+
+        Returns:
+            A list of {"timestamp": t, joint: angle, ...} dicts; joints with
+            no valid angle are left out
+        """
+        finite = np.isfinite(self.angles).T.tolist()
+        values = self.angles.T.tolist()
+        return [{"timestamp": t, **{name: value for name, value, valid in zip(self.joints, row, ok)
+                                    if valid}}
+                for t, row, ok in zip(self.timestamps.tolist(), values, finite)]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def window(self, first=0, stop=None, joints=None):
+        """Copy of frames [first, stop) of some joints (default: all), as in SpillReader."""
+        joints = list(joints or self.joints)
+        return AngleColumns(joints, self.timestamps[first:stop],
+                            {name: self.column(name)[first:stop] for name in joints},
+                            self.detected[first:stop])
+
+    def column(self, name):
+        """Get the angle array of one joint."""
+        return self.angles[self.joints.index(name)]
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + self.angles.nbytes + self.detected.nbytes
+
+    def save(self, file, compressed=True):
+        """
+        Write the columns as an .npz archive.
+
+        Args:
+            file: Path or writable binary file object
+            compressed: Deflate the arrays (smaller, slightly slower)
+        """
+        arrays = {name: self.angles[i] for i, name in enumerate(self.joints)}
+        savez = np.savez_compressed if compressed else np.savez
+        savez(file, timestamps=self.timestamps, detected=self.detected,
+              joints=np.array(self.joints), **arrays)
+
+    @classmethod
+    def load(cls, file):
+        """Read columns written by save."""
+        with np.load(file) as archive:
+            joints = [str(name) for name in archive["joints"]]
+            return cls(joints, archive["timestamps"],
+                       {name: archive[name] for name in joints}, archive["detected"])
@@ -10,6 +10,8 @@ import sys
 import os
 import math
 
+from processing import create_pose
+
 def calculate_angle(a, b, c):
     """
     Calculate the angle between three points.
@@ -42,7 +44,7 @@ def calculate_angle(a, b, c):
     
     return angle
 
-def test_skeleton_mode(video_path, output_path):
+def test_skeleton_mode(video_path, output_path, profile=None):
     """
     Process a video with skeleton mode and save the output for inspection.
     Display joint angles for key joints in the body.
@@ -50,6 +52,7 @@ def test_skeleton_mode(video_path, output_path):
     Args:
         video_path: Path to input video
         output_path: Path to save processed video
+        profile: Processing profile name (see profiles.py), default if None
     """
     print(f"Processing video: {video_path}")
     print(f"Output will be saved to: {output_path}")
@@ -130,12 +133,7 @@ def test_skeleton_mode(video_path, output_path):
     
     # Process video frames
     frame_count = 0
-    with mp_pose.Pose(
-        static_image_mode=False,
-        model_complexity=2,
-        enable_segmentation=True,
-        min_detection_confidence=0.5,
-        min_tracking_confidence=0.5) as pose:
+    with create_pose(profile) as pose:
         
         while cap.isOpened():
             success, frame = cap.read()
@@ -223,17 +221,18 @@ def test_skeleton_mode(video_path, output_path):
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("Usage: python debug_utils.py <input_video_path> <output_video_path>")
+        print("Usage: python debug_utils.py <input_video_path> <output_video_path> [profile]")
         sys.exit(1)
     
     input_path = sys.argv[1]
     output_path = sys.argv[2]
+    profile = sys.argv[3] if len(sys.argv) > 3 else None
     
     if not os.path.exists(input_path):
         print(f"Error: Input video not found at {input_path}")
         sys.exit(1)
     
-    success = test_skeleton_mode(input_path, output_path)
+    success = test_skeleton_mode(input_path, output_path, profile)
     if success:
         print("Debug test completed successfully")
     else:
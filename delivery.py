@@ -0,0 +1,92 @@
+"""
+Delivery of uploaded and processed videos.
+
+Responses support single byte ranges (so a <video> element can seek without
+downloading the file), conditional requests and strong ETags:
+
+- Uploads are stored under the SHA-256 of their bytes (see cache.py), so the
+  hash is their ETag and they are cached by browsers for a year as immutable.
+- Processed videos can still be growing while their job runs, so they get an
+  ETag from their size and modification time and must be revalidated.
+
+With X-Accel-Redirect (nginx) or X-Sendfile (Apache, lighttpd) delivery, the
+app only checks the request and sets the headers, and the reverse proxy sends
+the bytes (and handles ranges) itself.
+"""
+
+import mimetypes
+import os
+import re
+
+from flask import Response, request, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+# Cache lifetime of content-addressed files (seconds)
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Names of files stored under the hash of their contents
+_CONTENT_ADDRESSED = re.compile(r"^([0-9a-f]{64})\.[A-Za-z0-9]+$")
+
+# Supported delivery modes
+DELIVERY_MODES = ("", "x-accel", "x-sendfile")
+
+
+def content_hash(filename):
+    """Return the content hash in a content-addressed file name, or None."""
+    match = _CONTENT_ADDRESSED.match(filename)
+    return match.group(1) if match else None
+
+
+def send_video(folder, filename, mode="", accel_prefix="/protected-videos/"):
+    """
+    Build the response for a video in `folder`.
+
+    Args:
+        folder: Directory the videos are stored in
+        filename: Requested file name (from the URL)
+        mode: "" to send the bytes from Python, "x-accel" or "x-sendfile" to
+            leave them to the reverse proxy
+        accel_prefix: Internal nginx location that maps to `folder`
+
+    Returns:
+        A Flask response
+
+    Raises:
+        NotFound: If the file doesn't exist or is outside `folder`
+        ValueError: If `mode` is unknown
+    """
+    if mode not in DELIVERY_MODES:
+        raise ValueError(f"Unknown video delivery mode: {mode}")
+    path = safe_join(folder, filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+
+    video_hash = content_hash(filename)
+    if video_hash and request.if_none_match.contains(video_hash):
+        # The client's copy is current (the proxy modes rely on this too)
+        response = Response(status=304)
+        response.set_etag(video_hash)
+    elif mode == "x-accel":
+        response = Response(mimetype=mimetypes.guess_type(filename)[0]
+                            or "application/octet-stream")
+        response.headers["X-Accel-Redirect"] = accel_prefix.rstrip("/") + "/" + filename
+        if video_hash:
+            response.set_etag(video_hash)
+    elif mode == "x-sendfile":
+        response = Response(mimetype=mimetypes.guess_type(filename)[0]
+                            or "application/octet-stream")
+        response.headers["X-Sendfile"] = os.path.abspath(path)
+        if video_hash:
+            response.set_etag(video_hash)
+    else:
+        # Werkzeug answers Range, If-Range and If-None-Match against this ETag
+        response = send_from_directory(folder, filename, conditional=True,
+                                       etag=video_hash or True)
+
+    response.headers["Accept-Ranges"] = "bytes"
+    if video_hash:
+        response.headers["Cache-Control"] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+    return response
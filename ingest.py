@@ -0,0 +1,313 @@
+"""
+Resumable chunked uploads that can be analyzed while they arrive.
+
+A client opens an upload session, then sends the file in chunks, each tagged
+with the byte offset it starts at. Chunks are streamed straight from the request
+body to disk, so worker memory doesn't grow with the file size, and a client
+that lost its connection asks for the current offset and carries on from there.
+
+Session state lives in a `<id>.json` file and the data is written to
+`<id><ext>` in the upload folder, so any server process can take the next chunk
+of any session.
+
+For streamable containers (fragmented MP4, WebM) a session can ask for
+processing to start before the upload has finished. The analysis then reads
+the video through a FIFO fed by `follow`, which tails the growing file until
+the session is marked complete (or removed).
+"""
+
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Bytes copied at a time from the request body to disk and from disk to the decoder
+CHUNK_SIZE = 1024 * 1024
+
+# How often the follower checks for new data (seconds)
+POLL_SECONDS = 0.05
+
+# Give up on an upload that hasn't grown for this long (seconds)
+STALL_SECONDS = 10 * 60
+
+
+class UploadError(Exception):
+    """Raised for invalid upload requests."""
+
+
+class OffsetMismatch(UploadError):
+    """Raised when a chunk doesn't start at the current end of the upload."""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class UploadStore:
+    """
+    Upload sessions kept in a directory.
+
+    Args:
+        folder: Directory for the session metadata
+        data_folder: Directory the uploaded data is written to
+        max_bytes: Largest accepted upload
+    """
+
+    def __init__(self, folder, data_folder, max_bytes):
+        self.folder = folder
+        self.data_folder = data_folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+
+    def meta_path(self, upload_id):
+        """Path of a session's metadata, as passed to follow."""
+        return os.path.join(self.folder, f"{upload_id}.json")
+
+    def data_path(self, session):
+        """Path of the (possibly still growing) uploaded data."""
+        return os.path.join(self.data_folder, session["data_filename"])
+
+    def _write(self, session):
+        # Replace the metadata atomically so readers never see half a file
+        session = {key: value for key, value in session.items() if key != "offset"}
+        temp_path = self.meta_path(session["id"]) + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(session, f)
+        os.replace(temp_path, self.meta_path(session["id"]))
+
+    def create(self, filename, size=None, stream=False, options=None):
+        """
+        Open a new upload session.
+
+        Args:
+            filename: Original file name (used for its extension)
+            size: Total size in bytes, if known
+            stream: Start processing before the upload has finished
+            options: Processing options stored with the session
+
+        Returns:
+            The session dict
+        """
+        if size is not None and size > self.max_bytes:
+            raise UploadError(f"Upload is larger than {self.max_bytes} bytes")
+        self.prune()
+        upload_id = uuid.uuid4().hex
+        extension = os.path.splitext(filename)[1].lower()
+        session = {
+            "id": upload_id,
+            "filename": filename,
+            "data_filename": f"{upload_id}{extension}",
+            "size": size,
+            "stream": stream,
+            "options": options or {},
+            "complete": False,
+            "job_id": None,
+            "result_extras": {},
+            "created_at": time.time()
+        }
+        open(self.data_path(session), "wb").close()
+        self._write(session)
+        session["offset"] = 0
+        return session
+
+    def prune(self, max_age=24 * 60 * 60):
+        """Remove sessions that were opened more than `max_age` seconds ago."""
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.folder):
+            if not name.endswith(".json"):
+                continue
+            session = self.get(name[:-len(".json")])
+            if session is not None and session["created_at"] < cutoff:
+                self.discard(session, remove_data=not session["complete"])
+
+    def get(self, upload_id):
+        """
+        Get a session with its current offset.
+
+        Returns:
+            The session dict, or None if the id is unknown
+        """
+        # Ids come from URLs; only accept ones create could have made
+        if not upload_id.isalnum():
+            return None
+        try:
+            with open(self.meta_path(upload_id)) as f:
+                session = json.load(f)
+            session["offset"] = os.path.getsize(self.data_path(session))
+        except (FileNotFoundError, ValueError):
+            return None
+        return session
+
+    def update(self, upload_id, **fields):
+        """Change fields of a session, e.g. to record its job id."""
+        with self._locked(upload_id):
+            session = self.get(upload_id)
+            session.update(fields)
+            self._write(session)
+            return session
+
+    @contextlib.contextmanager
+    def _locked(self, upload_id):
+        # Serialize writers to one session across processes
+        with open(self.meta_path(upload_id) + ".lock", "wb") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def append(self, upload_id, offset, stream):
+        """
+        Append a chunk read from a stream.
+
+        Args:
+            upload_id: Session id
+            offset: Byte offset the chunk starts at
+            stream: Readable binary stream with the chunk
+
+        Returns:
+            The new offset
+
+        Raises:
+            OffsetMismatch: If `offset` isn't the current end of the upload
+            UploadError: If the session is complete or the size limit is hit
+        """
+        with self._locked(upload_id):
+            session = self.get(upload_id)
+            if session["complete"]:
+                raise UploadError("Upload is already complete")
+            if offset != session["offset"]:
+                raise OffsetMismatch(session["offset"])
+
+            limit = min(self.max_bytes, session["size"] or self.max_bytes)
+            written = offset
+            with open(self.data_path(session), "ab") as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if written + len(chunk) > limit:
+                        # Drop the partial chunk so the client can retry it
+                        f.truncate(offset)
+                        raise UploadError(f"Upload is larger than {limit} bytes")
+                    f.write(chunk)
+                    written += len(chunk)
+            return written
+
+    def complete(self, upload_id):
+        """
+        Mark an upload as finished.
+
+        Returns:
+            The session dict
+
+        Raises:
+            UploadError: If fewer bytes arrived than the declared size
+        """
+        with self._locked(upload_id):
+            session = self.get(upload_id)
+            if session["size"] is not None and session["offset"] != session["size"]:
+                raise UploadError(
+                    f"Upload has {session['offset']} of {session['size']} bytes")
+            session["complete"] = True
+            self._write(session)
+            return session
+
+    def discard(self, session, remove_data=False):
+        """Remove a session, and optionally the data uploaded so far."""
+        paths = [self.meta_path(session["id"]), self.meta_path(session["id"]) + ".lock"]
+        if remove_data:
+            paths.append(self.data_path(session))
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _session_state(meta_path):
+    # Whether a session is complete, and the error it failed with (URL
+    # downloads record one); a session that no longer exists won't receive
+    # more data either
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return True, None
+    except ValueError:
+        return False, None
+    return meta["complete"], meta.get("error")
+
+
+def _feed(data_path, meta_path, fifo_path, stop, state):
+    # Copy the growing file into the FIFO until the upload is complete
+    try:
+        with open(fifo_path, "wb") as fifo, open(data_path, "rb") as source:
+            last_growth = time.time()
+            while not stop.is_set():
+                chunk = source.read(CHUNK_SIZE)
+                if chunk:
+                    fifo.write(chunk)
+                    last_growth = time.time()
+                    continue
+                # Check for completion only after reaching the end, then drain
+                complete, error = _session_state(meta_path)
+                if error:
+                    state["error"] = error
+                    break
+                if complete:
+                    chunk = source.read()
+                    if chunk:
+                        fifo.write(chunk)
+                    break
+                if time.time() - last_growth > STALL_SECONDS:
+                    state["error"] = "Upload stalled before it was complete"
+                    break
+                time.sleep(POLL_SECONDS)
+    except BrokenPipeError:
+        # The decoder stopped reading (it failed or has all it needs)
+        pass
+    except Exception as e:
+        state["error"] = str(e)
+
+
+@contextlib.contextmanager
+def follow(data_path, meta_path):
+    """
+    Expose a growing upload as a stream the video decoder can read.
+
+    Args:
+        data_path: Path of the uploaded data (see UploadStore.data_path)
+        meta_path: Path of the session metadata (see UploadStore.meta_path)
+
+    Yields:
+        A dict with the FIFO path under "path"; once the block exits, "error"
+        is set if the upload stalled or could not be read
+    """
+    directory = tempfile.mkdtemp(prefix="upload_stream_")
+    fifo_path = os.path.join(directory, "stream")
+    os.mkfifo(fifo_path)
+    stop = threading.Event()
+    state = {"path": fifo_path, "error": None}
+    feeder = threading.Thread(target=_feed, args=(data_path, meta_path, fifo_path, stop, state),
+                              daemon=True)
+    feeder.start()
+    try:
+        yield state
+    finally:
+        stop.set()
+        # Unblock a feeder still waiting for the decoder to open the FIFO
+        try:
+            os.close(os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+        feeder.join(timeout=5)
+        shutil.rmtree(directory, ignore_errors=True)
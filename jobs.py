@@ -0,0 +1,650 @@
+"""
+Background job queue for video analysis.
+
+Uploads are turned into jobs that run on a pool of worker processes. Each worker
+keeps warm MediaPipe pose detectors in its pose pool (see posepool.py), so a
+model is loaded once per process and profile instead of once per video.
+
+The number of queued and running jobs is bounded so a burst of uploads is
+rejected instead of exhausting memory.
+
+A job can be cancelled (cancel, or a request waiting on it whose client goes
+away): a queued job is dropped and a running one stops at its next progress
+report. drain stops taking jobs and lets the rest finish before shutdown.
+
+Job state lives in the memory of the process that created the pool, so serve
+the app from one process, either asgi.py under uvicorn or gunicorn with a
+single worker and threads (e.g. `gunicorn -w 1 --threads 8 app:app`), and
+scale with JOB_WORKERS instead.
+"""
+
+import functools
+import logging
+import multiprocessing
+import pickle
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import ingest
+import multiperson
+import parallel
+import processing
+from metrics import Counter, Gauge, Histogram
+from pipeline import LATENCY_BUCKETS, latency_quantile
+
+logger = logging.getLogger(__name__)
+
+# How long finished jobs are kept around for status/result queries (seconds)
+JOB_RETENTION_SECONDS = 60 * 60
+
+# How often a wait that can be abandoned checks whether it was (seconds)
+ABANDON_POLL_SECONDS = 0.5
+
+# How often an idle progress listener checks whether its pool was discarded
+# (seconds)
+PROGRESS_POLL_SECONDS = 1.0
+
+# Per-worker-process state, set up by _init_worker
+_progress_queue = None
+_cancel_flags = None
+
+# Metrics served on /metrics, recorded in the parent process as jobs finish
+STAGE_SECONDS = Histogram("pose_stage_seconds",
+                          "Per-frame latency of pipeline stages and steps",
+                          ["stage"], buckets=LATENCY_BUCKETS)
+FRAMES = Counter("pose_frames", "Frames analyzed")
+DETECTED_FRAMES = Counter("pose_detected_frames", "Analyzed frames with a detected pose")
+JOBS = Counter("pose_jobs", "Finished analysis jobs", ["status"])
+JOB_SECONDS = Histogram("pose_job_seconds", "Time from submitting a job to its result",
+                        buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800))
+JOB_FPS = Histogram("pose_job_fps", "Frames analyzed per second of job run time",
+                    buckets=(5, 10, 15, 20, 30, 45, 60, 90, 120, 240))
+QUEUE_OCCUPANCY = Gauge("pose_pipeline_queue_occupancy",
+                        "Mean number of frames waiting in a pipeline queue, last job",
+                        ["queue"])
+STAGE_UTILIZATION = Gauge("pose_pipeline_stage_utilization",
+                          "Fraction of the run a pipeline stage was busy, last job", ["stage"])
+ACTIVE_JOBS = Gauge("pose_jobs_active", "Jobs waiting for or using a worker", ["status"])
+WORKER_UTILIZATION = Gauge("pose_worker_utilization",
+                           "Fraction of the worker processes running a job")
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker to stop a job that was cancelled."""
+
+
+def _init_worker(progress_queue, cancel_flags, segment_slots, warm_profiles):
+    """
+    Initialize a worker process and warm its pose pool.
+
+    Args:
+        progress_queue: Queue used to send progress events back to the parent
+        cancel_flags: Shared byte array with one flag per job slot, set by
+            the parent to cancel the job in that slot
+        segment_slots: Semaphore bounding the segment worker processes of
+            all workers together (see parallel.py)
+        warm_profiles: Profiles to build pose detectors for up front
+    """
+    global _progress_queue, _cancel_flags
+    _progress_queue = progress_queue
+    _cancel_flags = cancel_flags
+    parallel.configure(segment_slots, cancel_flags)
+    processing.pose_pool.warm(warm_profiles)
+
+
+def _ready():
+    # No-op task used to make the pool start its worker processes
+    return True
+
+
+def _run_job(job_id, slot, video_path, output_path, options):
+    """
+    Run a single analysis job inside a worker process.
+
+    Args:
+        job_id: Id of the job, used to tag progress events
+        slot: Index of the job's cancel flag
+        video_path: Path to the input video
+        output_path: Path for the annotated video, or None
+        options: Keyword arguments passed through to process_video
+
+    Returns:
+        The process_video result dict
+    """
+    _progress_queue.put((job_id, "running", 0.0))
+    last_reported = [-1]
+
+    def report_progress(progress, frame_idx):
+        # Called for every frame, so a cancelled job stops within one (the
+        # analysis fails with this error and cleans up after itself)
+        if _cancel_flags[slot]:
+            raise JobCancelled("Job cancelled")
+        # Only send whole-percent changes so the queue isn't flooded per frame
+        if int(progress) != last_reported[0]:
+            last_reported[0] = int(progress)
+            _progress_queue.put((job_id, "running", progress))
+
+    def report_angles(frames):
+        # process_video already batches these, so send each batch as it comes
+        _progress_queue.put((job_id, "frames", frames))
+
+    # Read an upload that is still arriving through a stream that waits for
+    # more data; it can't be seeked, so it is always processed serially
+    follow_upload = options.pop("follow_upload", None)
+    workers = options.pop("workers", 1)
+    # Only annotated (and so serial) runs write a preview rendition
+    preview_path = options.pop("preview_path", None)
+    # Redraw an annotated video from stored landmarks (no inference)
+    render_from = options.pop("render_from", None)
+    if render_from:
+        return processing.render_video(video_path, render_from, output_path,
+                                       preview_path=preview_path,
+                                       progress_callback=report_progress, **options)
+
+    # Spilled results are read from disk, not streamed: streamed angles are
+    # collected in the parent until the job ends
+    spill = options.get("spill_path")
+    # Multi-person results are per person and only sent once the job ends
+    multi_person = options.pop("multi_person", False)
+    if multi_person:
+        process = multiperson.process_video_multi
+    else:
+        process = functools.partial(processing.process_video,
+                                    angles_callback=None if spill else report_angles)
+    if follow_upload:
+        with ingest.follow(video_path, follow_upload) as stream:
+            result = process(stream["path"], output_path, preview_path=preview_path,
+                             progress_callback=report_progress, **options)
+        if stream["error"]:
+            return {"success": False, "error": stream["error"]}
+        return result
+
+    # Split long clips over several processes when parallelism was requested;
+    # annotated output needs frames in order, sampling adapts to the frames
+    # before, spills are written in order and people and ROI crops follow
+    # the subject from frame to frame, so those always run serially
+    sampling = options.get("sample_fps") or options.get("adaptive_sampling")
+    follows = multi_person or options.get("roi")
+    if workers > 1 and not output_path and not sampling and not spill and not follows:
+        return parallel.process_video_parallel(video_path, workers=workers,
+                                               progress_callback=report_progress,
+                                               cancel_slot=slot, **options)
+
+    return process(video_path, output_path, preview_path=preview_path,
+                   progress_callback=report_progress, **options)
+
+
+def _record_metrics(job, result, columns, latency):
+    # Fold a finished job into the /metrics counters and histograms
+    JOBS.inc(status=job["status"])
+    JOB_SECONDS.observe(job["finished_at"] - job["created_at"])
+    if job["status"] != "completed":
+        return
+    for name, histogram in (latency or {}).items():
+        STAGE_SECONDS.merge(histogram["counts"], histogram["sum"], histogram["count"],
+                            stage=name)
+    pipeline = result.get("pipeline") or {}
+    for name, stats in pipeline.get("queues", {}).items():
+        QUEUE_OCCUPANCY.set(stats["mean_occupancy"], queue=name)
+    for name, stats in pipeline.get("stages", {}).items():
+        if stats["utilization"] is not None:
+            STAGE_UTILIZATION.set(stats["utilization"], stage=name)
+    if columns is not None:
+        frames, detected = len(columns), int(columns.detected.sum())
+    elif "spill" in result:
+        frames, detected = result["spill"]["frames"], result["spill"]["detected_frames"]
+    elif "multi_person" in result:
+        frames = result["multi_person"]["frames"]
+        detected = result["multi_person"]["detected_frames"]
+    else:
+        return
+    FRAMES.inc(frames)
+    DETECTED_FRAMES.inc(detected)
+    run_seconds = job["finished_at"] - (job["started_at"] or job["created_at"])
+    if run_seconds > 0:
+        JOB_FPS.observe(frames / run_seconds)
+
+
+def _timings(job, result, latency):
+    # Per-request breakdown of where a job's time went
+    pipeline = result.get("pipeline") or {}
+    started = job["started_at"] or job["created_at"]
+    timings = {
+        "queued_seconds": started - job["created_at"],
+        "run_seconds": job["finished_at"] - started,
+        "bottleneck": pipeline.get("bottleneck"),
+        "queues": pipeline.get("queues", {}),
+        "stages": {}
+    }
+    for name, histogram in (latency or {}).items():
+        if not histogram["count"]:
+            continue
+        timings["stages"][name] = {
+            "count": histogram["count"],
+            "total_seconds": histogram["sum"],
+            "mean_ms": histogram["sum"] / histogram["count"] * 1000,
+            "p50_ms": latency_quantile(histogram["counts"], 0.5) * 1000,
+            "p95_ms": latency_quantile(histogram["counts"], 0.95) * 1000
+        }
+    return timings
+
+
+class JobManager:
+    """
+    Tracks analysis jobs and runs them on a bounded process pool.
+
+    Args:
+        max_workers: Number of worker processes (concurrent analyses)
+        max_queued: Number of jobs allowed to wait for a free worker
+        warm_profiles: Profiles every worker builds a pose detector for when
+            it starts (default: the default profile)
+    """
+
+    def __init__(self, max_workers=2, max_queued=8, warm_profiles=(None,)):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.warm_profiles = tuple(warm_profiles)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # Signalled whenever a job reports progress, angles or finishes
+        self._changed = threading.Condition(self._lock)
+        self._context = multiprocessing.get_context("spawn")
+        self._executor = None
+        self._progress_queue = None
+        self._listener = None
+        # Every active job holds one of these slots and its cancel flag
+        self._cancel_flags = self._context.RawArray("b", max_workers + max_queued)
+        self._free_slots = list(range(max_workers + max_queued))
+        # Segment worker processes of parallel analyses, across all workers
+        self._segment_slots = self._context.Semaphore(parallel.MAX_SEGMENT_WORKERS)
+        # Set by drain: no new jobs are accepted
+        self._closed = False
+
+    def _ensure_executor(self):
+        # Start the pool lazily so importing the app doesn't spawn processes
+        if self._executor is None:
+            self._progress_queue = self._context.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=self._context,
+                initializer=_init_worker,
+                initargs=(self._progress_queue, self._cancel_flags, self._segment_slots,
+                          self.warm_profiles))
+            self._listener = threading.Thread(
+                target=self._listen_progress, args=(self._progress_queue,), daemon=True)
+            self._listener.start()
+        return self._executor
+
+    def _discard_executor(self, executor):
+        # Called with the lock held: drop a broken pool, unless it was already
+        # replaced, and stop what is left of it. Its progress listener notices
+        # on its own, since a worker killed while writing to the queue can
+        # leave it locked or cut off mid-message
+        if executor is not self._executor:
+            return
+        executor.shutdown(wait=False)
+        self._executor = None
+
+    def _listen_progress(self, progress_queue):
+        # Apply progress and angle events sent by the workers to the job
+        # records, until shutdown or until the pool is discarded
+        while True:
+            try:
+                event = progress_queue.get(timeout=PROGRESS_POLL_SECONDS)
+            except queue.Empty:
+                with self._lock:
+                    if self._executor is None or self._progress_queue is not progress_queue:
+                        break
+                continue
+            except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+                break
+            if event is None:
+                break
+            job_id, kind, payload = event
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job and job["status"] in ("queued", "running"):
+                    if job["status"] == "queued":
+                        job["started_at"] = time.time()
+                        job["status"] = "running"
+                    if kind == "frames":
+                        job["frames"].extend(payload)
+                    else:
+                        job["status"] = kind
+                        job["progress"] = payload
+                    self._changed.notify_all()
+
+    def _prune(self):
+        # Forget finished jobs once their retention period has passed
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] and job["finished_at"] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values()
+                       if job["status"] in ("queued", "running"))
+
+    def status_counts(self):
+        """Number of queued and of running jobs, keyed for ACTIVE_JOBS."""
+        with self._lock:
+            statuses = [job["status"] for job in self._jobs.values()]
+        return {(status,): statuses.count(status) for status in ("queued", "running")}
+
+    def export_metrics(self):
+        """Report this manager's queue depth and worker use on /metrics."""
+        ACTIVE_JOBS.set_function(self.status_counts)
+        WORKER_UTILIZATION.set_function(
+            lambda: min(self.status_counts()[("running",)], self.max_workers) / self.max_workers)
+
+    def submit(self, video_path, output_path=None, result_extras=None, on_success=None,
+               timings=False, **options):
+        """
+        Queue a video for analysis.
+
+        Args:
+            video_path: Path to the input video
+            output_path: Path for the annotated video, or None
+            result_extras: Fields merged into the result when the job succeeds
+            on_success: Called with the final result when the job succeeds
+            timings: Add a per-stage latency breakdown under "timings" to the
+                job's result (it isn't passed to on_success)
+            **options: Keyword arguments passed through to process_video
+
+        Returns:
+            The job id
+
+        Raises:
+            QueueFullError: If the number of active jobs is at capacity, or
+                the manager is draining
+        """
+        with self._lock:
+            self._prune()
+            if self._closed:
+                raise QueueFullError("The server is shutting down, try again later")
+            active = sum(1 for job in self._jobs.values()
+                         if job["status"] in ("queued", "running"))
+            if active >= self.max_workers + self.max_queued:
+                raise QueueFullError(
+                    f"Too many jobs in progress ({active}), try again later")
+            slot = self._free_slots.pop()
+            self._cancel_flags[slot] = 0
+
+            job_id = str(uuid.uuid4())
+            job = {
+                "id": job_id,
+                "status": "queued",
+                "progress": 0.0,
+                "error": None,
+                "result": None,
+                "columns": None,
+                "frames": [],
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "future": None,
+                "executor": None,
+                "result_extras": result_extras or {},
+                "on_success": on_success,
+                "timings": timings,
+                "slot": slot,
+                "cancelled": False,
+            }
+            self._jobs[job_id] = job
+
+            try:
+                executor = self._ensure_executor()
+                try:
+                    future = executor.submit(
+                        _run_job, job_id, slot, video_path, output_path, options)
+                except BrokenProcessPool:
+                    # A worker died (e.g. killed for memory); start a fresh pool
+                    logger.error("Job worker pool is broken, restarting it")
+                    self._discard_executor(executor)
+                    executor = self._ensure_executor()
+                    future = executor.submit(
+                        _run_job, job_id, slot, video_path, output_path, options)
+            except Exception:
+                # Nothing will run the job
+                del self._jobs[job_id]
+                self._free_slots.append(slot)
+                raise
+            job["future"] = future
+            job["executor"] = executor
+
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        return job_id
+
+    def _finish(self, job_id, future):
+        # Record the outcome of a job once its future resolves
+        columns = None
+        latency = None
+        try:
+            if future.cancelled():
+                # Cancelled before it started
+                result, error = None, "Job cancelled"
+            else:
+                result = future.result()
+                error = None if result.get("success", False) else result.get("error", "Unknown error")
+                # Keep the columnar angles next to the JSON-serializable result
+                columns = result.pop("columns", None)
+                # The raw latency histograms only feed the metrics
+                latency = (result.get("pipeline") or {}).pop("latency", None)
+        except Exception as e:
+            logger.error(f"Job {job_id} crashed: {str(e)}")
+            result = None
+            latency = None
+            error = str(e)
+            if isinstance(e, BrokenProcessPool):
+                with self._lock:
+                    job = self._jobs.get(job_id)
+                    if job is not None:
+                        self._discard_executor(job["executor"])
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["finished_at"] = time.time()
+            self._free_slots.append(job["slot"])
+            if job["cancelled"] and error is not None:
+                job["status"] = "cancelled"
+                job["error"] = "Job cancelled"
+            elif error is None:
+                result.update(job["result_extras"])
+                job["status"] = "completed"
+                job["progress"] = 100.0
+                job["result"] = result
+                job["columns"] = columns
+                if job["timings"]:
+                    job["result"] = {**result, "timings": _timings(job, result, latency)}
+            else:
+                job["status"] = "failed"
+                job["error"] = error
+                job["result"] = result
+            # Streamed angles are served from the result from now on
+            job["frames"] = []
+            on_success = job["on_success"]
+            self._changed.notify_all()
+
+        _record_metrics(job, result, columns, latency)
+
+        if error is None and on_success is not None:
+            try:
+                on_success(result)
+            except Exception as e:
+                logger.error(f"Job {job_id} success callback failed: {str(e)}")
+
+    def get(self, job_id):
+        """
+        Get a snapshot of a job's state.
+
+        Args:
+            job_id: Id returned by submit
+
+        Returns:
+            A dict with the job's public fields (the angles are under "result"
+            and, as an AngleColumns, under "columns"), or None if the job is
+            unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {key: value for key, value in job.items()
+                    if key not in ("future", "executor", "result_extras", "on_success", "frames",
+                                   "timings", "slot")}
+
+    def stream(self, job_id, cursor=0, timeout=None, max_frames=1000):
+        """
+        Wait for angles computed after `cursor` frames, or for the job to change.
+
+        A caller that falls behind gets everything that piled up in one batch
+        (up to `max_frames`), so slow consumers receive fewer, larger updates.
+
+        Args:
+            job_id: Id returned by submit
+            cursor: Number of frames the caller has already received
+            timeout: Maximum seconds to wait for something new
+            max_frames: Most frames returned at once
+
+        Returns:
+            A dict with "frames" (new per-frame angle dicts), "cursor" (frames
+            received after this batch), "pending" (frames already available
+            beyond this batch), "status", "progress" and "error", or None if
+            the job is unknown
+        """
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+
+            def available():
+                if job["status"] == "completed":
+                    # Spilled and multi-person results have no single series to stream
+                    return job["result"].get("data", [])
+                return job["frames"]
+
+            state = (job["status"], job["progress"])
+            self._changed.wait_for(
+                lambda: len(available()) > cursor or (job["status"], job["progress"]) != state,
+                timeout=timeout)
+            frames = available()[cursor:cursor + max_frames]
+            return {
+                "frames": frames,
+                "cursor": cursor + len(frames),
+                "pending": max(len(available()) - cursor - len(frames), 0),
+                "status": job["status"],
+                "progress": job["progress"],
+                "error": job["error"]
+            }
+
+    def wait(self, job_id, timeout=None, abandon=None):
+        """
+        Block until a job has finished.
+
+        Args:
+            job_id: Id returned by submit
+            timeout: Maximum seconds to wait, or None to wait forever
+            abandon: Optional threading.Event set once nobody needs the
+                result any more (e.g. the client disconnected); the job is
+                then cancelled and wait returns
+
+        Returns:
+            The job snapshot, as returned by get; its "finished_at" is None
+            if the wait timed out or was abandoned
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        abandoned = False
+        with self._changed:
+            job = self._jobs[job_id]
+            while job["finished_at"] is None:
+                if abandon is not None and abandon.is_set():
+                    abandoned = True
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                if abandon is not None:
+                    remaining = (ABANDON_POLL_SECONDS if remaining is None
+                                 else min(remaining, ABANDON_POLL_SECONDS))
+                self._changed.wait(remaining)
+        if abandoned:
+            self.cancel(job_id)
+        return self.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job.
+
+        A queued job never starts; a running one stops at its next frame. The
+        job ends with the "cancelled" status.
+
+        Args:
+            job_id: Id returned by submit
+
+        Returns:
+            False if the job is unknown or already finished
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["finished_at"] is not None or job["cancelled"]:
+                return False
+            job["cancelled"] = True
+            self._cancel_flags[job["slot"]] = 1
+            future = job["future"]
+        # A job that hasn't started is dropped from the pool's queue
+        future.cancel()
+        logger.info(f"Cancelled job {job_id}")
+        return True
+
+    def drain(self, timeout=None):
+        """
+        Stop accepting jobs, let the active ones finish and stop the pool.
+
+        Args:
+            timeout: Seconds to wait for active jobs; those still queued or
+                running then are cancelled
+
+        Returns:
+            The number of jobs cancelled
+        """
+        with self._changed:
+            self._closed = True
+            self._changed.wait_for(
+                lambda: all(job["finished_at"] is not None for job in self._jobs.values()),
+                timeout=timeout)
+            remaining = [job_id for job_id, job in self._jobs.items()
+                         if job["finished_at"] is None]
+        for job_id in remaining:
+            self.cancel(job_id)
+        self.shutdown(wait=True)
+        return len(remaining)
+
+    def warm_up(self):
+        """
+        Start the worker processes now so the first job doesn't wait for them
+        to load their models. Returns without waiting for them to be ready.
+        """
+        with self._lock:
+            executor = self._ensure_executor()
+            # One task per worker makes the pool start all of them
+            for _ in range(self.max_workers):
+                executor.submit(_ready)
+
+    def shutdown(self, wait=True):
+        """Stop the worker pool, optionally waiting for running jobs."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._progress_queue.put(None)
+            self._executor = None
@@ -0,0 +1,183 @@
+"""
+Stored pose landmarks, so results can be recomputed without inference.
+
+Every analysis writes the raw (N, 33, 4) landmark tensor it found (x, y, z
+and visibility per landmark, NaN for frames without a pose) to a single file
+next to the upload. New joint sets, a visibility threshold or smoothing are
+then a vectorized pass over a memory-mapped array (see reanalyze), and
+processing.render_video redraws the annotated video from it without running
+the pose model.
+
+File layout: an 8 byte magic, then a JSON header padded to HEADER_BYTES, then
+the landmarks as little-endian float32 rows of 33 x 4, then, for runs that
+sampled frames, one byte per frame marking those that went through inference.
+The file is written under a temporary name and renamed into place when
+complete, so a file that exists can always be read.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from angles import AngleEngine, NUM_LANDMARKS
+from columnar import AngleColumns
+from sampling import interpolate
+from summary import smooth
+
+MAGIC = b"POSELMK1"
+
+# Bytes reserved for the magic and header before the landmark rows
+HEADER_BYTES = 4096
+
+EXTENSION = ".landmarks"
+
+# Bytes per frame of landmarks
+_ROW_BYTES = NUM_LANDMARKS * 4 * 4
+
+
+class LandmarkWriter:
+    """
+    Append per-frame landmarks to a landmark file.
+
+    Args:
+        path: File to create
+        fps: Frame rate of the video
+        width: Frame width of the video
+        height: Frame height of the video
+        **meta: Other JSON-serializable fields stored in the header
+    """
+
+    def __init__(self, path, fps, width, height, **meta):
+        self.path = path
+        self.frames = 0
+        self._header = {"fps": fps, "width": width, "height": height, **meta}
+        self._temp_path = f"{path}.{os.getpid()}.tmp"
+        self._file = open(self._temp_path, "wb")
+        self._file.write(b"\0" * HEADER_BYTES)
+
+    def append(self, landmarks):
+        """Write the (n, 33, 4) landmarks of the next frames."""
+        self._file.write(np.ascontiguousarray(landmarks, dtype="<f4").tobytes())
+        self.frames += len(landmarks)
+
+    def close(self, sampled=None):
+        """
+        Finish the file.
+
+        Args:
+            sampled: (N,) bool array of the frames that went through inference
+                when frames were sampled, None if they all did
+        """
+        if sampled is not None:
+            self._file.write(np.asarray(sampled, dtype=bool)[:self.frames].tobytes())
+        header = json.dumps({**self._header, "frames": self.frames,
+                             "sampled": sampled is not None}).encode()
+        if len(MAGIC) + len(header) > HEADER_BYTES:
+            self.abort()
+            raise ValueError("Landmark file header is too large")
+        self._file.seek(0)
+        self._file.write(MAGIC + header)
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        """Close and delete an unfinished file."""
+        self._file.close()
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
+
+
+class LandmarkReader:
+    """
+    Memory-mapped view of a landmark file.
+
+    Args:
+        path: Landmark file
+
+    Raises:
+        FileNotFoundError: If the file doesn't exist
+        ValueError: If it isn't a landmark file
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            head = f.read(HEADER_BYTES)
+        if not head.startswith(MAGIC):
+            raise ValueError(f"Not a landmark file: {path}")
+        self.meta = json.loads(head[len(MAGIC):].rstrip(b"\0"))
+        self.path = path
+        self.frames = self.meta["frames"]
+        self.fps = self.meta["fps"]
+        self.width = self.meta["width"]
+        self.height = self.meta["height"]
+        if self.frames:
+            self.landmarks = np.memmap(path, dtype="<f4", mode="r", offset=HEADER_BYTES,
+                                       shape=(self.frames, NUM_LANDMARKS, 4))
+        else:
+            self.landmarks = np.empty((0, NUM_LANDMARKS, 4), dtype=np.float32)
+        self.sampled = None
+        if self.meta["sampled"] and self.frames:
+            self.sampled = np.memmap(path, dtype=bool, mode="r",
+                                     offset=HEADER_BYTES + self.frames * _ROW_BYTES,
+                                     shape=(self.frames,))
+
+    def __len__(self):
+        return self.frames
+
+    def frame_range(self, start=None, end=None):
+        """
+        Frames whose timestamps fall in [start, end) seconds.
+
+        Returns:
+            A (first, stop) pair of frame indices
+        """
+        first = 0 if start is None else min(max(int(np.ceil(start * self.fps)), 0),
+                                             self.frames)
+        stop = self.frames if end is None else min(max(int(np.ceil(end * self.fps)), 0),
+                                                   self.frames)
+        return first, max(stop, first)
+
+
+def reanalyze(reader, joints=None, min_visibility=None, smoothing=None, first=0, stop=None):
+    """
+    Compute angles from stored landmarks.
+
+    Args:
+        reader: A LandmarkReader
+        joints: Joint names from angles.JOINTS (default: the default set)
+        min_visibility: Report angles whose landmarks are less visible than
+            this as missing
+        smoothing: None, "one-euro" or "savgol" (see summary.py)
+        first: First frame
+        stop: Frame to stop before (default: the last one)
+
+    Returns:
+        An AngleColumns
+
+    Raises:
+        ValueError: If a joint or the smoothing method is unknown
+    """
+    engine = AngleEngine(joints, min_visibility)
+    stop = len(reader) if stop is None else min(stop, len(reader))
+    first = min(max(first, 0), stop)
+    if reader.sampled is not None and first < stop:
+        # Start from the sample before the window so its skipped frames at
+        # the start can be interpolated
+        samples = np.flatnonzero(reader.sampled[:first + 1])
+        anchor = int(samples[-1]) if len(samples) else first
+        angles = engine.compute(reader.landmarks[anchor:stop])
+        sampled = np.array(reader.sampled[anchor:stop])
+        sampled[0] = True
+        angles = interpolate(angles, sampled)[first - anchor:]
+        detected = ~np.isnan(reader.landmarks[first:stop, 0, 0])
+        detected |= ~sampled[first - anchor:] & np.isfinite(angles).any(axis=1)
+    else:
+        angles = engine.compute(reader.landmarks[first:stop])
+        detected = ~np.isnan(reader.landmarks[first:stop, 0, 0])
+    timestamps = np.arange(first, stop) / reader.fps
+    if smoothing:
+        angles = smooth(timestamps, angles, smoothing)
+    return AngleColumns.from_angle_matrix(engine.names, angles, timestamps, detected)
@@ -0,0 +1,193 @@
+"""
+Minimal Prometheus metrics in the text exposition format.
+
+Counters, gauges and histograms with labels, kept in a Registry that renders
+them for a /metrics endpoint. Updates take a lock and a dict lookup, so they
+are cheap enough to leave on; per-frame timings are not sent here one by one
+but collected per job by the pipeline (see pipeline.StageStats) and merged in
+when the job finishes.
+
+Only what this app needs is implemented, so there is no dependency on
+prometheus_client.
+"""
+
+import math
+import threading
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+               for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, label_values, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}"
+                         f"{_format_labels(self.label_names, label_values, extra)} "
+                         f"{_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            return [("_total", key, (), value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, or be read from a function at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=(), registry=None):
+        super().__init__(name, documentation, labels, registry)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """
+        Read the gauge from `function` when scraped. It returns a number, or
+        for a labelled gauge a dict mapping label value tuples to numbers.
+        """
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            values = self._function()
+            if not isinstance(values, dict):
+                values = {(): values}
+            return [("", key, (), value) for key, value in values.items()]
+        with self._lock:
+            return [("", key, (), value) for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values over fixed buckets.
+
+    Args:
+        buckets: Upper bounds of the buckets, ascending (+Inf is added)
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=(), registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labels, registry)
+
+    def _entry(self, key):
+        # [per-bucket counts (last is +Inf), sum, count]
+        if key not in self._values:
+            self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        return self._values[key]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound),
+                     len(self.buckets))
+        with self._lock:
+            entry = self._entry(key)
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def merge(self, counts, total, count, **labels):
+        """
+        Add observations already bucketed elsewhere.
+
+        Args:
+            counts: Per-bucket (not cumulative) counts over the same buckets,
+                with the +Inf bucket last
+            total: Sum of the observed values
+            count: Number of observations
+        """
+        if len(counts) != len(self.buckets) + 1:
+            raise ValueError(f"{self.name} has {len(self.buckets) + 1} buckets")
+        key = self._key(labels)
+        with self._lock:
+            entry = self._entry(key)
+            for i, value in enumerate(counts):
+                entry[0][i] += value
+            entry[1] += total
+            entry[2] += count
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, value in zip(self.buckets + (math.inf,), counts):
+                    cumulative += value
+                    samples.append(("_bucket", key, [("le", _format_value(bound))], cumulative))
+                samples.append(("_sum", key, (), total))
+                samples.append(("_count", key, (), count))
+        return samples
+
+
+class Registry:
+    """A set of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+
+    def render(self):
+        """Return every metric in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# Registry served on /metrics
+REGISTRY = Registry()
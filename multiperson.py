@@ -0,0 +1,497 @@
+"""
+Multi-person pose tracking.
+
+MediaPipe Pose finds one person per image, so in multi-person mode every
+person gets a pose detector of their own, fed a crop of the frame around
+them. A person detector (OpenCV's HOG people detector) runs every
+`detect_every` frames to find people; in between, each person is followed by
+their own landmarks, which give the box the next frame is cropped to.
+Detections are matched to the people already tracked by box overlap (IoU), or
+by how close their centres are when someone moved too far for the boxes to
+overlap. Unmatched detections start new tracks, and a track ends once its
+pose has been lost for TRACK_MAX_MISSES frames, or at a detection that doesn't
+find it while it is lost.
+
+Each track checks a detector out of the process's pose pool, so the pose work
+per frame grows with the number of people and `max_people` bounds it, while
+the cost of the person detector is spread over `detect_every` frames.
+Landmarks found in a crop are mapped back to the full frame, so angles,
+drawing and results are the same as for a single person.
+"""
+
+import logging
+import os
+import time
+
+import cv2
+import numpy as np
+
+import processing
+from angles import AngleEngine, LandmarkBuffer
+from overlay import OverlayRenderer
+from pipeline import Pipeline, END
+from profiles import get_profile, validate_profile, inference_size
+from roi import ROI_MAX_SHRINK, to_frame_landmarks, landmark_box, padded_roi
+from video_io import create_writer
+
+logger = logging.getLogger(__name__)
+
+# Frames between two runs of the person detector, and the most people tracked
+# at once (each needs its own pose detector from the pool)
+DETECT_EVERY = int(os.environ.get("MULTI_PERSON_DETECT_EVERY", 15))
+MAX_PEOPLE = int(os.environ.get("MULTI_PERSON_MAX_PEOPLE", 4))
+
+# Longest side of the image given to the person detector, and the lowest SVM
+# score of a detection that is kept
+DETECT_MAX_DIMENSION = 640
+DETECT_MIN_SCORE = 0.5
+
+# Detections overlapping more than this (IoU) are merged by non-maximum
+# suppression
+DETECT_NMS_IOU = 0.4
+
+# A detection continues a track if their boxes overlap at least MATCH_MIN_IOU,
+# or failing that if their centres are closer than MATCH_MAX_DISTANCE times
+# the track box's diagonal
+MATCH_MIN_IOU = 0.3
+MATCH_MAX_DISTANCE = 0.5
+
+# Two boxes are the same person when this much of the smaller one lies in
+# the other: such a detection doesn't start a track, and of two such tracks
+# the newer one ends
+DUPLICATE_OVERLAP = 0.6
+
+# Consecutive frames without a pose after which a track ends
+TRACK_MAX_MISSES = 30
+
+# Tracks whose pose was found in fewer frames than this (usually a false
+# detection, or a duplicate that ended) are left out of the results
+TRACK_MIN_FRAMES = 5
+
+# Frames in flight between the decode, inference, annotate and encode stages
+PIPELINE_BUFFER_FRAMES = 8
+
+
+class HOGPersonDetector:
+    """
+    Find people with OpenCV's HOG + linear SVM people detector.
+
+    Frames are scaled down to DETECT_MAX_DIMENSION first; people need to be
+    about 128 pixels tall at that size to be found.
+    """
+
+    def __init__(self, max_dimension=DETECT_MAX_DIMENSION, min_score=DETECT_MIN_SCORE):
+        self.max_dimension = max_dimension
+        self.min_score = min_score
+        self._hog = cv2.HOGDescriptor()
+        self._hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+
+    def __call__(self, frame):
+        """
+        Detect people in a BGR frame.
+
+        Returns:
+            An (n, 4) array of x, y, width, height boxes in frame pixels
+        """
+        height, width = frame.shape[:2]
+        size = inference_size(width, height, self.max_dimension)
+        scale = width / size[0]
+        if size != (width, height):
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        boxes, scores = self._hog.detectMultiScale(frame, winStride=(8, 8), padding=(8, 8),
+                                                   scale=1.05)
+        if len(boxes) == 0:
+            return np.empty((0, 4))
+        scores = np.asarray(scores, dtype=np.float64).ravel()
+        keep = cv2.dnn.NMSBoxes(np.asarray(boxes).tolist(), scores.tolist(),
+                                self.min_score, DETECT_NMS_IOU)
+        keep = np.asarray(keep, dtype=int).ravel()
+        return np.asarray(boxes, dtype=np.float64)[keep] * scale
+
+
+def box_iou(a, b):
+    """Intersection over union of two x, y, width, height boxes."""
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    intersection = max(x1 - x0, 0) * max(y1 - y0, 0)
+    union = a[2] * a[3] + b[2] * b[3] - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def box_overlap(a, b):
+    """Fraction of the smaller of two x, y, width, height boxes inside the other."""
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    intersection = max(x1 - x0, 0) * max(y1 - y0, 0)
+    smaller = min(a[2] * a[3], b[2] * b[3])
+    return intersection / smaller if smaller > 0 else 0.0
+
+
+def match_boxes(tracked, detected):
+    """
+    Pair tracked boxes with detected ones.
+
+    Pairs are chosen greedily: the most overlapping first, then, for boxes
+    that don't overlap enough, the closest centres.
+
+    Args:
+        tracked: Boxes of the current tracks
+        detected: Boxes of the new detections
+
+    Returns:
+        A list of (track index, detection index) pairs
+    """
+    candidates = []
+    for i, a in enumerate(tracked):
+        for j, b in enumerate(detected):
+            iou = box_iou(a, b)
+            distance = np.hypot(a[0] + a[2] / 2 - b[0] - b[2] / 2,
+                                a[1] + a[3] / 2 - b[1] - b[3] / 2) / np.hypot(a[2], a[3])
+            if iou >= MATCH_MIN_IOU:
+                candidates.append((0, -iou, i, j))
+            elif distance <= MATCH_MAX_DISTANCE:
+                candidates.append((1, distance, i, j))
+    pairs = []
+    used_tracks, used_detections = set(), set()
+    for _, _, i, j in sorted(candidates):
+        if i not in used_tracks and j not in used_detections:
+            pairs.append((i, j))
+            used_tracks.add(i)
+            used_detections.add(j)
+    return pairs
+
+
+class Track:
+    """
+    One tracked person: their box, pose detector and landmarks.
+
+    Args:
+        track_id: Id reported in the results
+        box: Initial x, y, width, height box in frame pixels
+        pose: Pose detector checked out for this person
+        first_frame: Index of the frame the track starts at
+    """
+
+    def __init__(self, track_id, box, pose, first_frame):
+        self.id = track_id
+        self.box = np.asarray(box, dtype=np.float64)
+        self.pose = pose
+        self.first_frame = first_frame
+        self.buffer = LandmarkBuffer()
+        self.misses = 0
+        # Landmarks of the current frame in full-frame coordinates, or None
+        self.landmarks = None
+
+    def follow(self, box):
+        """Move to the box around this frame's landmarks."""
+        centre = box[:2] + box[2:] / 2
+        size = np.maximum(box[2:], self.box[2:] * ROI_MAX_SHRINK)
+        self.box = np.concatenate([centre - size / 2, size])
+
+    def roi(self, width, height):
+        """Padded crop rectangle (x0, y0, x1, y1) of the box, within the frame."""
+        return padded_roi(self.box, width, height)
+
+
+class PersonTracker:
+    """
+    Keep tracks of people from periodic detections and per-frame poses.
+
+    Args:
+        profile: Processing profile of the pose detectors
+        max_people: Most tracks alive at once
+        max_dimension: Longest side of the crops given to the pose model
+    """
+
+    def __init__(self, profile=None, max_people=MAX_PEOPLE, max_dimension=None):
+        self.profile = validate_profile(profile)
+        self.max_people = max_people
+        self.max_dimension = max_dimension
+        self.tracks = []
+        self.finished = []
+        self._next_id = 1
+
+    def update(self, boxes, frame_idx):
+        """
+        Match a round of detections to the tracks.
+
+        Tracks that lost their pose move to the box they were detected in
+        (the others keep following their landmarks), tracks that were lost and
+        not detected end, and the other detections start new tracks while
+        there is room.
+        """
+        pairs = match_boxes([track.box for track in self.tracks], boxes)
+        matched = {i for i, _ in pairs}
+        for i, j in pairs:
+            if self.tracks[i].misses:
+                self.tracks[i].box = np.asarray(boxes[j], dtype=np.float64)
+        for i, track in enumerate(list(self.tracks)):
+            if i not in matched and track.misses:
+                self._end(track)
+
+        # Start with the detections found with the most confidence (the
+        # detector returns them in that order)
+        detected = {j for _, j in pairs}
+        for j, box in enumerate(boxes):
+            if j in detected or len(self.tracks) >= self.max_people:
+                continue
+            if any(box_overlap(track.box, box) >= DUPLICATE_OVERLAP for track in self.tracks):
+                continue
+            pose = processing.pose_pool.acquire(self.profile)
+            self.tracks.append(Track(self._next_id, box, pose, frame_idx))
+            self._next_id += 1
+
+    def process(self, frame):
+        """
+        Run every track's pose detector on its crop of a BGR frame.
+
+        Each track stores the frame's landmarks (or an empty row) and follows
+        the landmarks to its next box.
+        """
+        height, width = frame.shape[:2]
+        for track in self.tracks:
+            x0, y0, x1, y1 = roi = track.roi(width, height)
+            track.landmarks = None
+            if x1 - x0 > 1 and y1 - y0 > 1:
+                crop = frame[y0:y1, x0:x1]
+                size = inference_size(x1 - x0, y1 - y0, self.max_dimension)
+                if size != (x1 - x0, y1 - y0):
+                    crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+                results = track.pose.process(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB))
+                if results.pose_landmarks:
+                    landmarks = to_frame_landmarks(results.pose_landmarks, roi, width, height)
+                    box = landmark_box(landmarks, roi, width, height)
+                    if box is not None:
+                        track.landmarks = landmarks
+                        track.follow(box)
+            track.buffer.append(track.landmarks)
+            track.misses = 0 if track.landmarks is not None else track.misses + 1
+
+        for track in list(self.tracks):
+            if track.misses >= TRACK_MAX_MISSES:
+                self._end(track)
+        # Tracks that ended up on the same person: keep the older one
+        for track in list(self.tracks):
+            if any(other.id < track.id and box_overlap(other.box, track.box) >= DUPLICATE_OVERLAP
+                   for other in self.tracks):
+                self._end(track)
+
+    def _end(self, track):
+        self.tracks.remove(track)
+        processing.pose_pool.release(self.profile, track.pose)
+        track.pose = None
+        self.finished.append(track)
+
+    def close(self):
+        """End every track, returning their pose detectors to the pool."""
+        for track in list(self.tracks):
+            self._end(track)
+
+
+# Annotate stage: draw every person's overlay and id onto decoded frames
+def _annotate_people(ring, to_annotate, to_encode, stats, renderer):
+    while True:
+        item = to_annotate.get()
+        if item is END:
+            break
+        slot, people, names, timestamp = item
+        start = time.perf_counter()
+        frame = ring.slots[slot]
+        if renderer.skeleton_mode:
+            frame.fill(0)
+        for track_id, landmarks, angles, vertices, box in people:
+            renderer.draw(frame, landmarks, names, angles, vertices, timestamp)
+            x, y = int(box[0]), max(int(box[1]) - 10, 20)
+            cv2.putText(frame, f"#{track_id}", (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8,
+                        (0, 0, 0), 4, cv2.LINE_AA)
+            cv2.putText(frame, f"#{track_id}", (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8,
+                        (0, 255, 255), 2, cv2.LINE_AA)
+        stats.add(time.perf_counter() - start)
+        to_encode.put(slot)
+    to_encode.put(END)
+
+
+def process_video_multi(video_path, output_path=None, skeleton_mode=False,
+                        progress_callback=None, joints=None, profile=None,
+                        max_dimension=None, preview_path=None, encoder=None,
+                        detect_every=DETECT_EVERY, max_people=MAX_PEOPLE, detector=None):
+    """
+    Track every person in a video and measure their joint angles.
+
+    Args:
+        video_path: Path to the input video
+        output_path: Where to write the annotated video, or None
+        skeleton_mode: Draw the skeletons on black instead of the video
+        progress_callback: Called as `progress_callback(progress, frame_idx)`
+            once per frame
+        joints: Joint names to measure, as for process_video
+        profile: Processing profile of the pose detectors (see profiles.py)
+        max_dimension: Overrides the profile's inference resolution; crops
+            larger than it are scaled down before inference
+        preview_path: Where to write a smaller rendition of the annotated video
+        encoder: Encoder of the annotated video, as for process_video
+        detect_every: Frames between two runs of the person detector
+        max_people: Most people tracked at once; capped by the pose pool size
+        detector: Called with a BGR frame, returns (n, 4) x, y, width, height
+            person boxes (default: a HOGPersonDetector)
+
+    Returns:
+        A result dict like process_video's, with per-person angles under
+        "people" (keyed by track id) instead of "data", and a "multi_person"
+        entry with the tracking statistics
+    """
+    if detect_every < 1:
+        raise ValueError("detect_every must be at least 1")
+    tracker = PersonTracker(profile, min(max_people, processing.pose_pool.max_size),
+                            max_dimension or get_profile(profile)["max_dimension"])
+    detector = detector or HOGPersonDetector()
+    try:
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            logger.error(f"Error opening video file: {video_path}")
+            return {"error": "Failed to open video file"}
+
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        out = None
+        if output_path:
+            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+            out = create_writer(output_path, fps, width, height, encoder, preview_path)
+            if not out.isOpened():
+                logger.warning(f"Failed to initialize the video encoder. Output may not be saved.")
+
+        engine = AngleEngine(joints)
+        frame_idx = 0
+        detections = 0
+        detected_frames = 0
+        people_frames = 0
+
+        # Decode (and annotate and encode) on their own threads, as in
+        # process_video; crops need the full-size frames
+        pipeline = Pipeline()
+        ring = pipeline.ring(PIPELINE_BUFFER_FRAMES, (height, width, 3))
+        decoded = pipeline.queue("decoded", PIPELINE_BUFFER_FRAMES)
+        to_annotate = pipeline.queue("annotate", PIPELINE_BUFFER_FRAMES) if out else None
+        to_encode = pipeline.queue("encode", PIPELINE_BUFFER_FRAMES) if out else None
+        inference_stats = pipeline.stage("inference")
+        detect_stats = pipeline.step("detect")
+        pose_stats = pipeline.step("pose")
+        pipeline.spawn("decode", processing._decode_frames, cap, ring, decoded,
+                       pipeline.stage("decode"))
+        if out:
+            pipeline.spawn("annotate", _annotate_people, ring, to_annotate, to_encode,
+                           pipeline.stage("annotate"), OverlayRenderer(skeleton_mode))
+            pipeline.spawn("encode", processing._encode_frames, out, ring, to_encode,
+                           pipeline.stage("encode"))
+
+        try:
+            while True:
+                slot = decoded.get()
+                if slot is END:
+                    break
+                frame = ring.slots[slot]
+
+                if progress_callback:
+                    progress_callback((frame_idx / frame_count) * 100 if frame_count > 0 else 0,
+                                      frame_idx)
+
+                start = time.perf_counter()
+                if frame_idx % detect_every == 0:
+                    tracker.update(detector(frame), frame_idx)
+                    detections += 1
+                detected = time.perf_counter()
+                detect_stats.add(detected - start)
+                tracker.process(frame)
+                pose_stats.add(time.perf_counter() - detected)
+
+                people = [track for track in tracker.tracks if track.landmarks is not None]
+                people_frames += len(people)
+                detected_frames += bool(people)
+
+                # Hand frames with someone on them to the annotate stage
+                if out and people:
+                    annotations = []
+                    for track in people:
+                        row = track.buffer.size - 1
+                        frame_landmarks = track.buffer.rows(row, row + 1)
+                        annotations.append((track.id, frame_landmarks[0].copy(),
+                                            engine.compute(frame_landmarks)[0],
+                                            engine.vertices(frame_landmarks)[0], track.box))
+                    inference_stats.add(time.perf_counter() - start)
+                    to_annotate.put((slot, annotations, engine.names, frame_idx / fps))
+                else:
+                    inference_stats.add(time.perf_counter() - start)
+                    ring.release(slot)
+
+                frame_idx += 1
+
+            if to_annotate:
+                to_annotate.put(END)
+        except BaseException:
+            pipeline.abort()
+            raise
+        finally:
+            try:
+                pipeline.join()
+            finally:
+                cap.release()
+                if out:
+                    out.release()
+                tracker.close()
+
+        if frame_count <= 0:
+            frame_count = frame_idx
+
+        # Angles of every person over the frames they were tracked, up to the
+        # last one their pose was found in
+        start = time.perf_counter()
+        people = {}
+        for track in sorted(tracker.finished, key=lambda track: track.id):
+            landmarks, detected = track.buffer.view()
+            if detected.sum() < TRACK_MIN_FRAMES:
+                continue
+            landmarks = landmarks[:np.flatnonzero(detected)[-1] + 1]
+            angles = engine.compute(landmarks)
+            timestamps = (track.first_frame + np.arange(len(landmarks))) / fps
+            people[str(track.id)] = {
+                "first_frame": track.first_frame,
+                "frames": len(landmarks),
+                "detected_frames": int(detected.sum()),
+                "data": engine.to_frame_dicts(angles, timestamps)
+            }
+        pipeline.step("angles").add(time.perf_counter() - start)
+
+        pipeline_stats = pipeline.report()
+        logger.info(f"Tracked {len(people)} people in {video_path}, "
+                    f"{frame_idx / pipeline_stats['wall_seconds']:.1f} fps overall")
+
+        return {
+            "success": True,
+            "people": people,
+            "multi_person": {
+                "detect_every": detect_every,
+                "max_people": tracker.max_people,
+                "detections": detections,
+                "tracks": len(people),
+                "frames": frame_idx,
+                "detected_frames": detected_frames,
+                "mean_people": people_frames / frame_idx if frame_idx else 0.0,
+                "joints": list(engine.names)
+            },
+            "pipeline": pipeline_stats,
+            "video_info": {
+                "frame_count": frame_count,
+                "fps": fps,
+                "width": width,
+                "height": height,
+                "duration": frame_count / fps
+            },
+            "profile": {"name": validate_profile(profile)}
+        }
+
+    except Exception as e:
+        logger.error(f"Error processing video: {str(e)}")
+        return {"success": False, "error": str(e)}
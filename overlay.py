@@ -0,0 +1,189 @@
+"""
+Overlay drawing for annotated videos.
+
+An OverlayRenderer is created once per video: the drawing specs, the pose
+connections as index arrays, the size of every text it can draw and a sprite
+of the landmark circle are worked out up front, so each frame only projects
+its landmarks to pixels in one vectorized pass, stamps the sprite at each of
+them and issues the remaining OpenCV calls. The output is pixel for
+pixel what MediaPipe's draw_landmarks plus the angle labels, arcs and
+timestamp drew before (python -m benchmarks.overlay checks it).
+
+draw returns the rectangles it touched, one around the timestamp and one
+around the person. Callers that draw onto frames holding nothing but an
+earlier overlay (skeleton mode without decoded pictures) pass them to clear
+instead of blanking the whole frame.
+"""
+
+import cv2
+import numpy as np
+import mediapipe as mp
+
+from angles import JOINT_LABELS
+
+# Landmarks less visible than this are not drawn, as in MediaPipe's drawing utils
+VISIBILITY_THRESHOLD = 0.5
+
+# Border color MediaPipe draws around landmark circles
+_BORDER_COLOR = (224, 224, 224)
+_TEXT_COLOR = (255, 255, 255)
+_OUTLINE_COLOR = (0, 0, 0)
+_ARC_COLOR = (0, 255, 0)
+_ARC_RADIUS = 30
+
+_FONT = cv2.FONT_HERSHEY_SIMPLEX
+_LABEL_SCALE = 0.5
+_TIME_SCALE = 1
+_TIME_ORIGIN = (10, 30)
+
+# Widest texts drawn, used to bound the dirty rectangle
+_ANGLE_TEMPLATE = "000.0°"
+_TIME_TEMPLATE = "Time: 00000.00s"
+
+_CONNECTIONS = np.array(sorted(mp.solutions.pose.POSE_CONNECTIONS), dtype=np.intp)
+
+
+class OverlayRenderer:
+    """
+    Draw the skeleton, joint angles and timestamp onto BGR frames.
+
+    Args:
+        skeleton_mode: Use the skeleton mode colors (the caller blanks the
+            frame first)
+    """
+
+    def __init__(self, skeleton_mode=False):
+        self.skeleton_mode = skeleton_mode
+        if skeleton_mode:
+            # Bright green landmarks and white connections for visibility on black
+            self.landmark_color, self.landmark_thickness, self.landmark_radius = (0, 255, 0), 5, 5
+            self.connection_color, self.connection_thickness = (255, 255, 255), 3
+        else:
+            self.landmark_color, self.landmark_thickness, self.landmark_radius = (0, 0, 255), 3, 3
+            self.connection_color, self.connection_thickness = (0, 255, 0), 2
+        self.border_radius = max(self.landmark_radius + 1, int(self.landmark_radius * 1.2))
+
+        # A landmark is a bordered circle drawn the same way wherever it is,
+        # so it is drawn once into a sprite that is copied onto frames (except
+        # next to the frame edge, where OpenCV clips it differently)
+        self._extent = self.border_radius + self.landmark_thickness
+        size = 2 * self._extent + 1
+        stamp = np.zeros((size, size), dtype=np.uint8)
+        cv2.circle(stamp, (self._extent, self._extent), self.border_radius, 1,
+                   self.landmark_thickness)
+        cv2.circle(stamp, (self._extent, self._extent), self.landmark_radius, 2,
+                   self.landmark_thickness)
+        self._sprite = np.zeros((size, size, 3), dtype=np.uint8)
+        self._sprite[stamp == 1] = _BORDER_COLOR
+        self._sprite[stamp == 2] = self.landmark_color
+        self._sprite_mask = (stamp > 0)[..., None]
+
+        # Text is outlined in black except in skeleton mode
+        self.outline = not skeleton_mode
+        text_thickness = 4 if self.outline else 2
+
+        self._arc_margin = _ARC_RADIUS + 2
+        self._labels = {}
+        self._label_boxes = {}
+        for name, label in JOINT_LABELS.items():
+            self._labels[name] = f"{label}: "
+            (text_width, text_height), baseline = cv2.getTextSize(
+                self._labels[name] + _ANGLE_TEMPLATE, _FONT, _LABEL_SCALE, text_thickness)
+            # Offsets from the text origin
+            self._label_boxes[name] = (-text_thickness, -text_height - text_thickness,
+                                       text_width + text_thickness, baseline + text_thickness)
+        (text_width, text_height), baseline = cv2.getTextSize(
+            _TIME_TEMPLATE, _FONT, _TIME_SCALE, text_thickness)
+        x, y = _TIME_ORIGIN
+        self._time_box = (x - text_thickness, y - text_height - text_thickness,
+                          x + text_width + text_thickness, y + baseline + text_thickness)
+
+    def draw(self, frame, landmarks, names, angles, vertices, timestamp):
+        """
+        Draw one frame's overlay in place.
+
+        Args:
+            frame: BGR frame
+            landmarks: (33, 4) array of normalized x, y, z and visibility
+            names: Joint names of `angles` and `vertices`
+            angles: (J,) angles in degrees, NaN where not measured
+            vertices: (J, 2) normalized positions of the joints' vertices
+            timestamp: Frame time in seconds
+
+        Returns:
+            The (x0, y0, x1, y1) rectangles drawn into, within the frame
+        """
+        height, width = frame.shape[:2]
+        # Bounds of the person's overlay
+        x0, y0, x1, y1 = width, height, -1, -1
+
+        # Landmarks that are visible and inside the frame, in pixels
+        x = landmarks[:, 0].astype(np.float64)
+        y = landmarks[:, 1].astype(np.float64)
+        visible = (landmarks[:, 3] >= VISIBILITY_THRESHOLD) & (x >= 0) & (x <= 1) & (y >= 0) & (y <= 1)
+        if visible.any():
+            points = np.empty((len(landmarks), 2), dtype=np.int32)
+            points[:, 0] = np.minimum(np.floor(np.where(visible, x, 0) * width), width - 1)
+            points[:, 1] = np.minimum(np.floor(np.where(visible, y, 0) * height), height - 1)
+
+            # Connections between two visible landmarks, then the landmarks
+            # over them
+            shown = visible[_CONNECTIONS[:, 0]] & visible[_CONNECTIONS[:, 1]]
+            if shown.any():
+                cv2.polylines(frame, list(points[_CONNECTIONS[shown]]), False,
+                              self.connection_color, self.connection_thickness)
+            drawn = points[visible]
+            extent = self._extent
+            for px, py in drawn.tolist():
+                if extent < px < width - extent - 1 and extent < py < height - extent - 1:
+                    np.copyto(frame[py - extent:py + extent + 1, px - extent:px + extent + 1],
+                              self._sprite, where=self._sprite_mask)
+                else:
+                    cv2.circle(frame, (px, py), self.border_radius, _BORDER_COLOR,
+                               self.landmark_thickness)
+                    cv2.circle(frame, (px, py), self.landmark_radius, self.landmark_color,
+                               self.landmark_thickness)
+            low = drawn.min(axis=0) - extent
+            high = drawn.max(axis=0) + extent
+            x0, y0 = min(x0, int(low[0])), min(y0, int(low[1]))
+            x1, y1 = max(x1, int(high[0])), max(y1, int(high[1]))
+
+        # Angle labels and arcs at their vertices
+        for name, point, angle in zip(names, vertices, angles):
+            if not np.isfinite(angle):
+                continue
+            x = int(point[0] * width)
+            y = int(point[1] * height)
+            if not (0 <= x < width and 0 <= y < height):
+                continue
+            text = f"{self._labels[name]}{angle:.1f}°"
+            if self.outline:
+                cv2.putText(frame, text, (x, y), _FONT, _LABEL_SCALE,
+                            _OUTLINE_COLOR, 4, cv2.LINE_AA)
+            cv2.putText(frame, text, (x, y), _FONT, _LABEL_SCALE,
+                        _TEXT_COLOR, 2, cv2.LINE_AA)
+            cv2.ellipse(frame, (x, y), (_ARC_RADIUS, _ARC_RADIUS), 0, 0, angle,
+                        _ARC_COLOR, 2, cv2.LINE_AA)
+            left, top, right, bottom = self._label_boxes[name]
+            x0, y0 = min(x0, x + left, x - self._arc_margin), min(y0, y + top, y - self._arc_margin)
+            x1 = max(x1, x + right, x + self._arc_margin)
+            y1 = max(y1, y + bottom, y + self._arc_margin)
+
+        time_text = f"Time: {timestamp:.2f}s"
+        if self.outline:
+            cv2.putText(frame, time_text, _TIME_ORIGIN, _FONT, _TIME_SCALE,
+                        _OUTLINE_COLOR, 4, cv2.LINE_AA)
+        cv2.putText(frame, time_text, _TIME_ORIGIN, _FONT, _TIME_SCALE,
+                    _TEXT_COLOR, 2, cv2.LINE_AA)
+
+        rects = [self._time_box]
+        if x1 >= 0:
+            rects.append((x0, y0, x1 + 1, y1 + 1))
+        return [(max(x0, 0), max(y0, 0), min(x1, width), min(y1, height))
+                for x0, y0, x1, y1 in rects]
+
+    @staticmethod
+    def clear(frame, rects):
+        """Black out the rectangles returned by draw."""
+        for x0, y0, x1, y1 in rects:
+            frame[y0:y1, x0:x1] = 0
@@ -0,0 +1,393 @@
+"""
+Segment-parallel video processing for long clips.
+
+The video is split into time segments that are processed by separate worker
+processes, each with its own pose detector. Every segment except the first
+starts decoding a little before its first frame so the tracker and landmark
+smoothing have warmed up by the time results are kept; the warm-up frames are
+discarded. Landmarks from all segments are stitched back together in frame
+order and the angles are computed in one pass, just like process_video.
+
+Annotated output needs frames in order, so parallel mode only produces angle
+data.
+
+Every analysis gets a pool of segment workers of its own. Since every worker
+holds a pose model, a finished analysis's pool is kept for IDLE_SECONDS and
+reused by the next one that needs as many processes. In job worker processes
+(see jobs.py) running analyses share MAX_SEGMENT_WORKERS process slots across
+all job workers: an analysis gets as many segments as there are free slots,
+and runs serially if there are none. An idle pool holds no slots. A
+cancelled job stops its segments within a frame.
+"""
+
+import logging
+import math
+import multiprocessing
+import multiprocessing.util
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+import processing
+from angles import AngleEngine, LandmarkBuffer
+from columnar import AngleColumns
+from landmark_store import LandmarkWriter
+from profiles import get_profile, validate_profile, inference_size
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on segment worker processes, per process or, under the job
+# manager, across all job workers
+MAX_SEGMENT_WORKERS = int(os.environ.get("PARALLEL_MAX_WORKERS", os.cpu_count() or 1))
+
+# Seconds of video decoded before each segment to warm up the tracker
+DEFAULT_OVERLAP_SECONDS = 1.0
+
+# Segments shorter than this many seconds are not worth a separate worker
+MIN_SEGMENT_SECONDS = 2.0
+
+# Seconds an idle segment worker pool is kept before its processes exit
+IDLE_SECONDS = int(os.environ.get("PARALLEL_IDLE_SECONDS", 60))
+
+# This process's segment worker pools: every running one, so they are all
+# stopped on exit, and the idle one kept for the next analysis, with its
+# number of processes and the timer that shuts it down
+_executors = set()
+_idle_executor = None
+_idle_size = 0
+_idle_timer = None
+_finalizer = None
+_executor_lock = threading.Lock()
+
+# Set by configure: a semaphore with one permit per segment worker process
+# shared by all job workers, and the job cancel flags (also in the segment
+# workers, given by the pool's initializer)
+_process_slots = None
+_cancel_flags = None
+
+
+class SegmentCancelled(Exception):
+    """Raised inside a segment worker when its job was cancelled."""
+
+
+def configure(process_slots=None, cancel_flags=None):
+    """
+    Share limits with the other processes running parallel analyses.
+
+    Args:
+        process_slots: Semaphore with one permit per segment worker process
+            allowed across those processes
+        cancel_flags: Shared byte array with one flag per job slot, as in
+            jobs.py; see the cancel_slot argument of process_video_parallel
+    """
+    global _process_slots, _cancel_flags
+    _process_slots = process_slots
+    _cancel_flags = cancel_flags
+
+
+def _init_segment_worker(cancel_flags):
+    global _cancel_flags
+    _cancel_flags = cancel_flags
+    # Load the default profile's model up front; others load on first use
+    processing.pose_pool.warm([None])
+
+
+def _take_slots(count):
+    # Take up to `count` process slots, returning how many were free
+    if _process_slots is None:
+        return count
+    taken = 0
+    while taken < count and _process_slots.acquire(block=False):
+        taken += 1
+    return taken
+
+
+def _give_slots(count):
+    if _process_slots is not None:
+        for _ in range(count):
+            _process_slots.release()
+
+
+def _acquire_executor(workers):
+    """
+    Check out a segment worker pool of its own for an analysis.
+
+    Takes up to `workers` process slots and reuses the idle pool if it has
+    that many processes (an idle pool of another size is replaced). Returns
+    the pool and its number of processes, or (None, 0) if no process slot is
+    free.
+    """
+    global _idle_executor, _idle_size, _idle_timer, _finalizer
+    size = _take_slots(workers)
+    if not size:
+        return None, 0
+    try:
+        with _executor_lock:
+            executor = None
+            if _idle_executor is not None:
+                _idle_timer.cancel()
+                if _idle_size == size:
+                    executor = _idle_executor
+                else:
+                    _stop_locked(_idle_executor)
+                _idle_executor, _idle_size, _idle_timer = None, 0, None
+            if executor is None:
+                executor = ProcessPoolExecutor(
+                    max_workers=size,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_segment_worker, initargs=(_cancel_flags,))
+                _executors.add(executor)
+            if _finalizer is None:
+                # A job worker process joins its children on exit before the
+                # executor's own atexit hook runs, so stop the pools first, and
+                # before the finalizers (priority 10) that close their queues
+                _finalizer = multiprocessing.util.Finalize(None, shutdown, exitpriority=100)
+            return executor, size
+    except Exception:
+        _give_slots(size)
+        raise
+
+
+def _release_executor(executor, size):
+    # Give back the analysis's process slots and keep its pool as the idle
+    # one until IDLE_SECONDS pass (an idle pool holds no slots)
+    global _idle_executor, _idle_size, _idle_timer
+    _give_slots(size)
+    with _executor_lock:
+        if executor not in _executors:
+            # Stopped by shutdown
+            return
+        if not IDLE_SECONDS:
+            _stop_locked(executor)
+            return
+        if _idle_executor is not None:
+            _idle_timer.cancel()
+            _stop_locked(_idle_executor)
+        _idle_executor, _idle_size = executor, size
+        _idle_timer = threading.Timer(IDLE_SECONDS, _shutdown_idle, args=(executor,))
+        _idle_timer.daemon = True
+        _idle_timer.start()
+
+
+def _shutdown_idle(executor):
+    global _idle_executor, _idle_size, _idle_timer
+    with _executor_lock:
+        if _idle_executor is executor:
+            _stop_locked(executor)
+            _idle_executor, _idle_size, _idle_timer = None, 0, None
+
+
+def _stop_locked(executor):
+    # Called with the lock held
+    executor.shutdown(wait=True)
+    _executors.discard(executor)
+
+
+def shutdown():
+    """Stop the segment worker pools that were started."""
+    global _idle_executor, _idle_size, _idle_timer
+    with _executor_lock:
+        if _idle_timer is not None:
+            _idle_timer.cancel()
+        for executor in list(_executors):
+            _stop_locked(executor)
+        _idle_executor, _idle_size, _idle_timer = None, 0, None
+
+
+def _process_segment(video_path, warmup_start, start, end, profile=None, max_dimension=None,
+                     cancel_slot=None):
+    """
+    Run pose estimation on one segment of a video.
+
+    Args:
+        video_path: Path to the input video
+        warmup_start: First frame to decode; frames before `start` only warm
+            up the tracker
+        start: First frame whose landmarks are kept
+        end: Frame to stop at (exclusive), or None to read to the end
+        profile: Processing profile name (see profiles.py)
+        max_dimension: Overrides the profile's inference resolution
+        cancel_slot: Index of the job's flag in the cancel flags; the segment
+            stops with SegmentCancelled once it is set
+
+    Returns:
+        A (start, landmarks) tuple with the (n, 33, 4) landmarks of the kept
+        frames
+    """
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if warmup_start > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, warmup_start)
+
+        size = inference_size(int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                              int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                              max_dimension or get_profile(profile)["max_dimension"])
+        buffer = LandmarkBuffer((end - warmup_start) if end else 1024)
+        frame_idx = warmup_start
+        # The pool resets the tracker of a detector it hands out again
+        with processing.pose_pool.checkout(profile) as pose:
+            while end is None or frame_idx < end:
+                if cancel_slot is not None and _cancel_flags[cancel_slot]:
+                    raise SegmentCancelled("Job cancelled")
+                success, frame = cap.read()
+                if not success:
+                    break
+                if size != frame.shape[1::-1]:
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                results = pose.process(frame_rgb)
+                buffer.append(results.pose_landmarks)
+                frame_idx += 1
+
+        landmarks = buffer.view()[0]
+        return start, landmarks[start - warmup_start:].copy()
+    finally:
+        cap.release()
+
+
+def plan_segments(frame_count, fps, workers, overlap_seconds=DEFAULT_OVERLAP_SECONDS):
+    """
+    Split a video into segments for parallel processing.
+
+    Args:
+        frame_count: Number of frames in the video
+        fps: Frame rate of the video
+        workers: Requested degree of parallelism
+        overlap_seconds: Warm-up decoded before each segment
+
+    Returns:
+        A list of (warmup_start, start, end) tuples; the last end is None
+    """
+    min_frames = max(int(MIN_SEGMENT_SECONDS * fps), 1)
+    workers = max(1, min(workers, MAX_SEGMENT_WORKERS, frame_count // min_frames or 1))
+    segment_length = math.ceil(frame_count / workers)
+    overlap = int(round(overlap_seconds * fps))
+
+    segments = []
+    for i in range(workers):
+        start = i * segment_length
+        end = None if i == workers - 1 else (i + 1) * segment_length
+        segments.append((max(start - overlap, 0), start, end))
+    return segments
+
+
+def process_video_parallel(video_path, workers=None, progress_callback=None,
+                           joints=None, skeleton_mode=False,
+                           overlap_seconds=DEFAULT_OVERLAP_SECONDS, profile=None,
+                           max_dimension=None, landmarks_path=None, cancel_slot=None):
+    """
+    Process a video by splitting it into segments handled by worker processes.
+
+    Args:
+        video_path: Path to the input video
+        workers: Number of segments to process concurrently (defaults to
+            MAX_SEGMENT_WORKERS); fewer if other analyses hold the process
+            slots, and serially if they hold all of them
+        progress_callback: Called as `progress_callback(progress, frames_done)`
+            whenever a segment finishes
+        joints: Joint names to measure, as for process_video
+        skeleton_mode: Accepted for compatibility with process_video; it only
+            affects annotated output, which parallel mode doesn't produce
+        overlap_seconds: Warm-up decoded before each segment
+        profile: Processing profile name, as for process_video
+        max_dimension: Overrides the profile's inference resolution
+        landmarks_path: Write the stitched landmarks to a landmark file there,
+            as for process_video
+        cancel_slot: Index of the job's flag in the cancel flags given to
+            configure; running segments stop once it is set
+
+    Returns:
+        The same result dict as process_video, plus the number of segments
+    """
+    try:
+        # Read video properties up front to plan the segments
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            logger.error(f"Error opening video file: {video_path}")
+            return {"error": "Failed to open video file"}
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+        segments = plan_segments(frame_count, fps, workers or MAX_SEGMENT_WORKERS,
+                                 overlap_seconds)
+        executor, size = _acquire_executor(len(segments))
+        if executor is None:
+            logger.info(f"No segment workers free, processing {video_path} serially")
+            return processing.process_video(video_path, progress_callback=progress_callback,
+                                            joints=joints, profile=profile,
+                                            max_dimension=max_dimension,
+                                            landmarks_path=landmarks_path)
+        try:
+            if size < len(segments):
+                segments = plan_segments(frame_count, fps, size, overlap_seconds)
+            logger.info(f"Processing {video_path} in {len(segments)} segments")
+
+            # Run every segment and collect the landmarks as they finish
+            futures = [executor.submit(_process_segment, video_path, *segment, profile,
+                                       max_dimension, cancel_slot)
+                       for segment in segments]
+            try:
+                parts = {}
+                frames_done = 0
+                for future in as_completed(futures):
+                    start, landmarks = future.result()
+                    parts[start] = landmarks
+                    frames_done += len(landmarks)
+                    if progress_callback and frame_count > 0:
+                        progress_callback(min(frames_done / frame_count * 100, 100.0),
+                                          frames_done)
+            finally:
+                # Don't start segments of a failed or cancelled analysis
+                for future in futures:
+                    future.cancel()
+        finally:
+            _release_executor(executor, size)
+
+        # Stitch the segments back together in frame order, padding segments
+        # that came up short so later frames keep their timestamps
+        pieces = []
+        for _, start, end in segments:
+            piece = parts[start]
+            if end is not None and len(piece) < end - start:
+                padding = np.full((end - start - len(piece),) + piece.shape[1:], np.nan,
+                                  dtype=piece.dtype)
+                piece = np.concatenate([piece, padding])
+            pieces.append(piece)
+        landmarks = np.concatenate(pieces)
+        if landmarks_path:
+            writer = LandmarkWriter(landmarks_path, fps, width, height,
+                                    video=os.path.basename(video_path),
+                                    profile=validate_profile(profile))
+            writer.append(landmarks)
+            writer.close()
+
+        engine = AngleEngine(joints)
+        angles = engine.compute(landmarks)
+        timestamps = np.arange(len(landmarks)) / fps
+        angle_data = engine.to_frame_dicts(angles, timestamps)
+
+        return {
+            "success": True,
+            "data": angle_data,
+            "columns": AngleColumns.from_angle_matrix(engine.names, angles, timestamps,
+                                                      ~np.isnan(landmarks[:, 0, 0])),
+            "segments": len(segments),
+            "video_info": {
+                "frame_count": frame_count,
+                "fps": fps,
+                "width": width,
+                "height": height,
+                "duration": frame_count / fps
+            },
+            "profile": {"name": validate_profile(profile)}
+        }
+
+    except Exception as e:
+        logger.error(f"Error processing video in parallel: {str(e)}")
+        return {"success": False, "error": str(e)}
@@ -0,0 +1,255 @@
+"""
+Building blocks for the streaming decode/inference/annotate/encode pipeline.
+
+process_video decodes frames on one thread, runs pose estimation on the calling
+thread, draws the annotated output on a third and hands it to the encoder on a
+fourth. The stages are linked by bounded queues, and frames live in a ring of
+preallocated arrays: the decoder takes a free slot, reads the next frame into
+it and hands the slot down the pipeline, and the last stage that needs the
+frame gives it back. The number of
+frames in flight is therefore fixed and the frame rate is set by the slowest
+stage.
+
+Every stage records how long it was busy and every queue how full it was, so
+the result can name the bottleneck. Per-frame latencies are also counted into
+fixed histogram buckets (a bisect and an increment per frame), both for the
+stages and for finer steps inside them, so a report can be merged into the
+server's /metrics histograms without sending every sample across processes.
+"""
+
+import bisect
+import queue
+import threading
+import time
+
+import numpy as np
+
+# Marks the end of a stage's output
+END = None
+
+# Upper bounds of the per-frame latency histogram buckets (seconds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# How often blocked stages check whether the pipeline was stopped (seconds)
+_POLL_SECONDS = 0.1
+
+
+def latency_quantile(counts, q):
+    """
+    Estimate a quantile from per-bucket counts over LATENCY_BUCKETS, by linear
+    interpolation within the bucket it falls in (as Prometheus does).
+
+    Returns:
+        The estimate in seconds; the largest bound if it falls beyond it, or
+        None without observations
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(counts):
+        if seen + count >= rank and count:
+            if index == len(LATENCY_BUCKETS):
+                return LATENCY_BUCKETS[-1]
+            lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+            return lower + (LATENCY_BUCKETS[index] - lower) * (rank - seen) / count
+        seen += count
+    return LATENCY_BUCKETS[-1]
+
+
+class PipelineStopped(Exception):
+    """Raised in a stage that is blocked while the pipeline is shutting down."""
+
+
+class FrameRing:
+    """
+    Fixed set of preallocated frame buffers shared by the pipeline stages.
+
+    Args:
+        capacity: Number of frames that can be in flight at once
+        shape: Shape of one frame, e.g. (height, width, 3)
+        stop: Event that aborts a blocked acquire
+    """
+
+    def __init__(self, capacity, shape, stop, dtype=np.uint8):
+        self.slots = [np.empty(shape, dtype=dtype) for _ in range(capacity)]
+        self._free = queue.Queue()
+        for index in range(capacity):
+            self._free.put(index)
+        self._stop = stop
+
+    def acquire(self):
+        """Wait for a free slot and return its index."""
+        while True:
+            try:
+                return self._free.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                if self._stop.is_set():
+                    raise PipelineStopped()
+
+    def release(self, index):
+        """Give a slot back once no stage needs its frame any more."""
+        self._free.put(index)
+
+
+class StageQueue:
+    """
+    Bounded queue between two stages that tracks its occupancy.
+
+    Args:
+        maxsize: Maximum number of items waiting in the queue
+        stop: Event that aborts a blocked put or get
+    """
+
+    def __init__(self, maxsize, stop):
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize)
+        self._stop = stop
+        self._samples = 0
+        self._occupancy = 0
+        self._max_occupancy = 0
+
+    def put(self, item):
+        while True:
+            try:
+                self._queue.put(item, timeout=_POLL_SECONDS)
+                return
+            except queue.Full:
+                if self._stop.is_set():
+                    raise PipelineStopped()
+
+    def get(self):
+        # Sample how many items were waiting each time the consumer asks
+        occupancy = self._queue.qsize()
+        self._samples += 1
+        self._occupancy += occupancy
+        self._max_occupancy = max(self._max_occupancy, occupancy)
+        while True:
+            try:
+                return self._queue.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                if self._stop.is_set():
+                    raise PipelineStopped()
+
+    def stats(self):
+        return {
+            "capacity": self.maxsize,
+            "mean_occupancy": self._occupancy / self._samples if self._samples else 0.0,
+            "max_occupancy": self._max_occupancy
+        }
+
+
+class StageStats:
+    """Counts the frames a stage handled and the time it spent on them."""
+
+    def __init__(self):
+        self.frames = 0
+        self.busy_seconds = 0.0
+        # Frames per latency bucket, the last one for anything slower
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, seconds):
+        self.frames += 1
+        self.busy_seconds += seconds
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def latency(self):
+        """Per-frame latency histogram over LATENCY_BUCKETS (counts not cumulative)."""
+        return {"counts": list(self.counts), "sum": self.busy_seconds, "count": self.frames}
+
+    def summary(self, wall_seconds):
+        return {
+            "frames": self.frames,
+            "busy_seconds": self.busy_seconds,
+            # Frames per second the stage could sustain on its own
+            "fps": self.frames / self.busy_seconds if self.busy_seconds > 0 else None,
+            "utilization": self.busy_seconds / wall_seconds if wall_seconds > 0 else None
+        }
+
+
+class Pipeline:
+    """
+    Owns the threads, queues and statistics of one pipeline run.
+
+    A stage that raises stops the whole pipeline; the error is re-raised from
+    join on the calling thread.
+    """
+
+    def __init__(self):
+        self.stop = threading.Event()
+        self._stages = {}
+        self._steps = {}
+        self._queues = {}
+        self._threads = []
+        self._errors = []
+        self._started = time.perf_counter()
+
+    def stage(self, name):
+        """Get (or create) the statistics of a stage."""
+        return self._stages.setdefault(name, StageStats())
+
+    def step(self, name):
+        """
+        Get (or create) the statistics of a step within a stage, such as the
+        model call within inference. Steps are reported but never named as
+        the bottleneck.
+        """
+        return self._steps.setdefault(name, StageStats())
+
+    def queue(self, name, maxsize):
+        """Create a named queue between two stages."""
+        self._queues[name] = StageQueue(maxsize, self.stop)
+        return self._queues[name]
+
+    def ring(self, capacity, shape):
+        """Create a ring of frame buffers tied to this pipeline."""
+        return FrameRing(capacity, shape, self.stop)
+
+    def spawn(self, name, target, *args):
+        """Run a stage on its own thread."""
+        def run():
+            try:
+                target(*args)
+            except PipelineStopped:
+                pass
+            except Exception as e:
+                self._errors.append(e)
+                self.stop.set()
+
+        thread = threading.Thread(target=run, name=f"pipeline-{name}", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def abort(self):
+        """Stop every stage, e.g. because the calling thread failed."""
+        self.stop.set()
+
+    def join(self):
+        """Wait for all stage threads and re-raise the first stage error."""
+        for thread in self._threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+
+    def report(self):
+        """
+        Summarize the run.
+
+        Returns:
+            A dict with per-stage and per-step throughput and utilization,
+            per-queue occupancy, the name of the slowest stage and the latency
+            histograms of the stages and steps
+        """
+        wall_seconds = time.perf_counter() - self._started
+        stages = {name: stats.summary(wall_seconds) for name, stats in self._stages.items()}
+        timed = [(stats["fps"], name) for name, stats in stages.items() if stats["fps"]]
+        return {
+            "wall_seconds": wall_seconds,
+            "stages": stages,
+            "steps": {name: stats.summary(wall_seconds) for name, stats in self._steps.items()},
+            "queues": {name: q.stats() for name, q in self._queues.items()},
+            "bottleneck": min(timed)[1] if timed else None,
+            "latency": {name: stats.latency()
+                        for name, stats in list(self._stages.items()) + list(self._steps.items())}
+        }
@@ -0,0 +1,177 @@
+"""
+Process-wide pool of warm pose detectors.
+
+Building a MediaPipe Pose graph loads the TFLite models from disk, which on a
+short clip can take longer than the analysis itself. The pool keeps detectors
+that finished a video and hands them to the next one that asks for the same
+processing profile, after resetting the tracker so results don't depend on
+what the detector saw before.
+
+The number of detectors (idle and checked out) is bounded. When the pool is
+full, an idle detector of another profile is closed to make room, and if none
+is idle the caller waits for one to be returned. Detectors that stay idle for
+longer than `idle_seconds` are closed by a background thread.
+"""
+
+import contextlib
+import logging
+import threading
+import time
+
+from profiles import validate_profile
+
+logger = logging.getLogger(__name__)
+
+
+class PosePool:
+    """
+    Bounded pool of pose detectors keyed by processing profile.
+
+    Args:
+        factory: Called as `factory(profile)` to build a detector
+        reset: Called on a detector before it is handed out again, to clear
+            its tracker state
+        max_size: Most detectors alive at once, idle or checked out
+        idle_seconds: Close detectors that were idle this long; 0 keeps them
+    """
+
+    def __init__(self, factory, reset, max_size=4, idle_seconds=600):
+        self.max_size = max(max_size, 1)
+        self.idle_seconds = idle_seconds
+        self._factory = factory
+        self._reset = reset
+        # profile -> list of (detector, time it was returned), oldest first
+        self._idle = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._returned = threading.Condition(self._lock)
+        self._reaper = None
+        self._created = 0
+        self._reused = 0
+        self._evicted = 0
+
+    def acquire(self, profile=None):
+        """
+        Check out a detector for a profile, building one if none is idle.
+
+        Blocks while the pool is full and every detector is in use.
+        """
+        profile = validate_profile(profile)
+        to_close = []
+        with self._lock:
+            self._start_reaper()
+            while True:
+                idle = self._idle.get(profile)
+                if idle:
+                    pose = idle.pop()[0]
+                    self._reused += 1
+                    break
+                if self._size < self.max_size:
+                    pose = None
+                    self._size += 1
+                    break
+                # Make room by closing the longest idle detector of any profile
+                candidates = [(entries[0][1], name) for name, entries in self._idle.items()
+                              if entries]
+                if candidates:
+                    to_close.append(self._idle[min(candidates)[1]].pop(0)[0])
+                    self._size -= 1
+                    self._evicted += 1
+                    continue
+                self._returned.wait()
+        self._close(to_close)
+
+        if pose is None:
+            try:
+                pose = self._factory(profile)
+            except BaseException:
+                with self._lock:
+                    self._size -= 1
+                    self._returned.notify()
+                raise
+            with self._lock:
+                self._created += 1
+        else:
+            self._reset(pose)
+        return pose
+
+    def release(self, profile, pose):
+        """Return a detector checked out with acquire."""
+        profile = validate_profile(profile)
+        with self._lock:
+            self._idle.setdefault(profile, []).append((pose, time.monotonic()))
+            self._returned.notify()
+
+    @contextlib.contextmanager
+    def checkout(self, profile=None):
+        """Use a detector for the duration of a with block."""
+        pose = self.acquire(profile)
+        try:
+            yield pose
+        finally:
+            self.release(profile, pose)
+
+    def warm(self, profiles):
+        """Build a detector for each profile now so the first request doesn't."""
+        for profile in profiles:
+            with self.checkout(profile):
+                pass
+
+    def evict_idle(self):
+        """Close detectors that have been idle for longer than idle_seconds."""
+        if not self.idle_seconds:
+            return
+        cutoff = time.monotonic() - self.idle_seconds
+        to_close = []
+        with self._lock:
+            for profile, entries in self._idle.items():
+                while entries and entries[0][1] < cutoff:
+                    to_close.append(entries.pop(0)[0])
+                    self._size -= 1
+                    self._evicted += 1
+            if to_close:
+                self._returned.notify_all()
+        if to_close:
+            logger.info(f"Closed {len(to_close)} idle pose detectors")
+        self._close(to_close)
+
+    def close(self):
+        """Close every idle detector."""
+        with self._lock:
+            to_close = [pose for entries in self._idle.values() for pose, _ in entries]
+            self._size -= len(to_close)
+            self._idle.clear()
+            self._returned.notify_all()
+        self._close(to_close)
+
+    def stats(self):
+        """Return the number of live and idle detectors and reuse counters."""
+        with self._lock:
+            return {
+                "size": self._size,
+                "max_size": self.max_size,
+                "idle": {profile: len(entries) for profile, entries in self._idle.items()
+                         if entries},
+                "created": self._created,
+                "reused": self._reused,
+                "evicted": self._evicted
+            }
+
+    def _close(self, poses):
+        for pose in poses:
+            try:
+                pose.close()
+            except Exception as e:
+                logger.warning(f"Error closing pose detector: {str(e)}")
+
+    def _start_reaper(self):
+        # Called with the lock held; the thread dies with the process
+        if self._reaper is None and self.idle_seconds:
+            self._reaper = threading.Thread(target=self._reap, name="pose-pool-reaper",
+                                            daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(max(self.idle_seconds / 2, 1))
+            self.evict_idle()
@@ -0,0 +1,697 @@
+import contextlib
+import os
+import time
+import cv2
+import numpy as np
+import mediapipe as mp
+import logging
+
+from angles import AngleEngine, LandmarkBuffer, JOINT_LABELS
+from columnar import AngleColumns
+from pipeline import Pipeline, END
+from posepool import PosePool
+from profiles import get_profile, validate_profile, inference_size
+from spill import SpillWriter
+from landmark_store import LandmarkWriter, LandmarkReader
+from overlay import OverlayRenderer
+from roi import RoiTracker, to_frame_landmarks
+from sampling import FrameSampler, interpolate, estimate_error
+from video_io import FFMPEG, FFmpegReader, create_writer
+
+logger = logging.getLogger(__name__)
+
+# Initialize MediaPipe pose
+mp_pose = mp.solutions.pose
+
+# Warm pose detectors kept by each process (see posepool.py), and how long an
+# unused one is kept (seconds)
+POSE_POOL_SIZE = int(os.environ.get("POSE_POOL_SIZE", 4))
+POSE_POOL_IDLE_SECONDS = float(os.environ.get("POSE_POOL_IDLE_SECONDS", 10 * 60))
+
+# Frames in flight between the decode, inference, annotate and encode stages
+PIPELINE_BUFFER_FRAMES = 8
+
+# Angles are handed to angles_callback once this many frames or seconds have
+# accumulated, whichever comes first
+ANGLE_BATCH_FRAMES = 30
+ANGLE_BATCH_SECONDS = 0.25
+
+# Initial landmark buffer of spilled runs, which only hold the frames of the
+# batch being written (it grows if needed)
+SPILL_BUFFER_FRAMES = 256
+
+# Calculate angle between three points
+def calculate_angle(a, b, c):
+    # Convert points to numpy arrays
+    a = np.array(a)
+    b = np.array(b)
+    c = np.array(c)
+    
+    # Calculate vectors
+    ba = a - b
+    bc = c - b
+    
+    # Calculate dot product
+    cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc))
+    
+    # Ensure value is within valid range for arccos
+    cosine_angle = np.clip(cosine_angle, -1.0, 1.0)
+    
+    # Calculate angle in degrees
+    angle = np.arccos(cosine_angle) * 180.0 / np.pi
+    
+    return angle
+
+# Create a pose detector with the settings of a processing profile (see
+# profiles.py; the default profile if none is given)
+def create_pose(profile=None):
+    settings = get_profile(profile)
+    return mp_pose.Pose(
+        static_image_mode=False,
+        model_complexity=settings["model_complexity"],
+        smooth_landmarks=settings["smooth_landmarks"],
+        enable_segmentation=settings["enable_segmentation"],
+        smooth_segmentation=settings["enable_segmentation"],
+        min_detection_confidence=settings["min_detection_confidence"],
+        min_tracking_confidence=settings["min_tracking_confidence"])
+
+# Clear tracker state so a reused pose detector starts fresh on a new video
+def reset_pose(pose):
+    if hasattr(pose, 'reset'):
+        pose.reset()
+
+# Pose detectors shared by every analysis in this process
+pose_pool = PosePool(create_pose, reset_pose, POSE_POOL_SIZE, POSE_POOL_IDLE_SECONDS)
+
+# Decode stage: read frames into free ring slots and pass them on
+#
+# With `resize_to` (width, height) set, frames are decoded into one reused
+# full-size buffer and only their scaled-down RGB copies go into the ring.
+def _decode_frames(cap, ring, decoded, stats, resize_to=None):
+    full_frame = None
+    while True:
+        slot = ring.acquire()
+        start = time.perf_counter()
+        if resize_to:
+            success, full_frame = cap.read(full_frame)
+            if success:
+                frame = cv2.resize(full_frame, resize_to, dst=ring.slots[slot],
+                                   interpolation=cv2.INTER_AREA)
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+        else:
+            success, frame = cap.read(ring.slots[slot])
+        if not success:
+            ring.release(slot)
+            break
+        # The decoder allocates a new array if the frame size changed
+        if frame is not ring.slots[slot]:
+            ring.slots[slot] = frame
+        stats.add(time.perf_counter() - start)
+        decoded.put(slot)
+    decoded.put(END)
+
+# Annotate stage: draw the overlay onto decoded frames and pass them on
+#
+# Skeleton mode doesn't show the picture, so the overlay is drawn onto a blank
+# frame from `canvases` instead and the decoded frame (if there is one) is
+# freed straight away. A canvas only holds the overlay last drawn on it, so
+# just the rectangles that overlay covered are cleared.
+def _annotate_frames(ring, to_annotate, to_encode, stats, renderer, canvases=None):
+    dirty = {}
+    while True:
+        item = to_annotate.get()
+        if item is END:
+            break
+        slot, landmarks, names, angles, vertices, timestamp = item
+        if canvases:
+            if slot is not None:
+                ring.release(slot)
+            slot = canvases.acquire()
+        start = time.perf_counter()
+        if canvases:
+            frame = canvases.slots[slot]
+            if slot in dirty:
+                renderer.clear(frame, dirty[slot])
+            else:
+                frame.fill(0)
+        else:
+            # The slot is ours until released, so draw on it directly
+            frame = ring.slots[slot]
+        dirty[slot] = renderer.draw(frame, landmarks, names, angles, vertices, timestamp)
+        stats.add(time.perf_counter() - start)
+        to_encode.put(slot)
+    to_encode.put(END)
+
+# Encode stage: hand annotated frames to the encoder and free their slots
+def _encode_frames(out, ring, to_encode, stats):
+    while True:
+        slot = to_encode.get()
+        if slot is END:
+            break
+        start = time.perf_counter()
+        out.write(ring.slots[slot])
+        ring.release(slot)
+        stats.add(time.perf_counter() - start)
+
+# Summarize how much inference frame sampling saved and what it cost
+def sampling_report(sampler, sampled, angles, inference_stats):
+    # `angles` is None when they weren't kept in memory (spilled results)
+    frames = len(sampled)
+    inferred = int(sampled.sum())
+    per_frame = (inference_stats["busy_seconds"] / inference_stats["frames"]
+                 if inference_stats["frames"] else 0.0)
+    return {
+        "mode": "adaptive" if sampler.adaptive else "fixed",
+        "target_fps": sampler.target_fps,
+        "frames": frames,
+        "inferred_frames": inferred,
+        "interpolated_frames": frames - inferred,
+        "inference_speedup": frames / inferred if inferred else None,
+        "inference_seconds_saved": per_frame * (frames - inferred),
+        # Nothing was interpolated if every frame was sampled
+        "estimated_error_degrees": (estimate_error(angles, sampled)
+                                    if inferred < frames and angles is not None else None)
+    }
+
+# Process a video to extract pose landmarks and calculate joint angles
+#
+# `profile` names the processing profile (see profiles.py) that sets the pose
+# model and the resolution frames are scaled down to before inference. If
+# `pose` is given it is used (after a tracker reset) and must have been created
+# for the same profile; otherwise one is checked out of pose_pool.
+# `max_dimension` overrides the profile's inference resolution.
+#
+# Frames are scaled down once, into a reused buffer, before inference; the
+# landmarks are normalized to the frame, so drawing and angles are the same at
+# full resolution. Without annotated output full-size frames aren't needed at
+# all: ffmpeg (if installed) scales and converts them while decoding, otherwise
+# the decode thread does it before frames enter the pipeline.
+#
+# `progress_callback(progress, frame_idx)` is called once per frame with the
+# percentage of frames processed so far. `joints` selects which angles from
+# angles.JOINTS are reported (default: elbows, shoulders and knees). Besides
+# the per-frame dicts in "data", the result carries the same angles as an
+# AngleColumns under "columns", which isn't JSON serializable and has to be
+# removed before the result is sent.
+#
+# `angles_callback(frames)`, if given, receives the per-frame angle dicts while
+# the video is processed: the first frame right away, then in small batches.
+#
+# `sample_fps` runs pose inference at that rate instead of on every frame, and
+# `adaptive_sampling` varies the rate with how fast the subject moves (using
+# `sample_fps` as the lowest rate). Angles of skipped frames are interpolated,
+# annotated output holds the last sampled pose, and the result's "sampling"
+# entry reports the work saved and the estimated interpolation error.
+#
+# Annotated output is written by `encoder` ("h264" through ffmpeg or "opencv",
+# see video_io.py), which also writes a smaller rendition to `preview_path` if
+# given.
+#
+# Decoding, annotation and encoding run on their own threads around the
+# inference loop (see pipeline.py); the result's "pipeline" entry reports the
+# throughput of each stage and how full the queues between them were.
+#
+# With `spill_path`, angles are computed in batches as frames are read and
+# appended to a spill directory there (see spill.py) instead of being kept, and
+# landmarks are dropped once their angles are written, so memory use doesn't
+# grow with the length of the video. The result then has a "spill" entry with
+# the frame count and joints instead of "data" and "columns".
+#
+# With `landmarks_path`, the raw landmarks of every frame are also written to a
+# landmark file there (see landmark_store.py), from which angles and annotated
+# video can be recomputed later without inference.
+#
+# With `roi`, once a pose is found the next frame is cropped around it (and
+# scaled down to at most roi.ROI_MAX_DIMENSION) before inference, falling back
+# to the whole frame when the crop finds no pose (see roi.py). Crops are given
+# to a second detector checked out of pose_pool. Frames are then decoded at
+# full size, as crops are taken from them. The result's "roi" entry reports the
+# frames cropped, the fallbacks, the switches between crops and whole frames
+# and the inference time of both.
+def process_video(video_path, output_path=None, skeleton_mode=False,
+                  pose=None, progress_callback=None, joints=None, angles_callback=None,
+                  sample_fps=None, adaptive_sampling=False, profile=None,
+                  max_dimension=None, preview_path=None, encoder=None, spill_path=None,
+                  landmarks_path=None, roi=False):
+    if roi and pose_pool.max_size < 2:
+        return {"error": "roi needs a POSE_POOL_SIZE of at least 2"}
+    with contextlib.ExitStack() as stack:
+        if pose is None:
+            # The pool resets the detectors it hands out again
+            pose = stack.enter_context(pose_pool.checkout(profile))
+        else:
+            # Start a detector the caller passed in from a clean tracker state
+            reset_pose(pose)
+        # Crops go to a detector of their own: a detector tracks the person in
+        # the coordinates of the images it is given, so sharing one between
+        # crops and whole frames would mean resetting it at every switch
+        crop_pose = stack.enter_context(pose_pool.checkout(profile)) if roi else None
+        return _process_video(video_path, output_path, skeleton_mode,
+                              pose, progress_callback, joints, angles_callback,
+                              sample_fps, adaptive_sampling, profile, max_dimension,
+                              preview_path, encoder, spill_path, landmarks_path, crop_pose)
+
+
+def _process_video(video_path, output_path, skeleton_mode, pose, progress_callback, joints,
+                   angles_callback, sample_fps, adaptive_sampling, profile, max_dimension,
+                   preview_path, encoder, spill_path, landmarks_path, crop_pose):
+    try:
+        # Open video file
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            logger.error(f"Error opening video file: {video_path}")
+            return {"error": "Failed to open video file"}
+        
+        # Get video properties
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        
+        # Prepare output video if needed
+        out = None
+        if output_path:
+            # Ensure directory exists
+            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+            out = create_writer(output_path, fps, width, height, encoder, preview_path)
+            
+            # Verify the encoder was initialized correctly
+            if not out.isOpened():
+                logger.warning(f"Failed to initialize the video encoder. Output may not be saved.")
+        
+        # Initialize results: landmarks are collected per frame and all angles
+        # are computed in one vectorized pass once the video has been read
+        # (spilled results only keep the frames not written yet)
+        engine = AngleEngine(joints)
+        if spill_path:
+            buffer = LandmarkBuffer(SPILL_BUFFER_FRAMES)
+        else:
+            buffer = LandmarkBuffer(frame_count + 1 if frame_count > 0 else 1024)
+        frame_idx = 0
+        
+        # Choose the frames that go through inference when sampling
+        sampler = None
+        if sample_fps or adaptive_sampling:
+            sampler = FrameSampler(fps, sample_fps, adaptive_sampling)
+        last_annotation = None
+        
+        # Frames whose angles have been handed to angles_callback (or
+        # written to the spill) so far
+        emitted = 0
+        last_emit = None
+        spill = None
+        spilled_detections = 0
+        landmarks_out = None
+        
+        def emit_angles(end):
+            nonlocal emitted, last_emit, spilled_detections
+            if sampler:
+                # Start from the sample before the batch so skipped frames at
+                # its start can be interpolated
+                anchor = sampler.last_sampled(emitted + 1)
+                batch = engine.compute(buffer.rows(anchor, end))
+                batch = interpolate(batch, sampler.mask(anchor, end))[emitted - anchor:]
+            else:
+                batch = engine.compute(buffer.rows(emitted, end))
+            timestamps = np.arange(emitted, end) / fps
+            if angles_callback:
+                angles_callback(engine.to_frame_dicts(batch, timestamps))
+            if spill:
+                detected = buffer.detections(emitted, end)
+                if sampler:
+                    skipped = ~sampler.mask(emitted, end)
+                    detected = detected | (skipped & np.isfinite(batch).any(axis=1))
+                spill.append(batch, timestamps, detected)
+                spilled_detections += int(detected.sum())
+                if landmarks_out:
+                    landmarks_out.append(buffer.rows(emitted, end))
+                # Keep only the frames the next batch still needs
+                buffer.release(sampler.last_sampled(end + 1) if sampler else end)
+            emitted = end
+            last_emit = time.perf_counter()
+        
+        # Resolution frames are given to the model at
+        inference_width, inference_height = inference_size(
+            width, height, max_dimension or get_profile(profile)["max_dimension"])
+        scaled = (inference_width, inference_height) != (width, height)
+        
+        # Without annotated output, or in skeleton mode where the picture isn't
+        # shown, decode straight to small RGB frames (unless crops are taken
+        # from the full-size ones)
+        decoder = "opencv"
+        low_res = (not out or skeleton_mode) and scaled and crop_pose is None
+        roi_tracker = None
+        if crop_pose is not None:
+            roi_tracker = RoiTracker(width, height,
+                                     max_dimension or get_profile(profile)["max_dimension"])
+        if low_res and FFMPEG and os.path.isfile(video_path):
+            cap.release()
+            cap = FFmpegReader(video_path, inference_width, inference_height)
+            decoder = "ffmpeg"
+        
+        if spill_path:
+            spill = SpillWriter(spill_path, engine.names, fps)
+        if landmarks_path:
+            landmarks_out = LandmarkWriter(landmarks_path, fps, width, height,
+                                           video=os.path.basename(video_path),
+                                           profile=validate_profile(profile))
+        
+        # Link decode -> inference -> annotate -> encode through bounded queues
+        # over a shared ring of preallocated frames
+        pipeline = Pipeline()
+        ring_shape = (inference_height, inference_width, 3) if low_res else (height, width, 3)
+        ring = pipeline.ring(PIPELINE_BUFFER_FRAMES, ring_shape)
+        decoded = pipeline.queue("decoded", PIPELINE_BUFFER_FRAMES)
+        to_annotate = pipeline.queue("annotate", PIPELINE_BUFFER_FRAMES) if out else None
+        to_encode = pipeline.queue("encode", PIPELINE_BUFFER_FRAMES) if out else None
+        # Skeleton mode draws onto blank full-size frames of its own
+        canvases = None
+        if out and skeleton_mode:
+            canvases = pipeline.ring(PIPELINE_BUFFER_FRAMES, (height, width, 3))
+        inference_stats = pipeline.stage("inference")
+        convert_stats = pipeline.step("convert")
+        pose_stats = pipeline.step("pose")
+        pipeline.spawn("decode", _decode_frames, cap, ring, decoded, pipeline.stage("decode"),
+                       (inference_width, inference_height) if decoder == "opencv" and low_res
+                       else None)
+        if out:
+            pipeline.spawn("annotate", _annotate_frames, ring, to_annotate, to_encode,
+                           pipeline.stage("annotate"), OverlayRenderer(skeleton_mode), canvases)
+            pipeline.spawn("encode", _encode_frames, out, canvases or ring, to_encode,
+                           pipeline.stage("encode"))
+        
+        # Full-size frames are scaled down into reused buffers here
+        frame_small = None
+        if scaled and not low_res:
+            frame_small = np.empty((inference_height, inference_width, 3), dtype=np.uint8)
+        frame_rgb = np.empty((inference_height, inference_width, 3), dtype=np.uint8)
+        
+        try:
+            # Process each frame in the video
+            while True:
+                slot = decoded.get()
+                if slot is END:
+                    break
+                frame = ring.slots[slot]
+                
+                # Calculate progress
+                progress = (frame_idx / frame_count) * 100 if frame_count > 0 else 0
+                if progress_callback:
+                    progress_callback(progress, frame_idx)
+                
+                # Skipped frames get an empty row that is interpolated later;
+                # annotated output shows the last sampled pose on them
+                if sampler and not sampler.should_sample(frame_idx):
+                    row = buffer.append(None)
+                    if out and last_annotation:
+                        to_annotate.put((slot,) + last_annotation[:-1] + (frame_idx / fps,))
+                    else:
+                        ring.release(slot)
+                    ready = sampler.last_sampled(row + 1) + 1
+                else:
+                    start = time.perf_counter()
+                    pose_landmarks = None
+                    
+                    # Look for the person in a crop around where they were
+                    region = roi_tracker.roi if roi_tracker else None
+                    if region is not None:
+                        crop_rgb = roi_tracker.crop(frame)
+                        converted = time.perf_counter()
+                        convert_stats.add(converted - start)
+                        results = crop_pose.process(crop_rgb)
+                        pose_stats.add(time.perf_counter() - converted)
+                        if results.pose_landmarks:
+                            pose_landmarks = to_frame_landmarks(results.pose_landmarks, region,
+                                                                width, height)
+                    
+                    # Otherwise search the whole frame
+                    if pose_landmarks is None:
+                        full_start = time.perf_counter()
+                        
+                        # Convert the BGR image to RGB into the reused buffers
+                        if low_res:
+                            # Already small and RGB
+                            frame_rgb = frame
+                        elif frame_small is not None:
+                            frame_small = cv2.resize(frame, (inference_width, inference_height),
+                                                     dst=frame_small, interpolation=cv2.INTER_AREA)
+                            frame_rgb = cv2.cvtColor(frame_small, cv2.COLOR_BGR2RGB, dst=frame_rgb)
+                        else:
+                            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame_rgb)
+                        converted = time.perf_counter()
+                        convert_stats.add(converted - full_start)
+                        
+                        # Process the frame with MediaPipe
+                        results = pose.process(frame_rgb)
+                        pose_stats.add(time.perf_counter() - converted)
+                        pose_landmarks = results.pose_landmarks
+                        if roi_tracker:
+                            roi_tracker.update(pose_landmarks, None, time.perf_counter() - start,
+                                               fallback=region is not None)
+                    elif roi_tracker:
+                        roi_tracker.update(pose_landmarks, region, time.perf_counter() - start)
+                    
+                    # Store the landmarks for this frame
+                    row = buffer.append(pose_landmarks)
+                    if sampler:
+                        sampler.observe(row, buffer.rows(row, row + 1)[0])
+                    ready = row + 1
+                    
+                    # Hand frames with a detection to the annotate stage (the
+                    # encode stage releases the slot); otherwise it is free now
+                    if out and pose_landmarks:
+                        # Angles and vertex positions for this frame only; the
+                        # landmarks are copied as spilled buffers reuse rows
+                        frame_landmarks = buffer.rows(row, row + 1)
+                        frame_angles = engine.compute(frame_landmarks)[0]
+                        frame_vertices = engine.vertices(frame_landmarks)[0]
+                        inference_stats.add(time.perf_counter() - start)
+                        last_annotation = (frame_landmarks[0].copy(), engine.names,
+                                           frame_angles, frame_vertices, frame_idx / fps)
+                        to_annotate.put((slot,) + last_annotation)
+                    else:
+                        inference_stats.add(time.perf_counter() - start)
+                        last_annotation = None
+                        ring.release(slot)
+                
+                # Pass on new angles in batches, the first frame immediately
+                if (angles_callback or spill) and ready > emitted and (
+                        last_emit is None
+                        or ready - emitted >= ANGLE_BATCH_FRAMES
+                        or time.perf_counter() - last_emit >= ANGLE_BATCH_SECONDS):
+                    emit_angles(ready)
+                
+                # Increment frame counter
+                frame_idx += 1
+            
+            if (angles_callback or spill) and emitted < buffer.size:
+                emit_angles(buffer.size)
+            if to_annotate:
+                to_annotate.put(END)
+        except BaseException:
+            pipeline.abort()
+            if spill:
+                spill.abort()
+            if landmarks_out:
+                landmarks_out.abort()
+            raise
+        finally:
+            # Wait for the stage threads before releasing what they use
+            try:
+                pipeline.join()
+            finally:
+                cap.release()
+                if out:
+                    out.release()
+        
+        # Streams being uploaded may not know their length up front
+        if frame_count <= 0:
+            frame_count = frame_idx
+        
+        # Spilled landmarks were written batch by batch
+        if landmarks_out:
+            if not spill:
+                landmarks_out.append(buffer.view()[0])
+            landmarks_out.close(sampler.mask() if sampler else None)
+        
+        # Compute every configured angle for every frame at once (spilled
+        # angles were computed and written batch by batch)
+        angles = None
+        if not spill:
+            landmarks, detected = buffer.view()
+            start = time.perf_counter()
+            angles = engine.compute(landmarks)
+            pipeline.step("angles").add(time.perf_counter() - start)
+        
+        pipeline_stats = pipeline.report()
+        logger.info(f"Pipeline for {video_path}: bottleneck {pipeline_stats['bottleneck']}, "
+                    f"{frame_idx / pipeline_stats['wall_seconds']:.1f} fps overall")
+        
+        # Fill in the frames that sampling skipped
+        sampling_stats = None
+        if sampler:
+            sampled = sampler.mask()
+            sampling_stats = sampling_report(sampler, sampled, angles,
+                                             pipeline_stats["stages"]["inference"])
+            if angles is not None:
+                angles = interpolate(angles, sampled)
+                detected = detected | (~sampled & np.isfinite(angles).any(axis=1))
+        
+        if spill:
+            spill.close()
+            result = {
+                "success": True,
+                "spill": {
+                    "frames": spill.frames,
+                    "detected_frames": spilled_detections,
+                    "joints": list(engine.names)
+                }
+            }
+        else:
+            timestamps = np.arange(len(landmarks)) / fps
+            result = {
+                "success": True,
+                "data": engine.to_frame_dicts(angles, timestamps),
+                "columns": AngleColumns.from_angle_matrix(engine.names, angles,
+                                                          timestamps, detected)
+            }
+        result.update({
+            "pipeline": pipeline_stats,
+            "video_info": {
+                "frame_count": frame_count,
+                "fps": fps,
+                "width": width,
+                "height": height,
+                "duration": frame_count / fps
+            },
+            "profile": {
+                "name": validate_profile(profile),
+                "inference_width": inference_width,
+                "inference_height": inference_height,
+                # Where frames were scaled down: "ffmpeg" while decoding,
+                # "opencv" after decoding, or None at full resolution
+                "scaled_by": (decoder if low_res else "opencv") if scaled else None
+            }
+        })
+        if sampling_stats:
+            result["sampling"] = sampling_stats
+        if roi_tracker:
+            result["roi"] = roi_tracker.report()
+        return result
+
+    except Exception as e:
+        logger.error(f"Error processing video: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+# Redraw the annotated video of an analysis from its landmark file, without
+# running inference
+#
+# `landmarks_path` is the file process_video wrote for `video_path`. `joints`
+# and `min_visibility` choose the angles drawn, as for
+# landmark_store.reanalyze. Frames without a pose are left out of the output
+# and frames that sampling skipped show the last sampled pose, as in
+# process_video. Decoding, drawing and encoding run on the pipeline's threads;
+# skeleton mode doesn't show the picture, so it decodes nothing and draws onto
+# blank frames.
+def render_video(video_path, landmarks_path, output_path, skeleton_mode=False, joints=None,
+                 min_visibility=None, progress_callback=None, preview_path=None,
+                 encoder=None):
+    try:
+        reader = LandmarkReader(landmarks_path)
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            logger.error(f"Error opening video file: {video_path}")
+            return {"error": "Failed to open video file"}
+        
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or len(reader)
+        
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        out = create_writer(output_path, fps, width, height, encoder, preview_path)
+        if not out.isOpened():
+            logger.warning(f"Failed to initialize the video encoder. Output may not be saved.")
+        
+        # Every frame's angles and vertex positions in one pass
+        engine = AngleEngine(joints, min_visibility)
+        angles = engine.compute(reader.landmarks)
+        vertices = engine.vertices(reader.landmarks)
+        detected = ~np.isnan(reader.landmarks[:, 0, 0])
+        
+        pipeline = Pipeline()
+        ring = pipeline.ring(PIPELINE_BUFFER_FRAMES, (height, width, 3))
+        to_annotate = pipeline.queue("annotate", PIPELINE_BUFFER_FRAMES)
+        to_encode = pipeline.queue("encode", PIPELINE_BUFFER_FRAMES)
+        landmark_stats = pipeline.stage("landmarks")
+        if skeleton_mode:
+            cap.release()
+        else:
+            decoded = pipeline.queue("decoded", PIPELINE_BUFFER_FRAMES)
+            pipeline.spawn("decode", _decode_frames, cap, ring, decoded,
+                           pipeline.stage("decode"))
+        pipeline.spawn("annotate", _annotate_frames, ring, to_annotate, to_encode,
+                       pipeline.stage("annotate"), OverlayRenderer(skeleton_mode),
+                       ring if skeleton_mode else None)
+        pipeline.spawn("encode", _encode_frames, out, ring, to_encode, pipeline.stage("encode"))
+        
+        frame_idx = 0
+        rendered = 0
+        last_annotation = None
+        try:
+            while True:
+                if skeleton_mode:
+                    if frame_idx >= len(reader):
+                        break
+                    slot = None
+                else:
+                    slot = decoded.get()
+                    if slot is END:
+                        break
+                if progress_callback:
+                    progress_callback((frame_idx / frame_count) * 100, frame_idx)
+                
+                start = time.perf_counter()
+                skipped = (reader.sampled is not None and frame_idx < len(reader)
+                           and not reader.sampled[frame_idx])
+                if frame_idx < len(reader) and detected[frame_idx]:
+                    last_annotation = (reader.landmarks[frame_idx], engine.names,
+                                       angles[frame_idx], vertices[frame_idx])
+                elif not skipped:
+                    last_annotation = None
+                landmark_stats.add(time.perf_counter() - start)
+                
+                if last_annotation:
+                    to_annotate.put((slot,) + last_annotation + (frame_idx / fps,))
+                    rendered += 1
+                elif slot is not None:
+                    ring.release(slot)
+                frame_idx += 1
+            to_annotate.put(END)
+        except BaseException:
+            pipeline.abort()
+            raise
+        finally:
+            try:
+                pipeline.join()
+            finally:
+                cap.release()
+                out.release()
+        
+        return {
+            "success": True,
+            "rendered_frames": rendered,
+            "joints": list(engine.names),
+            "pipeline": pipeline.report(),
+            "video_info": {
+                "frame_count": frame_count,
+                "fps": fps,
+                "width": width,
+                "height": height,
+                "duration": frame_count / fps
+            }
+        }
+    
+    except Exception as e:
+        logger.error(f"Error rendering video: {str(e)}")
+        return {"success": False, "error": str(e)}
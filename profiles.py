@@ -0,0 +1,91 @@
+"""
+Named processing profiles that trade accuracy for speed.
+
+A profile bundles the MediaPipe Pose settings (model complexity, segmentation,
+landmark smoothing and confidence thresholds) with the resolution frames are
+scaled down to before inference. The segmentation mask is never used by the
+analysis, so none of the built-in profiles pay for it.
+
+Profiles are plain dicts so they can be passed to worker processes and hashed
+into the result cache key; changing one invalidates the results computed with
+it. `python -m benchmarks.profiles` measures their speed and how far their
+angles are from the accurate profile's.
+"""
+
+import os
+
+# Profile table: name -> settings
+#   model_complexity: 0 (lite), 1 (full) or 2 (heavy) pose landmark model
+#   enable_segmentation: Also compute the person segmentation mask
+#   smooth_landmarks: Filter landmarks across frames to reduce jitter
+#   min_detection_confidence / min_tracking_confidence: MediaPipe thresholds
+#   max_dimension: Longest side of the image given to the model, None for the
+#       decoded resolution
+PROFILES = {
+    "fast": {
+        "model_complexity": 0,
+        "enable_segmentation": False,
+        "smooth_landmarks": True,
+        "min_detection_confidence": 0.5,
+        "min_tracking_confidence": 0.5,
+        "max_dimension": 480
+    },
+    "balanced": {
+        "model_complexity": 1,
+        "enable_segmentation": False,
+        "smooth_landmarks": True,
+        "min_detection_confidence": 0.5,
+        "min_tracking_confidence": 0.5,
+        "max_dimension": 720
+    },
+    "accurate": {
+        "model_complexity": 2,
+        "enable_segmentation": False,
+        "smooth_landmarks": True,
+        "min_detection_confidence": 0.5,
+        "min_tracking_confidence": 0.5,
+        "max_dimension": None
+    },
+}
+
+# Profile used when a request doesn't name one
+DEFAULT_PROFILE = os.environ.get("PROCESSING_PROFILE", "accurate")
+
+
+def validate_profile(name):
+    """
+    Check a profile name.
+
+    Args:
+        name: Profile name, or None for the default profile
+
+    Returns:
+        The profile name
+
+    Raises:
+        ValueError: If the profile is unknown
+    """
+    name = name or DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"Unknown profile: {name} (expected one of {', '.join(PROFILES)})")
+    return name
+
+
+def get_profile(name=None):
+    """Return the settings of a profile (the default one if `name` is None)."""
+    return PROFILES[validate_profile(name)]
+
+
+def inference_size(width, height, max_dimension):
+    """
+    Size of the image given to the model for a frame of `width` x `height`.
+
+    Frames are only ever scaled down, keeping their aspect ratio.
+
+    Returns:
+        A (width, height) tuple
+    """
+    if not max_dimension or max(width, height) <= max_dimension:
+        return width, height
+    scale = max_dimension / max(width, height)
+    return max(int(round(width * scale)), 1), max(int(round(height * scale)), 1)
@@ -0,0 +1,535 @@
+"""
+Download videos from URLs (e.g. an internal object store) for analysis.
+
+A download streams the response body to disk in a background thread, so the
+analysis can start before it has finished: it follows the growing file the
+same way it follows a streamed upload (see ingest.follow), as long as the
+container can be decoded front to back (WebM/Matroska, and MP4 or MOV with the
+moov box before the media data). Other files are analyzed once complete.
+
+Downloads are keyed by URL. A second request for a URL that is downloading
+joins that download, and one for a URL downloaded before reuses the file
+without touching the network (URLs are treated as immutable; refresh
+revalidates with a conditional request). A download cut off midway, within a
+request or by a restart, carries on from where it stopped with an HTTP range
+request, validated with If-Range so a changed file is fetched from the start.
+Downloads nobody asked for in a day are deleted (RemoteStore.prune).
+
+The data is written to `<key><ext>` in the data folder (next to the uploads,
+so it is served by /api/videos) and its state to `<key>.json`, which has the
+"complete" flag ingest.follow polls, plus the validators, size and content
+hash. Connections are kept alive and reused per host by a ConnectionPool.
+
+Only hosts on the store's allow list are downloaded from, redirects included.
+A host name is resolved before connecting and the connection is made to the
+address that was checked: unless the host is named on the list, an address
+that isn't public (loopback, link-local such as a cloud metadata service,
+private or reserved ranges) is refused, so URLs can't reach internal services.
+"""
+
+import hashlib
+import http.client
+import ipaddress
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Bytes read at a time from a response body
+CHUNK_SIZE = 1024 * 1024
+
+# Times a download is resumed after a dropped connection or a server error
+RETRIES = 5
+
+# Seconds to wait before the first retry (doubled for each one after)
+RETRY_BACKOFF_SECONDS = 0.5
+
+# Seconds a socket may block on connect or read
+TIMEOUT_SECONDS = 30
+
+MAX_REDIRECTS = 5
+
+# Idle keep-alive connections kept per host
+MAX_IDLE_PER_HOST = 4
+
+
+class DownloadError(Exception):
+    """Raised for URLs that can't be downloaded."""
+
+
+class _Retry(Exception):
+    # A failure worth resuming the download after
+    pass
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections reused across requests to the same host.
+
+    Args:
+        max_idle: Idle connections kept per host
+        timeout: Socket timeout in seconds
+    """
+
+    def __init__(self, max_idle=MAX_IDLE_PER_HOST, timeout=TIMEOUT_SECONDS):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, scheme, host, port, allow_private):
+        address = resolve(host, port, allow_private)
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        # Connect to the address that was checked rather than resolving the
+        # name again (TLS still verifies the host name)
+        connection._create_connection = (
+            lambda _, timeout, source: socket.create_connection(address, timeout, source))
+        return connection
+
+    def request(self, method, url, headers=None, allow_private=False):
+        """
+        Send a request on a pooled connection.
+
+        Args:
+            method: HTTP method
+            url: http(s) URL
+            headers: Request headers
+            allow_private: Connect even if the host resolves to an address
+                that isn't public (see resolve)
+
+        Returns:
+            A (connection, response) pair; pass both to release once the body
+            has been read (or abandoned)
+        """
+        parts = urlsplit(url)
+        default_port = 443 if parts.scheme == "https" else 80
+        origin = (parts.scheme, parts.hostname, parts.port or default_port)
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        with self._lock:
+            idle = self._idle.get(origin)
+            connection = idle.pop() if idle else None
+        if connection is not None:
+            # The server may have closed an idle connection since its last use
+            try:
+                connection.request(method, target, headers=headers or {})
+                return connection, connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                connection.close()
+        connection = self._connect(*origin, allow_private)
+        try:
+            connection.request(method, target, headers=headers or {})
+            return connection, connection.getresponse()
+        except Exception:
+            connection.close()
+            raise
+
+    def release(self, connection, response):
+        """Return a connection to the pool if its response was read to the end."""
+        if not response.isclosed() or response.will_close:
+            connection.close()
+            return
+        scheme = "https" if isinstance(connection, http.client.HTTPSConnection) else "http"
+        origin = (scheme, connection.host, connection.port)
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            connections = [connection for idle in self._idle.values() for connection in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+
+
+def resolve(host, port, allow_private=False):
+    """
+    Resolve a host to the (address, port) to connect to.
+
+    Raises:
+        DownloadError: Unless `allow_private`, if any of the host's addresses
+            isn't public: loopback, link-local, private or reserved
+        OSError: If the name can't be resolved
+    """
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    if not allow_private:
+        for info in infos:
+            address = ipaddress.ip_address(info[4][0].split("%")[0])
+            if not address.is_global:
+                raise DownloadError(f"{host} resolves to {address}, which isn't a public address")
+    return infos[0][4][:2]
+
+
+def url_key(url):
+    """Name a URL's download is stored under."""
+    return hashlib.sha256(url.encode()).hexdigest()[:32]
+
+
+def streamable(head):
+    """
+    Whether a video starting with these bytes can be decoded as it arrives.
+
+    WebM/Matroska always can; an MP4 or MOV can when its moov box (or a
+    fragment) comes before the media data.
+    """
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return True
+    position = 0
+    while position + 8 <= len(head):
+        size, kind = struct.unpack(">I4s", head[position:position + 8])
+        if kind in (b"moov", b"moof"):
+            return True
+        if kind == b"mdat" or size == 0:
+            return False
+        if size == 1:
+            if position + 16 > len(head):
+                return False
+            size = struct.unpack(">Q", head[position + 8:position + 16])[0]
+        if size < 8:
+            return False
+        position += size
+    return False
+
+
+class Download:
+    """
+    State of one URL's download, shared by the requests waiting on it.
+
+    Attributes:
+        path: The downloaded data (growing until complete)
+        meta_path: Its state file, as passed to ingest.follow
+        received: Bytes written so far
+        size: Total size once known
+        complete: Whether every byte has been written
+        video_hash: SHA-256 of the data once complete
+        error: Why the download failed, or None
+    """
+
+    def __init__(self, url, path, meta_path, meta=None):
+        meta = meta or {}
+        self.url = url
+        self.path = path
+        self.meta_path = meta_path
+        self.size = meta.get("size")
+        self.complete = meta.get("complete", False)
+        self.video_hash = meta.get("video_hash")
+        self.etag = meta.get("etag")
+        self.last_modified = meta.get("last_modified")
+        self.received = os.path.getsize(path) if os.path.exists(path) else 0
+        self.error = None
+        self._changed = threading.Condition()
+
+    def wait(self, min_bytes=None, timeout=None):
+        """
+        Block until the download is over, or has at least `min_bytes`.
+
+        Returns:
+            False if `timeout` seconds passed first
+        """
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: self.complete or self.error is not None
+                or (min_bytes is not None and self.received >= min_bytes), timeout)
+
+    def head(self, size):
+        """The first `size` bytes written so far."""
+        with open(self.path, "rb") as f:
+            return f.read(size)
+
+    def _update(self, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self._changed.notify_all()
+
+    def _write_meta(self):
+        # Replace the state atomically so followers never see half a file
+        meta = {"url": self.url, "path": os.path.basename(self.path),
+                "complete": self.complete, "error": self.error,
+                "size": self.size, "etag": self.etag, "last_modified": self.last_modified,
+                "video_hash": self.video_hash, "updated_at": time.time()}
+        temp_path = f"{self.meta_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, self.meta_path)
+
+
+class RemoteStore:
+    """
+    URL downloads kept on disk and deduplicated by URL.
+
+    Args:
+        folder: Directory for the download state files
+        data_folder: Directory the downloaded data is written to
+        max_bytes: Largest accepted download
+        allowed_hosts: Host names that may be downloaded from, and may resolve
+            to private addresses (e.g. an object store on the internal
+            network); "*" allows any host with public addresses, and none
+            are allowed if empty
+        pool: ConnectionPool to send requests on
+    """
+
+    def __init__(self, folder, data_folder, max_bytes, allowed_hosts=(), pool=None):
+        self.folder = folder
+        self.data_folder = data_folder
+        self.max_bytes = max_bytes
+        self.allowed_hosts = {host.lower() for host in allowed_hosts}
+        self.pool = pool or ConnectionPool()
+        self._active = {}
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _check_url(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise DownloadError(f"Not an http(s) URL: {url}")
+        if not self.allowed_hosts:
+            raise DownloadError("Downloads from URLs are disabled")
+        if parts.hostname.lower() not in self.allowed_hosts and "*" not in self.allowed_hosts:
+            raise DownloadError(f"Downloads from {parts.hostname} are not allowed")
+
+    def open(self, url, extension=".mp4", refresh=False):
+        """
+        Start downloading a URL, or join or reuse its download.
+
+        Args:
+            url: http(s) URL of the video
+            extension: File extension including the dot, e.g. ".mp4"
+            refresh: Revalidate a completed download with the server
+
+        Returns:
+            A Download, possibly already complete
+
+        Raises:
+            DownloadError: If the URL isn't http(s) or its host isn't allowed
+        """
+        self._check_url(url)
+        key = url_key(url)
+        with self._lock:
+            download = self._active.get(key)
+            if download is not None:
+                return download
+            meta_path = os.path.join(self.folder, f"{key}.json")
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (FileNotFoundError, ValueError):
+                meta = None
+            path = os.path.join(self.data_folder, f"{key}{extension.lower()}")
+            # A failed download is resumed too (its error is not carried over)
+            download = Download(url, path, meta_path, meta)
+            revalidate = download.complete and download.received == download.size
+            if revalidate:
+                # Keep a download in use from being pruned
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass
+                if not refresh:
+                    return download
+            if not os.path.exists(path) or meta is None:
+                # Nothing (valid) to resume from
+                open(path, "wb").close()
+                download = Download(url, path, meta_path)
+                revalidate = False
+            # Requests joining a revalidation wait for its outcome
+            download.complete = False
+            self.prune()
+            self._active[key] = download
+        download._write_meta()
+        threading.Thread(target=self._run, args=(key, download, revalidate), daemon=True,
+                         name=f"download-{key[:8]}").start()
+        return download
+
+    def prune(self, max_age=24 * 60 * 60):
+        """
+        Forget downloads whose data was removed (e.g. evicted from the result
+        cache), and delete completed ones not used and unfinished ones not
+        written to for `max_age` seconds.
+        """
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.folder):
+            if not name.endswith(".json") or name[:-len(".json")] in self._active:
+                continue
+            meta_path = os.path.join(self.folder, name)
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            data_path = os.path.join(self.data_folder, meta["path"])
+            if meta["complete"]:
+                # A reused download is touched (see open)
+                try:
+                    used_at = os.path.getmtime(data_path)
+                except FileNotFoundError:
+                    used_at = None
+            else:
+                used_at = meta["updated_at"]
+            if used_at is not None and used_at > cutoff:
+                continue
+            for path in (meta_path, data_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _run(self, key, download, revalidate):
+        # Download in the background, resuming after transient failures
+        try:
+            for attempt in range(RETRIES + 1):
+                try:
+                    self._transfer(download, revalidate)
+                    break
+                except _Retry as e:
+                    # A new version whose body started arriving (its hash was
+                    # cleared) is resumed rather than revalidated, or a 304 for
+                    # it would complete the partial file
+                    revalidate = revalidate and download.video_hash is not None
+                    if attempt == RETRIES:
+                        raise DownloadError(f"{str(e)} (gave up after {RETRIES} retries)")
+                    logger.warning(f"Download of {download.url} interrupted at "
+                                   f"{download.received} bytes, resuming: {str(e)}")
+                    time.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+            with self._lock:
+                self._active.pop(key, None)
+        except Exception as e:
+            logger.error(f"Download of {download.url} failed: {str(e)}")
+            # Let the next request start over before anyone sees the error
+            with self._lock:
+                self._active.pop(key, None)
+            download._update(error=str(e))
+            # Followers stop at the error instead of waiting for more data
+            download._write_meta()
+
+    def _transfer(self, download, revalidate):
+        # One request for the rest of the data, following redirects
+        headers = {"Accept-Encoding": "identity"}
+        if revalidate:
+            if download.etag:
+                headers["If-None-Match"] = download.etag
+            if download.last_modified:
+                headers["If-Modified-Since"] = download.last_modified
+        elif download.received:
+            # Resume only while the file is unchanged (a weak ETag can't tell)
+            validator = download.etag if download.etag and not download.etag.startswith("W/") \
+                else download.last_modified
+            if validator:
+                headers["Range"] = f"bytes={download.received}-"
+                headers["If-Range"] = validator
+
+        url = download.url
+        for _ in range(MAX_REDIRECTS + 1):
+            # Only hosts named on the allow list may be internal
+            listed = urlsplit(url).hostname.lower() in self.allowed_hosts
+            try:
+                connection, response = self.pool.request("GET", url, headers,
+                                                         allow_private=listed)
+            except (OSError, http.client.HTTPException) as e:
+                raise _Retry(str(e))
+            if response.status not in (301, 302, 303, 307, 308):
+                break
+            location = response.getheader("Location")
+            response.read()
+            self.pool.release(connection, response)
+            if not location:
+                raise DownloadError(f"{url} redirected without a location")
+            url = urljoin(url, location)
+            self._check_url(url)
+        else:
+            raise DownloadError(f"{download.url} redirected too many times")
+
+        try:
+            if response.status == 304 and revalidate:
+                response.read()
+                download._update(complete=True)
+                download._write_meta()
+                return
+            if response.status >= 500 or response.status == 429:
+                response.read()
+                raise _Retry(f"HTTP {response.status}")
+            if response.status == 416 and download.received:
+                # The range was past the end: fetch the whole file again
+                response.read()
+                open(download.path, "wb").close()
+                download._update(received=0, etag=None, last_modified=None)
+                raise _Retry("Range not satisfiable")
+            if response.status not in (200, 206):
+                raise DownloadError(f"{download.url} returned HTTP {response.status}")
+            received, video_hash = self._read_body(download, response)
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise _Retry(str(e))
+        except Exception:
+            connection.close()
+            raise
+        # Put the connection back before waiting requests go on to the next
+        # download
+        self.pool.release(connection, response)
+        download._update(complete=True, size=received, video_hash=video_hash)
+        download._write_meta()
+        logger.info(f"Downloaded {received} bytes from {download.url}")
+
+    def _read_body(self, download, response):
+        # Write the response body after what is on disk, or over it for a 200;
+        # returns the total size and the hash of the data
+        digest = hashlib.sha256()
+        if response.status == 206:
+            start, size = _content_range(response.getheader("Content-Range"))
+            if start != download.received:
+                raise DownloadError(f"{download.url} resumed at byte {start} instead of "
+                                    f"{download.received}")
+            with open(download.path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            mode = "ab"
+        else:
+            length = response.getheader("Content-Length")
+            size = int(length) if length is not None else None
+            mode = "wb"
+            download._update(received=0, complete=False, video_hash=None)
+        if size is not None and size > self.max_bytes:
+            raise DownloadError(f"{download.url} is larger than {self.max_bytes} bytes")
+        download._update(size=size, etag=response.getheader("ETag"),
+                         last_modified=response.getheader("Last-Modified"))
+        download._write_meta()
+
+        received = download.received
+        with open(download.path, mode) as f:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if received > self.max_bytes:
+                    raise DownloadError(f"{download.url} is larger than {self.max_bytes} bytes")
+                f.write(chunk)
+                f.flush()
+                digest.update(chunk)
+                download._update(received=received)
+        if size is not None and received < size:
+            raise _Retry(f"Connection closed after {received} of {size} bytes")
+        return received, digest.hexdigest()
+
+
+def _content_range(value):
+    # Start and total size from a "bytes start-end/total" header
+    try:
+        unit, _, spec = value.partition(" ")
+        span, _, total = spec.partition("/")
+        return int(span.split("-")[0]), None if total == "*" else int(total)
+    except (AttributeError, ValueError):
+        raise DownloadError(f"Invalid Content-Range: {value}")
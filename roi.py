@@ -0,0 +1,254 @@
+"""
+Region-of-interest crops that follow a person from frame to frame.
+
+When the person fills a small part of the frame (wide-angle camera footage),
+most of what the pose model is given is background. Once a pose has been
+found, the next frame is cropped to a padded box around its landmarks and,
+if the crop is still large, scaled down to ROI_MAX_DIMENSION before
+inference. The landmarks the model returns are normalized to the crop and are
+mapped back to the full frame (to_frame_landmarks), so angles, drawing and
+stored landmarks don't depend on the crop.
+
+The crop is a square around the person's box, like the one the pose model
+cuts out for itself, so a person seen from the side isn't cut off when they
+raise an arm. It is only moved when the person gets close to its edge or
+shrinks well inside it, since the pose model tracks the person from the
+previous frame in the coordinates of the image it is given: a small shift
+it follows, but not a switch between crops and whole frames, so the two go
+to separate detectors. A frame in which the crop finds no pose is searched
+again at full size, and the following frames are too until a pose is found.
+
+Multi-person tracking (multiperson.py) crops each person the same way.
+"""
+
+import os
+
+import cv2
+import numpy as np
+from mediapipe.framework.formats import landmark_pb2
+
+from profiles import inference_size
+
+# Margin added around a person's box on each side before cropping, as a
+# fraction of its width and height
+ROI_PADDING = 0.25
+
+# Landmarks this visible make up the box a person is followed by; fewer than
+# ROI_MIN_LANDMARKS of them count as losing the pose
+ROI_MIN_VISIBILITY = 0.5
+ROI_MIN_LANDMARKS = 6
+
+# Most a person's box may shrink from one frame to the next (as a factor of
+# its width and height), so a pose with only a few landmarks visible doesn't
+# collapse the crop
+ROI_MAX_SHRINK = 0.9
+
+# Longest side of a single-person crop given to the pose model (its landmark
+# model looks at 256 x 256 pixels of the person)
+ROI_MAX_DIMENSION = int(os.environ.get("ROI_MAX_DIMENSION", 384))
+
+# Side of a single-person crop as a multiple of the longer side of the
+# person's box
+ROI_SCALE = 1.5
+
+# A single-person crop is moved once the person's box comes closer to its
+# edge than this fraction of the margin it was made with, or its longer side
+# shrinks below this fraction of what it was
+ROI_RECENTER_MARGIN = 0.5
+ROI_RECENTER_SHRINK = 0.6
+
+
+def to_frame_landmarks(pose_landmarks, roi, width, height):
+    """
+    Map landmarks found in a crop to normalized full-frame coordinates.
+
+    Args:
+        pose_landmarks: MediaPipe landmarks normalized to the crop
+        roi: The crop's (x0, y0, x1, y1) rectangle in frame pixels
+        width: Frame width
+        height: Frame height
+
+    Returns:
+        A NormalizedLandmarkList normalized to the frame
+    """
+    x0, y0, x1, y1 = roi
+    crop_width, crop_height = x1 - x0, y1 - y0
+    mapped = landmark_pb2.NormalizedLandmarkList()
+    for lm in pose_landmarks.landmark:
+        # z uses the same scale as x
+        mapped.landmark.add(x=(x0 + lm.x * crop_width) / width,
+                            y=(y0 + lm.y * crop_height) / height,
+                            z=lm.z * crop_width / width,
+                            visibility=lm.visibility)
+    return mapped
+
+
+def landmark_box(pose_landmarks, roi, width, height):
+    """
+    Box around the visible landmarks, in frame pixels.
+
+    Landmarks the model placed outside the crop they were found in are
+    clamped to it, so a bad estimate can't stretch the box over someone else.
+
+    Returns:
+        An x, y, width, height array, or None if too few landmarks are visible
+    """
+    points = np.array([(lm.x * width, lm.y * height) for lm in pose_landmarks.landmark
+                       if lm.visibility >= ROI_MIN_VISIBILITY])
+    if len(points) < ROI_MIN_LANDMARKS:
+        return None
+    points = np.clip(points, roi[:2], roi[2:])
+    (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+    if x1 - x0 < 1 or y1 - y0 < 1:
+        return None
+    return np.array([x0, y0, x1 - x0, y1 - y0])
+
+
+def padded_roi(box, width, height):
+    """Padded crop rectangle (x0, y0, x1, y1) of an x, y, width, height box, within the frame."""
+    x, y, w, h = box
+    x0 = int(max(x - w * ROI_PADDING, 0))
+    y0 = int(max(y - h * ROI_PADDING, 0))
+    x1 = int(min(x + w * (1 + ROI_PADDING), width))
+    y1 = int(min(y + h * (1 + ROI_PADDING), height))
+    return x0, y0, x1, y1
+
+
+class RoiTracker:
+    """
+    Crop rectangle following the person in a single-person analysis.
+
+    Args:
+        width: Frame width
+        height: Frame height
+        max_dimension: Longest side of the whole frames given to the model;
+            crops are scaled down to this or ROI_MAX_DIMENSION, whichever is
+            smaller
+    """
+
+    def __init__(self, width, height, max_dimension=None):
+        self.width = width
+        self.height = height
+        self.max_dimension = min(max_dimension or ROI_MAX_DIMENSION, ROI_MAX_DIMENSION)
+        # Crop of the next frame, None to search the whole frame
+        self.roi = None
+        self._box = None
+        self._roi_side = None
+        self.cropped_frames = 0
+        self.full_frames = 0
+        self.fallbacks = 0
+        self.recenters = 0
+        # Changes between crops and whole frames as the model's input, and the
+        # kind of input it was given last
+        self.switches = 0
+        self._last_input = None
+        self._crop_area = 0.0
+        self._cropped_seconds = 0.0
+        self._full_seconds = 0.0
+
+    def crop(self, frame):
+        """The current crop of a BGR frame, scaled down and converted to RGB."""
+        x0, y0, x1, y1 = self.roi
+        crop = frame[y0:y1, x0:x1]
+        size = inference_size(x1 - x0, y1 - y0, self.max_dimension)
+        if size != (x1 - x0, y1 - y0):
+            crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+
+    def update(self, pose_landmarks, roi, seconds, fallback=False):
+        """
+        Follow the pose found in a frame.
+
+        Args:
+            pose_landmarks: Full-frame landmarks of the frame, or None
+            roi: The crop they were found in, None if the whole frame was
+                searched
+            seconds: Time spent on the frame's inference
+            fallback: Whether the whole frame was searched after the crop
+                found nothing
+        """
+        if roi is not None:
+            self.cropped_frames += 1
+            self._cropped_seconds += seconds
+            self._crop_area += (roi[2] - roi[0]) * (roi[3] - roi[1])
+        else:
+            self.full_frames += 1
+            self._full_seconds += seconds
+        if fallback:
+            self.fallbacks += 1
+        inputs = ["crop", "full"] if fallback else ["crop" if roi is not None else "full"]
+        for kind in inputs:
+            if self._last_input not in (None, kind):
+                self.switches += 1
+            self._last_input = kind
+
+        box = None
+        if pose_landmarks is not None:
+            box = landmark_box(pose_landmarks, roi or (0, 0, self.width, self.height),
+                               self.width, self.height)
+        if box is None:
+            # Search the whole frame until the person is found again
+            self.roi = self._box = self._roi_side = None
+            return
+        if self._box is not None:
+            # Don't let a few visible landmarks collapse the box
+            centre = box[:2] + box[2:] / 2
+            size = np.maximum(box[2:], self._box[2:] * ROI_MAX_SHRINK)
+            box = np.concatenate([centre - size / 2, size])
+        self._box = box
+        if self.roi is None or self._needs_recenter(box):
+            side = box[2:].max()
+            if self.roi is not None:
+                self.recenters += 1
+                # Landmarks past the crop's edge were clamped to it, so only
+                # make the crop smaller once the person really got smaller
+                if side >= self._roi_side * ROI_RECENTER_SHRINK:
+                    side = max(side, self._roi_side)
+            self._roi_side = side
+            self.roi = self._square(box)
+
+    def _square(self, box):
+        # Square crop centred on the box, moved (not cut) to fit in the frame
+        side = min(self._roi_side * ROI_SCALE, self.width, self.height)
+        centre = box[:2] + box[2:] / 2
+        x0 = min(max(centre[0] - side / 2, 0), self.width - side)
+        y0 = min(max(centre[1] - side / 2, 0), self.height - side)
+        return int(x0), int(y0), int(x0 + side), int(y0 + side)
+
+    def _needs_recenter(self, box):
+        # Whether the box got too close to the crop's edge (where it isn't the
+        # frame's edge) or too small for it
+        x0, y0, x1, y1 = self.roi
+        margin = self._roi_side * (ROI_SCALE - 1) / 2 * ROI_RECENTER_MARGIN
+        if (box[0] - x0 < margin and x0 > 0) or (x1 - box[0] - box[2] < margin
+                                                 and x1 < self.width):
+            return True
+        if (box[1] - y0 < margin and y0 > 0) or (y1 - box[1] - box[3] < margin
+                                                 and y1 < self.height):
+            return True
+        return bool(box[2:].max() < self._roi_side * ROI_RECENTER_SHRINK)
+
+    def report(self):
+        """Summary for the result: how many frames were cropped and what it saved."""
+        frames = self.cropped_frames + self.full_frames
+        cropped_ms = (self._cropped_seconds / self.cropped_frames * 1000
+                      if self.cropped_frames else None)
+        full_ms = self._full_seconds / self.full_frames * 1000 if self.full_frames else None
+        return {
+            "frames": frames,
+            "cropped_frames": self.cropped_frames,
+            "full_frames": self.full_frames,
+            "fallbacks": self.fallbacks,
+            "recenters": self.recenters,
+            "switches": self.switches,
+            # Mean share of the frame's pixels in a crop
+            "mean_crop_fraction": (self._crop_area / self.cropped_frames
+                                   / (self.width * self.height)
+                                   if self.cropped_frames else None),
+            # Mean inference time of cropped frames and of frames searched at
+            # full size. The latter include every person detection, so they
+            # aren't a fair baseline; python -m benchmarks.roi compares runs
+            # with and without crops
+            "cropped_inference_ms": cropped_ms,
+            "full_frame_inference_ms": full_ms
+        }
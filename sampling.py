@@ -0,0 +1,152 @@
+"""
+Frame sampling to run pose inference on fewer frames.
+
+A FrameSampler decides which decoded frames go through the pose model, either
+at a fixed target rate or adaptively: the gap between samples shrinks when the
+landmarks move quickly and grows while the subject holds still. Angles for the
+frames in between are interpolated linearly from the neighbouring samples, so a
+result still has one entry per original frame.
+
+The interpolation error is estimated without extra inference by leaving each
+sample out in turn and comparing it with the value interpolated from its
+neighbours, which models a gap twice as long as the one actually used.
+"""
+
+import numpy as np
+
+# Mean landmark movement per frame (in normalized image units) above which the
+# adaptive sampler halves its interval, and below which it lengthens it
+FAST_MOTION = 0.01
+SLOW_MOTION = 0.002
+
+# Lowest sampling rate used by the adaptive mode when none is given (samples/sec)
+DEFAULT_MIN_FPS = 5.0
+
+
+class FrameSampler:
+    """
+    Chooses which frames to run inference on.
+
+    Args:
+        fps: Frame rate of the video
+        target_fps: Sampling rate; in adaptive mode the lowest rate used
+        adaptive: Adjust the rate to how fast the landmarks move
+    """
+
+    def __init__(self, fps, target_fps=None, adaptive=False):
+        self.adaptive = adaptive
+        self.target_fps = target_fps
+        min_fps = target_fps or DEFAULT_MIN_FPS
+        self.max_interval = max(int(round(fps / min_fps)), 1) if fps > 0 else 1
+        self.interval = 1 if adaptive else self.max_interval
+        self.sampled = []
+        self._next = 0
+        self._last_landmarks = None
+        self._last_row = None
+
+    def should_sample(self, row):
+        """Decide whether frame `row` (the next frame in order) is inferred."""
+        sample = row >= self._next
+        self.sampled.append(sample)
+        if sample:
+            self._next = row + self.interval
+        return sample
+
+    def observe(self, row, landmarks):
+        """
+        Adapt the interval to the motion seen at a sampled frame.
+
+        Args:
+            row: Index of the sampled frame
+            landmarks: (33, 4) landmarks of that frame, NaN if nothing was
+                detected
+        """
+        if not self.adaptive:
+            return
+        if np.isnan(landmarks[0, 0]):
+            # Lost the subject; sample densely until it is found again
+            self.interval = 1
+            self._last_landmarks = None
+        else:
+            if self._last_landmarks is not None:
+                motion = np.nanmean(np.abs(landmarks[:, :2] - self._last_landmarks[:, :2]))
+                motion /= row - self._last_row
+                if motion > FAST_MOTION:
+                    self.interval = max(self.interval // 2, 1)
+                elif motion < SLOW_MOTION:
+                    self.interval = min(self.interval + 1, self.max_interval)
+            self._last_landmarks = landmarks.copy()
+            self._last_row = row
+        self._next = row + self.interval
+
+    def mask(self, start=0, end=None):
+        """Return a bool array marking the sampled frames in [start, end)."""
+        return np.array(self.sampled[start:end], dtype=bool)
+
+    def last_sampled(self, before):
+        """Index of the last sampled frame before `before`, or None."""
+        for row in range(min(before, len(self.sampled)) - 1, -1, -1):
+            if self.sampled[row]:
+                return row
+        return None
+
+
+def interpolate(angles, sampled):
+    """
+    Fill the angles of frames that were not sampled.
+
+    Each skipped frame is interpolated linearly between the samples around it;
+    frames after the last sample keep its value. If either neighbouring sample
+    has no angle, neither does the frame.
+
+    Args:
+        angles: (N, J) angle array; rows of skipped frames are ignored
+        sampled: (N,) bool array, True for sampled frames (the first frame
+            must be sampled)
+
+    Returns:
+        A new (N, J) array
+    """
+    angles = angles.copy()
+    samples = np.flatnonzero(sampled)
+    skipped = np.flatnonzero(~sampled)
+    if len(samples) == 0 or len(skipped) == 0:
+        return angles
+
+    position = np.searchsorted(samples, skipped, side="right") - 1
+    left = samples[np.maximum(position, 0)]
+    right = samples[np.minimum(position + 1, len(samples) - 1)]
+    span = np.maximum(right - left, 1)
+    weight = np.where(right > left, (skipped - left) / span, 0.0)[:, None]
+    angles[skipped] = angles[left] + (angles[right] - angles[left]) * weight
+    return angles
+
+
+def estimate_error(angles, sampled):
+    """
+    Estimate the interpolation error from the sampled frames alone.
+
+    Args:
+        angles: (N, J) angle array
+        sampled: (N,) bool array of sampled frames
+
+    Returns:
+        A dict with the mean, 95th percentile and max absolute error in
+        degrees (None when there are too few samples to tell)
+    """
+    samples = np.flatnonzero(sampled)
+    if len(samples) < 3:
+        return {"mean": None, "p95": None, "max": None}
+
+    left, middle, right = samples[:-2], samples[1:-1], samples[2:]
+    weight = ((middle - left) / (right - left))[:, None]
+    predicted = angles[left] + (angles[right] - angles[left]) * weight
+    error = np.abs(predicted - angles[middle])
+    error = error[np.isfinite(error)]
+    if error.size == 0:
+        return {"mean": None, "p95": None, "max": None}
+    return {
+        "mean": float(error.mean()),
+        "p95": float(np.percentile(error, 95)),
+        "max": float(error.max())
+    }
@@ -0,0 +1,164 @@
+"""
+On-disk angle results for very long videos.
+
+A spill is a directory with one raw little-endian file per column, the same
+columns as an AngleColumns: timestamps (float64), detected (bool) and one
+float32 file per joint, plus meta.json describing them. process_video appends
+each batch of angles to the column files as soon as it is computed, so no
+per-frame data accumulates in memory however long the video is, and readers
+memory-map the files and copy out only the window they were asked for.
+
+meta.json is written when the spill is complete; a spill without it is still
+being written (or was abandoned) and can't be opened.
+"""
+
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from columnar import AngleColumns
+
+META_FILENAME = "meta.json"
+
+# Column file names of the timestamps and detection mask; joints are stored
+# as "<joint>.f32"
+_TIMESTAMPS = "timestamps.f64"
+_DETECTED = "detected.u1"
+
+
+class SpillWriter:
+    """
+    Append angles to a spill directory.
+
+    Args:
+        path: Directory to create (it must not exist yet)
+        joints: Joint names, in column order
+        fps: Frame rate of the video, recorded in meta.json
+    """
+
+    def __init__(self, path, joints, fps):
+        os.makedirs(path)
+        self.path = path
+        self.joints = tuple(joints)
+        self.fps = fps
+        self.frames = 0
+        self._timestamps = open(os.path.join(path, _TIMESTAMPS), "wb")
+        self._detected = open(os.path.join(path, _DETECTED), "wb")
+        self._columns = [open(os.path.join(path, f"{name}.f32"), "wb") for name in self.joints]
+
+    def append(self, angles, timestamps, detected):
+        """
+        Write the next frames.
+
+        Args:
+            angles: (n, J) angle array, joints in the writer's order
+            timestamps: (n,) frame times in seconds
+            detected: (n,) bool array
+        """
+        self._timestamps.write(np.asarray(timestamps, dtype="<f8").tobytes())
+        self._detected.write(np.asarray(detected, dtype=bool).tobytes())
+        for index, f in enumerate(self._columns):
+            f.write(np.ascontiguousarray(angles[:, index], dtype="<f4").tobytes())
+        self.frames += len(timestamps)
+
+    def _close_files(self):
+        for f in [self._timestamps, self._detected] + self._columns:
+            f.close()
+
+    def close(self, **extra):
+        """Finish the spill; `extra` fields are stored in meta.json."""
+        self._close_files()
+        meta = {"joints": list(self.joints), "fps": self.fps, "frames": self.frames, **extra}
+        temp_path = os.path.join(self.path, META_FILENAME + ".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, os.path.join(self.path, META_FILENAME))
+
+    def abort(self):
+        """Close and delete an unfinished spill."""
+        self._close_files()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class SpillReader:
+    """
+    Read windows of a finished spill.
+
+    Args:
+        path: Spill directory
+
+    Raises:
+        FileNotFoundError: If the spill doesn't exist or isn't finished
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, META_FILENAME)) as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.joints = tuple(self.meta["joints"])
+        self.frames = self.meta["frames"]
+        self.timestamps = self._map(_TIMESTAMPS, "<f8")
+        self.detected = self._map(_DETECTED, bool)
+
+    def __len__(self):
+        return self.frames
+
+    def _map(self, filename, dtype):
+        if self.frames == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.path, filename), dtype=dtype, mode="r",
+                         shape=(self.frames,))
+
+    def column(self, name):
+        """Memory-mapped angle array of one joint."""
+        return self._map(f"{name}.f32", "<f4")
+
+    def frame_range(self, start=None, end=None):
+        """
+        Frames whose timestamps fall in [start, end) seconds.
+
+        Returns:
+            A (first, stop) pair of frame indices
+        """
+        first = 0 if start is None else int(np.searchsorted(self.timestamps, start, "left"))
+        stop = self.frames if end is None else int(np.searchsorted(self.timestamps, end, "left"))
+        return first, max(stop, first)
+
+    def window(self, first=0, stop=None, joints=None):
+        """
+        Copy frames [first, stop) of some joints into memory.
+
+        Args:
+            first: First frame index
+            stop: Frame index to stop before (default: the end)
+            joints: Joint names to include (default: all)
+
+        Returns:
+            An AngleColumns
+
+        Raises:
+            ValueError: If a joint isn't in the spill
+        """
+        joints = list(joints or self.joints)
+        unknown = [name for name in joints if name not in self.joints]
+        if unknown:
+            raise ValueError(f"Joints not in this result: {', '.join(unknown)}")
+        stop = self.frames if stop is None else min(stop, self.frames)
+        first = min(max(first, 0), stop)
+        return AngleColumns(joints, np.array(self.timestamps[first:stop]),
+                            {name: np.array(self.column(name)[first:stop]) for name in joints},
+                            np.array(self.detected[first:stop]))
+
+
+def prune_spills(folder, max_age):
+    """Delete spill directories in `folder` last modified over `max_age` seconds ago."""
+    if not os.path.isdir(folder):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
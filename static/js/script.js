@@ -10,7 +10,12 @@ let lastFrameTime = 0;
 let processingTimes = [];
 let framesAnalyzed = 0;
 let chart;
+let videoFile = null; // File the video was loaded from, for server-side analysis
 let selectedJoint = 'leftElbow';
+let serverResultUrl = null; // Binary (.npz) result of a server-side analysis job
+let serverStream = null; // EventSource of a server-side analysis in progress
+let serverSummary = null; // Summary and downsampled series of a finished server-side analysis
+let serverSession = 0; // Bumped on reset, so late server responses are dropped
 let maxAngles = {
     leftElbow: { value: 0, time: 0 },
     rightElbow: { value: 0, time: 0 },
@@ -20,6 +25,10 @@ let maxAngles = {
     rightKnee: { value: 0, time: 0 }
 };
 
+// Most points drawn on the chart; longer sessions are downsampled so peaks
+// and valleys still show
+const CHART_MAX_POINTS = 300;
+
 // MediaPipe pose landmarks indices
 const POSE_LANDMARKS = {
     NOSE: 0,
@@ -156,11 +165,13 @@ function setupEventListeners() {
     
     // Analysis controls
     const startAnalysisBtn = document.getElementById('startAnalysisBtn');
+    const serverAnalysisBtn = document.getElementById('serverAnalysisBtn');
     const resetBtn = document.getElementById('resetBtn');
     const downloadDataBtn = document.getElementById('downloadDataBtn');
     const skeletonModeToggle = document.getElementById('skeletonMode');
     
     startAnalysisBtn.addEventListener('click', toggleAnalysis);
+    serverAnalysisBtn.addEventListener('click', analyzeOnServer);
     resetBtn.addEventListener('click', resetAnalysis);
     downloadDataBtn.addEventListener('click', downloadData);
     skeletonModeToggle.addEventListener('change', () => {
@@ -199,6 +210,7 @@ function handleVideoFile(file) {
     }
     
     const url = URL.createObjectURL(file);
+    videoFile = file;
     
     // Set video source
     video.src = url;
@@ -261,6 +273,10 @@ function toggleAnalysis() {
             showNotification('MediaPipe is not loaded yet. Please wait.', 'warning');
             return;
         }
+        if (serverStream) {
+            showNotification('Wait for the server analysis to finish or reset it first', 'warning');
+            return;
+        }
         
         analysisActive = true;
         startAnalysisBtn.textContent = 'Stop Analysis';
@@ -606,8 +622,127 @@ function updateAngleData(angles) {
     updateMaxAngles(angles);
 }
 
+// Upload the loaded video for analysis on the server and follow its progress
+async function analyzeOnServer() {
+    if (!videoFile) {
+        showNotification('Please upload a video first', 'warning');
+        return;
+    }
+    
+    resetAnalysis();
+    const session = serverSession;
+    
+    const formData = new FormData();
+    formData.append('video', videoFile);
+    formData.append('skeletonMode', String(skeletonMode));
+    formData.append('saveData', String(document.getElementById('saveData').checked));
+    
+    toggleLoadingOverlay(true, 'Uploading video...');
+    let result;
+    try {
+        const response = await fetch('/api/upload', { method: 'POST', body: formData });
+        result = await response.json();
+        if (!response.ok || !result.success) {
+            throw new Error(result.error || `HTTP ${response.status}`);
+        }
+    } catch (error) {
+        console.error('Server analysis failed to start:', error);
+        showNotification(`Server analysis failed to start: ${error.message}`, 'error');
+        return;
+    } finally {
+        toggleLoadingOverlay(false);
+    }
+    
+    // Reset (or another video loaded) while uploading
+    if (session !== serverSession) return;
+    
+    if (result.job_id) {
+        streamServerAnalysis(result);
+        showNotification('Server analysis started', 'success');
+    } else {
+        // A stored result of the same video and options
+        addServerFrames(result.data || []);
+        showNotification('Loaded a stored server analysis', 'success');
+    }
+}
+
+// Follow a server-side analysis job (the response of /api/upload or
+// /api/analyze that queued it) and render its angles as they arrive
+function streamServerAnalysis(job) {
+    if (serverStream) {
+        serverStream.close();
+    }
+    
+    // EventSource reconnects on its own and resumes after the last frame seen
+    serverStream = new EventSource(job.stream_url);
+    
+    serverStream.addEventListener('angles', event => {
+        addServerFrames(JSON.parse(event.data));
+    });
+    
+    serverStream.addEventListener('done', event => {
+        const done = JSON.parse(event.data);
+        serverStream.close();
+        serverStream = null;
+        
+        if (done.status === 'completed') {
+            setServerResult(job.binary_result_url);
+            loadServerSummary(`/api/jobs/${job.job_id}/summary`);
+            showNotification('Server analysis complete', 'success');
+        } else {
+            showNotification(`Server analysis failed: ${done.error}`, 'error');
+        }
+    });
+}
+
+// Add a batch of frames from the server ({timestamp, joint: angle, ...})
+function addServerFrames(frames) {
+    frames.forEach(frame => {
+        const angles = { ...frame, time: frame.timestamp };
+        delete angles.timestamp;
+        
+        angleData.push(angles);
+        updateDataTable(angles, false);
+        updateMaxAngles(angles);
+    });
+    
+    // Filter and redraw once per batch rather than once per frame
+    filterDataTable(document.getElementById('jointSelect').value);
+    updateChart();
+    
+    framesAnalyzed += frames.length;
+    document.getElementById('framesAnalyzed').textContent = framesAnalyzed;
+}
+
+// Fetch a server-side summary (per-joint statistics and a chart series of
+// CHART_MAX_POINTS points) and show it in place of the streamed frames
+async function loadServerSummary(url) {
+    const session = serverSession;
+    try {
+        const response = await fetch(`${url}?points=${CHART_MAX_POINTS}`);
+        const summary = await response.json();
+        if (!response.ok || !summary.success) {
+            throw new Error(summary.error || `HTTP ${response.status}`);
+        }
+        if (session !== serverSession) return;
+        serverSummary = summary;
+    } catch (error) {
+        console.error('Could not load the analysis summary:', error);
+        return;
+    }
+    
+    Object.keys(maxAngles).forEach(joint => {
+        const stats = serverSummary.joints[joint] && serverSummary.joints[joint].stats;
+        if (stats && stats.max !== null) {
+            maxAngles[joint] = { value: stats.max, time: stats.max_time };
+            showMaxAngle(joint);
+        }
+    });
+    updateChart();
+}
+
 // Update data table with new measurements
-function updateDataTable(angles) {
+function updateDataTable(angles, applyFilter = true) {
     const tableBody = document.getElementById('angleDataBody');
     
     // Create a new row
@@ -634,8 +769,10 @@ function updateDataTable(angles) {
     tableBody.appendChild(row);
     
     // Filter based on current selection
-    const jointSelect = document.getElementById('jointSelect');
-    filterDataTable(jointSelect.value);
+    if (applyFilter) {
+        const jointSelect = document.getElementById('jointSelect');
+        filterDataTable(jointSelect.value);
+    }
 }
 
 // Filter data table to show only selected joint
@@ -746,8 +883,20 @@ function initializeChart() {
 function updateChart() {
     if (!chart || angleData.length === 0) return;
     
-    const timeData = angleData.map(data => data.time.toFixed(1));
-    const angleValues = angleData.map(data => data[selectedJoint]);
+    let timeData;
+    let angleValues;
+    const series = serverSummary && serverSummary.joints[selectedJoint] &&
+        serverSummary.joints[selectedJoint].series;
+    if (series) {
+        // Already downsampled by the server, keeping peaks and valleys
+        timeData = series.timestamps.map(time => time.toFixed(1));
+        angleValues = series.angles;
+    } else {
+        // Downsampled the same way while a session is still growing
+        const points = downsampleSeries(angleData, selectedJoint, CHART_MAX_POINTS);
+        timeData = points.times.map(time => time.toFixed(1));
+        angleValues = points.angles;
+    }
     
     chart.data.labels = timeData;
     chart.data.datasets[0].data = angleValues;
@@ -762,6 +911,75 @@ function updateChart() {
     chart.update();
 }
 
+// Largest-Triangle-Three-Buckets downsampling of one joint's angles, as the
+// summary endpoint does it (see summary.py): the frames between the first and
+// the last are split into equal buckets and each keeps the point that forms
+// the largest triangle with its neighbours, so peaks and valleys survive.
+// Frames without an angle show up as gaps (null)
+function downsampleSeries(frames, joint, maxPoints) {
+    const value = frame => (typeof frame[joint] === 'number' ? frame[joint] : null);
+    if (frames.length <= maxPoints) {
+        return { times: frames.map(frame => frame.time), angles: frames.map(value) };
+    }
+    
+    const buckets = maxPoints - 2;
+    const edge = i => 1 + Math.floor(i * (frames.length - 2) / buckets);
+    const times = [frames[0].time];
+    const angles = [value(frames[0])];
+    let anchorTime = frames[0].time;
+    let anchorValue = value(frames[0]);
+    
+    for (let bucket = 0; bucket < buckets; bucket++) {
+        const start = edge(bucket);
+        const end = edge(bucket + 1);
+        
+        // Mean of the next bucket, or the last frame after the last bucket
+        let nextTime;
+        let nextValue = null;
+        if (bucket + 1 < buckets) {
+            const following = frames.slice(end, edge(bucket + 2));
+            const values = following.map(value).filter(angle => angle !== null);
+            nextTime = following.reduce((acc, frame) => acc + frame.time, 0) / following.length;
+            if (values.length) {
+                nextValue = values.reduce((acc, angle) => acc + angle, 0) / values.length;
+            }
+        } else {
+            nextTime = frames[frames.length - 1].time;
+            nextValue = value(frames[frames.length - 1]);
+        }
+        
+        // Without a neighbouring value the triangle degenerates to the
+        // distance from the one that is there
+        const aValue = anchorValue === null ? nextValue : anchorValue;
+        const cValue = nextValue === null ? aValue : nextValue;
+        let chosen = frames[start];
+        let largest = -1;
+        for (let index = start; index < end; index++) {
+            const angle = value(frames[index]);
+            if (angle === null || aValue === null) continue;
+            const area = Math.abs((anchorTime - nextTime) * (angle - aValue) -
+                (anchorTime - frames[index].time) * (cValue - aValue));
+            if (area > largest) {
+                largest = area;
+                chosen = frames[index];
+            }
+        }
+        times.push(chosen.time);
+        angles.push(value(chosen));
+        
+        // A bucket with no value leaves the previous point as the anchor
+        if (value(chosen) !== null) {
+            anchorTime = chosen.time;
+            anchorValue = value(chosen);
+        }
+    }
+    
+    const last = frames[frames.length - 1];
+    times.push(last.time);
+    angles.push(value(last));
+    return { times, angles };
+}
+
 // Update maximum angles and summary display
 function updateMaxAngles(angles) {
     // Update max angles
@@ -771,24 +989,27 @@ function updateMaxAngles(angles) {
                 value: angles[joint],
                 time: angles.time
             };
-            
-            // Update summary display
-            const maxCard = document.getElementById(`${joint}Max`);
-            if (maxCard) {
-                const angleValue = maxCard.querySelector('.angle-value');
-                const timestamp = maxCard.querySelector('.timestamp');
-                
-                angleValue.textContent = `${maxAngles[joint].value.toFixed(1)}°`;
-                
-                // Format time for display
-                const minutes = Math.floor(maxAngles[joint].time / 60);
-                const seconds = Math.floor(maxAngles[joint].time % 60);
-                timestamp.textContent = `Time: ${String(minutes).padStart(2, '0')}:${String(seconds).padStart(2, '0')}`;
-            }
+            showMaxAngle(joint);
         }
     });
 }
 
+// Show a joint's maximum angle on its summary card
+function showMaxAngle(joint) {
+    const maxCard = document.getElementById(`${joint}Max`);
+    if (maxCard) {
+        const angleValue = maxCard.querySelector('.angle-value');
+        const timestamp = maxCard.querySelector('.timestamp');
+        
+        angleValue.textContent = `${maxAngles[joint].value.toFixed(1)}°`;
+        
+        // Format time for display
+        const minutes = Math.floor(maxAngles[joint].time / 60);
+        const seconds = Math.floor(maxAngles[joint].time % 60);
+        timestamp.textContent = `Time: ${String(minutes).padStart(2, '0')}:${String(seconds).padStart(2, '0')}`;
+    }
+}
+
 // Update session statistics
 function updateSessionStats() {
     // Calculate average processing time
@@ -810,6 +1031,13 @@ function updateSessionStats() {
 function resetAnalysis() {
     // Reset data
     angleData = [];
+    serverResultUrl = null;
+    serverSummary = null;
+    serverSession++;
+    if (serverStream) {
+        serverStream.close();
+        serverStream = null;
+    }
     framesAnalyzed = 0;
     processingTimes = [];
     
@@ -857,8 +1085,55 @@ function resetAnalysis() {
     showNotification('Analysis reset successfully', 'success');
 }
 
-// Download data as CSV
+// Remember the binary result of a finished server-side analysis job (the
+// binary_result_url returned by /api/upload or /api/analyze), which Download
+// Data then saves instead of a CSV
+function setServerResult(url) {
+    serverResultUrl = url;
+}
+
+// Save a blob under a timestamped filename
+function saveBlob(blob, extension) {
+    const url = URL.createObjectURL(blob);
+    const a = document.createElement('a');
+    
+    // Generate filename with timestamp
+    const date = new Date();
+    const timestamp = `${date.getFullYear()}${(date.getMonth() + 1).toString().padStart(2, '0')}${date.getDate().toString().padStart(2, '0')}_${date.getHours().toString().padStart(2, '0')}${date.getMinutes().toString().padStart(2, '0')}`;
+    const filename = `joint_angle_data_${timestamp}.${extension}`;
+    
+    a.href = url;
+    a.download = filename;
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
+    
+    // Some browsers cancel the download if the URL is revoked right away
+    setTimeout(() => URL.revokeObjectURL(url), 1000);
+}
+
+// Download the server's columnar result as-is instead of building a CSV
+async function downloadServerResult() {
+    try {
+        const response = await fetch(serverResultUrl);
+        if (response.status !== 200) {
+            throw new Error(`Server returned ${response.status}`);
+        }
+        saveBlob(await response.blob(), 'npz');
+        showNotification('Data downloaded successfully', 'success');
+    } catch (error) {
+        console.error('Failed to download server result:', error);
+        showNotification('Failed to download data from the server', 'error');
+    }
+}
+
+// Download data as CSV, or as the server's binary result when there is one
 function downloadData() {
+    if (serverResultUrl) {
+        downloadServerResult();
+        return;
+    }
+    
     if (angleData.length === 0) {
         showNotification('No data available to download', 'warning');
         return;
@@ -878,20 +1153,7 @@ function downloadData() {
     });
     
     // Create and trigger download
-    const blob = new Blob([csvContent], { type: 'text/csv' });
-    const url = URL.createObjectURL(blob);
-    const a = document.createElement('a');
-    
-    // Generate filename with timestamp
-    const date = new Date();
-    const timestamp = `${date.getFullYear()}${(date.getMonth() + 1).toString().padStart(2, '0')}${date.getDate().toString().padStart(2, '0')}_${date.getHours().toString().padStart(2, '0')}${date.getMinutes().toString().padStart(2, '0')}`;
-    const filename = `joint_angle_data_${timestamp}.csv`;
-    
-    a.href = url;
-    a.download = filename;
-    document.body.appendChild(a);
-    a.click();
-    document.body.removeChild(a);
+    saveBlob(new Blob([csvContent], { type: 'text/csv' }), 'csv');
     
     showNotification('Data downloaded successfully', 'success');
 }
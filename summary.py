@@ -0,0 +1,480 @@
+"""
+Summaries and display series of angle results, computed in one pass.
+
+summarize reads a result in chunks of frames, so an in-memory AngleColumns and
+a spilled result on disk (see spill.py) are summarized the same way without
+loading the whole of either. Every chunk goes through, in order:
+
+1. Optional smoothing: a One-Euro filter, which follows fast movement with
+   little lag and removes jitter while the joint holds still, or a
+   Savitzky-Golay filter, a sliding polynomial fit that keeps the height of
+   peaks
+2. Running statistics per joint: min and max with their times, mean, standard
+   deviation, and a 0.1 degree histogram the percentiles are read from
+3. Repetition counting: a turning point is confirmed once the angle has moved
+   REP_MIN_SWING degrees back from its running extreme, and every two turning
+   points (there and back) make a repetition
+4. Largest-Triangle-Three-Buckets (LTTB) downsampling: the frames are split
+   into equal buckets and each keeps the point that forms the largest
+   triangle with its neighbours, so peaks and valleys survive and a chart
+   only has to draw a few hundred points
+
+Frames without an angle are skipped by the statistics and show up as gaps
+(None) in the series.
+"""
+
+import math
+
+import numpy as np
+
+# Points in a display series by default, and the most that can be asked for
+DEFAULT_POINTS = 300
+MAX_POINTS = 10000
+
+SMOOTHING_METHODS = ("one-euro", "savgol")
+
+# Percentiles reported for every joint
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# Angles lie in [0, 180] degrees; percentiles are read from bins this wide
+HISTOGRAM_DEGREES = 0.1
+_BINS = int(round(180 / HISTOGRAM_DEGREES)) + 1
+
+# Swing (degrees) that confirms a turning point when counting repetitions
+REP_MIN_SWING = 30.0
+
+# One-Euro filter settings: cutoff frequency at rest (Hz), how fast it rises
+# with speed, and the cutoff used for the speed estimate
+ONE_EURO_MIN_CUTOFF = 1.0
+ONE_EURO_BETA = 0.01
+ONE_EURO_D_CUTOFF = 1.0
+
+# Savitzky-Golay window (frames, odd) and polynomial order
+SAVGOL_WINDOW = 9
+SAVGOL_ORDER = 2
+
+# Frames read per chunk
+CHUNK_FRAMES = 8192
+
+
+class OneEuroFilter:
+    """
+    Streaming One-Euro filter over several joints.
+
+    A gap (NaN) restarts the filter for that joint.
+    """
+
+    def __init__(self, joints, min_cutoff=ONE_EURO_MIN_CUTOFF, beta=ONE_EURO_BETA,
+                 d_cutoff=ONE_EURO_D_CUTOFF):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        # Per joint: time, value and speed of the last filtered frame
+        self._state = [None] * joints
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def feed(self, timestamps, angles):
+        """Filter the next (n,) timestamps and (n, J) angles; returns both."""
+        filtered = np.array(angles, dtype=np.float64)
+        times = timestamps.tolist()
+        for joint in range(filtered.shape[1]):
+            column = filtered[:, joint].tolist()
+            state = self._state[joint]
+            for i, (t, x) in enumerate(zip(times, column)):
+                if x != x:
+                    state = None
+                    continue
+                if state is None:
+                    state = (t, x, 0.0)
+                    continue
+                last_t, last_x, last_dx = state
+                dt = t - last_t
+                if dt <= 0:
+                    column[i] = last_x
+                    continue
+                dx = (x - last_x) / dt
+                a_d = self._alpha(self.d_cutoff, dt)
+                dx = last_dx + a_d * (dx - last_dx)
+                a = self._alpha(self.min_cutoff + self.beta * abs(dx), dt)
+                x = last_x + a * (x - last_x)
+                column[i] = x
+                state = (t, x, dx)
+            self._state[joint] = state
+            filtered[:, joint] = column
+        return timestamps, filtered
+
+    def finish(self):
+        return None
+
+
+class SavitzkyGolayFilter:
+    """
+    Streaming Savitzky-Golay filter over several joints.
+
+    Output lags input by half a window, which finish returns. Frames whose
+    window isn't complete or contains a gap (the first and last half window
+    of the video, and around missing frames) keep their raw value.
+    """
+
+    def __init__(self, window=SAVGOL_WINDOW, order=SAVGOL_ORDER):
+        if window % 2 == 0 or window <= order:
+            raise ValueError("The Savitzky-Golay window must be odd and longer than the order")
+        self.window = window
+        half = window // 2
+        # Least-squares polynomial fit evaluated at the window's center
+        offsets = np.arange(-half, half + 1, dtype=np.float64)
+        self._coefficients = np.linalg.pinv(np.vander(offsets, order + 1, increasing=True))[0]
+        self._timestamps = np.empty(0)
+        self._angles = None
+        self._started = False
+
+    def feed(self, timestamps, angles):
+        half = self.window // 2
+        angles = np.asarray(angles, dtype=np.float64)
+        if self._angles is None:
+            self._angles = np.empty((0, angles.shape[1]))
+        t = np.concatenate([self._timestamps, timestamps])
+        x = np.concatenate([self._angles, angles])
+        if len(x) < self.window:
+            self._timestamps, self._angles = t, x
+            return t[:0], x[:0]
+
+        # Windows centered on frames half .. len - half - 1
+        windows = np.lib.stride_tricks.sliding_window_view(x, self.window, axis=0)
+        smoothed = np.nan_to_num(windows) @ self._coefficients
+        smoothed = np.where(np.isnan(windows).any(axis=-1), x[half:len(x) - half], smoothed)
+        if self._started:
+            out_t, out_x = t[half:len(x) - half], smoothed
+        else:
+            # The first half window of the video can't be smoothed
+            out_t, out_x = t[:len(x) - half], np.concatenate([x[:half], smoothed])
+            self._started = True
+        # Keep what the next windows still need
+        self._timestamps = t[len(x) - self.window + 1:]
+        self._angles = x[len(x) - self.window + 1:]
+        return out_t, out_x
+
+    def finish(self):
+        """The last half window of frames, unsmoothed."""
+        if self._angles is None:
+            return None
+        half = self.window // 2
+        if not self._started:
+            # Fewer frames than a window: all of them, raw
+            return self._timestamps, self._angles
+        return self._timestamps[-half:], self._angles[-half:]
+
+
+class _Statistics:
+    # Running min/max/mean/std and a histogram per joint
+
+    def __init__(self, joints):
+        self.count = np.zeros(joints, dtype=np.int64)
+        self.total = np.zeros(joints)
+        self.squares = np.zeros(joints)
+        self.min = np.full(joints, np.inf)
+        self.max = np.full(joints, -np.inf)
+        self.min_time = np.full(joints, np.nan)
+        self.max_time = np.full(joints, np.nan)
+        self.histogram = np.zeros((joints, _BINS), dtype=np.int64)
+
+    def feed(self, timestamps, angles):
+        valid = np.isfinite(angles)
+        values = np.where(valid, angles, 0.0)
+        self.count += valid.sum(axis=0)
+        self.total += values.sum(axis=0)
+        self.squares += (values ** 2).sum(axis=0)
+        for joint in range(angles.shape[1]):
+            column = angles[valid[:, joint], joint]
+            if column.size == 0:
+                continue
+            times = timestamps[valid[:, joint]]
+            low, high = column.argmin(), column.argmax()
+            if column[low] < self.min[joint]:
+                self.min[joint], self.min_time[joint] = column[low], times[low]
+            if column[high] > self.max[joint]:
+                self.max[joint], self.max_time[joint] = column[high], times[high]
+            bins = np.clip(np.rint(column / HISTOGRAM_DEGREES), 0, _BINS - 1).astype(np.int64)
+            self.histogram[joint] += np.bincount(bins, minlength=_BINS)
+
+    def percentile(self, joint, q):
+        cumulative = np.cumsum(self.histogram[joint])
+        index = int(np.searchsorted(cumulative, q / 100 * cumulative[-1], side="left"))
+        return round(index * HISTOGRAM_DEGREES, 1)
+
+    def report(self, joint):
+        count = int(self.count[joint])
+        if count == 0:
+            return {"valid_frames": 0, "min": None, "max": None, "mean": None, "std": None,
+                    "min_time": None, "max_time": None, "range_of_motion": None,
+                    "percentiles": {f"p{q}": None for q in PERCENTILES}}
+        mean = self.total[joint] / count
+        variance = max(self.squares[joint] / count - mean ** 2, 0.0)
+        return {
+            "valid_frames": count,
+            "min": float(self.min[joint]),
+            "min_time": float(self.min_time[joint]),
+            "max": float(self.max[joint]),
+            "max_time": float(self.max_time[joint]),
+            "mean": float(mean),
+            "std": math.sqrt(variance),
+            "range_of_motion": float(self.max[joint] - self.min[joint]),
+            "percentiles": {f"p{q}": self.percentile(joint, q) for q in PERCENTILES}
+        }
+
+
+class _RepetitionCounter:
+    # Zigzag turning points per joint
+
+    def __init__(self, joints, swing):
+        self.swing = swing
+        self.turns = [0] * joints
+        # Per joint: direction of the last confirmed swing (+1 up, -1 down,
+        # 0 none yet) and the running extremes since
+        self._direction = [0] * joints
+        self._high = [None] * joints
+        self._low = [None] * joints
+
+    def feed(self, angles):
+        swing = self.swing
+        for joint in range(angles.shape[1]):
+            direction = self._direction[joint]
+            high, low = self._high[joint], self._low[joint]
+            turns = self.turns[joint]
+            for x in angles[:, joint].tolist():
+                if x != x:
+                    continue
+                if high is None:
+                    high = low = x
+                    continue
+                high = max(high, x)
+                low = min(low, x)
+                if direction >= 0 and x <= high - swing:
+                    # Came down from a peak
+                    turns += 1
+                    direction = -1
+                    low = x
+                elif direction <= 0 and x >= low + swing:
+                    # Came up from a valley
+                    turns += 1
+                    direction = 1
+                    high = x
+            self._direction[joint] = direction
+            self._high[joint], self._low[joint] = high, low
+            self.turns[joint] = turns
+
+    def reps(self, joint):
+        return self.turns[joint] // 2
+
+
+class _LTTB:
+    # Streaming Largest-Triangle-Three-Buckets over frame-index buckets
+
+    def __init__(self, frames, points, joints):
+        self.frames = frames
+        self.joints = joints
+        self.keep_all = frames <= points
+        # The first and last frames are kept; the others are split into
+        # points - 2 buckets
+        self.edges = np.linspace(1, frames - 1, points - 1).astype(np.int64) \
+            if not self.keep_all else None
+        self._bucket = 0
+        self._offset = 0
+        self._t = np.empty(0)
+        self._y = np.empty((0, joints))
+        self._last_t = None
+        self._last_y = None
+        self.series_t = []
+        self.series_y = []
+
+    def _emit(self, t, y):
+        self.series_t.append(t)
+        self.series_y.append(y)
+
+    def feed(self, timestamps, angles):
+        if self.keep_all:
+            for t, row in zip(timestamps.tolist(), angles):
+                self._emit(np.full(self.joints, t), row)
+            return
+        self._t = np.concatenate([self._t, timestamps])
+        self._y = np.concatenate([self._y, angles])
+        if self._offset == 0 and self._last_t is None and len(self._t):
+            # The first frame is always kept
+            self._last_t = np.full(self.joints, self._t[0])
+            self._last_y = self._y[0].copy()
+            self._emit(self._last_t, self._last_y)
+        self._select(final=False)
+
+    def _select(self, final):
+        buckets = len(self.edges) - 1
+        available = self._offset + len(self._t)
+        while self._bucket < buckets:
+            start, end = self.edges[self._bucket], self.edges[self._bucket + 1]
+            # The next bucket (or the last frame) must have arrived
+            following = self.edges[self._bucket + 2] if self._bucket + 1 < buckets \
+                else self.frames
+            if following > available and not final:
+                return
+            if self._bucket + 1 < buckets:
+                next_t = self._t[end - self._offset:following - self._offset].mean()
+                following_y = self._y[end - self._offset:following - self._offset]
+                valid = np.isfinite(following_y)
+                counts = valid.sum(axis=0)
+                next_y = np.where(counts > 0, np.where(valid, following_y, 0.0).sum(axis=0)
+                                  / np.maximum(counts, 1), np.nan)
+            else:
+                next_t = self._t[self.frames - 1 - self._offset]
+                next_y = self._y[self.frames - 1 - self._offset]
+            t = self._t[start - self._offset:end - self._offset]
+            y = self._y[start - self._offset:end - self._offset]
+
+            # Without a neighbouring value the triangle degenerates to the
+            # distance from the one that is there
+            a_y = np.where(np.isnan(self._last_y), next_y, self._last_y)
+            c_y = np.where(np.isnan(next_y), a_y, next_y)
+            a_t = self._last_t
+            area = np.abs((a_t - next_t) * (y - a_y) - (a_t - t[:, None]) * (c_y - a_y))
+            area = np.where(np.isnan(area), -1.0, area)
+            chosen = area.argmax(axis=0)
+            columns = np.arange(self.joints)
+            selected_t = t[chosen]
+            selected_y = y[chosen, columns]
+            self._emit(selected_t, selected_y)
+            # A bucket with no value leaves the previous point as the anchor
+            keep = ~np.isnan(selected_y)
+            self._last_t = np.where(keep, selected_t, self._last_t)
+            self._last_y = np.where(keep, selected_y, self._last_y)
+
+            self._bucket += 1
+            drop = end - self._offset
+            self._t, self._y = self._t[drop:], self._y[drop:]
+            self._offset = end
+
+    def finish(self):
+        if self.keep_all:
+            return
+        self._select(final=True)
+        self._emit(np.full(self.joints, self._t[-1]), self._y[-1])
+
+    def series(self, joint):
+        return {
+            "timestamps": [float(t[joint]) for t in self.series_t],
+            "angles": [None if y[joint] != y[joint] else float(y[joint]) for y in self.series_y]
+        }
+
+
+def _smoother(method, joints):
+    if method is None:
+        return None
+    if method == "one-euro":
+        return OneEuroFilter(joints)
+    if method == "savgol":
+        return SavitzkyGolayFilter()
+    raise ValueError(f"Unknown smoothing: {method} "
+                     f"(choose from {', '.join(SMOOTHING_METHODS)})")
+
+
+def smooth(timestamps, angles, method):
+    """
+    Smooth a whole (N, J) angle array.
+
+    Args:
+        timestamps: (N,) frame times in seconds
+        angles: (N, J) angles in degrees, NaN for gaps
+        method: "one-euro" or "savgol"
+
+    Returns:
+        A new (N, J) float64 array
+
+    Raises:
+        ValueError: If the method is unknown
+    """
+    smoother = _smoother(method, angles.shape[1])
+    parts = [smoother.feed(np.asarray(timestamps), angles)[1]]
+    rest = smoother.finish()
+    if rest is not None:
+        parts.append(rest[1])
+    return np.concatenate(parts)
+
+
+def _chunks(source, joints, chunk_frames):
+    for first in range(0, len(source), chunk_frames):
+        columns = source.window(first, first + chunk_frames, joints)
+        yield columns.timestamps, columns.angles.T.astype(np.float64)
+
+
+def summarize(source, points=DEFAULT_POINTS, smoothing=None, joints=None,
+              rep_swing=REP_MIN_SWING, chunk_frames=CHUNK_FRAMES):
+    """
+    Summarize an angle result in one pass.
+
+    Args:
+        source: An AngleColumns or a SpillReader
+        points: Points per joint in the display series (at least 3)
+        smoothing: None, "one-euro" or "savgol"
+        joints: Joints to summarize (default: all in the result)
+        rep_swing: Swing in degrees that confirms a repetition's turning point
+        chunk_frames: Frames read at a time
+
+    Returns:
+        A dict with the frame count, duration, the settings used, and per
+        joint "stats" (min, max, mean, std, percentiles, range of motion,
+        repetitions) and a downsampled "series"
+
+    Raises:
+        ValueError: If an option is invalid or a joint isn't in the result
+    """
+    if not 3 <= points <= MAX_POINTS:
+        raise ValueError(f"points must be between 3 and {MAX_POINTS}")
+    joints = list(joints or source.joints)
+    unknown = [name for name in joints if name not in source.joints]
+    if unknown:
+        raise ValueError(f"Joints not in this result: {', '.join(unknown)}")
+
+    frames = len(source)
+    smoother = _smoother(smoothing, len(joints))
+    statistics = _Statistics(len(joints))
+    repetitions = _RepetitionCounter(len(joints), rep_swing)
+    downsampler = _LTTB(frames, points, len(joints)) if frames else None
+    duration = 0.0
+
+    def consume(timestamps, angles):
+        nonlocal duration
+        if len(timestamps) == 0:
+            return
+        statistics.feed(timestamps, angles)
+        repetitions.feed(angles)
+        downsampler.feed(timestamps, angles)
+        duration = float(timestamps[-1])
+
+    for timestamps, angles in _chunks(source, joints, chunk_frames):
+        if smoother:
+            timestamps, angles = smoother.feed(timestamps, angles)
+        consume(timestamps, angles)
+    if smoother:
+        rest = smoother.finish()
+        if rest is not None:
+            consume(*rest)
+    if downsampler:
+        downsampler.finish()
+
+    summary = {
+        "frames": frames,
+        "duration": duration,
+        "points": points,
+        "smoothing": smoothing,
+        "joints": {}
+    }
+    for index, name in enumerate(joints):
+        stats = statistics.report(index)
+        stats["reps"] = repetitions.reps(index)
+        summary["joints"][name] = {
+            "stats": stats,
+            "series": downsampler.series(index) if downsampler else {"timestamps": [],
+                                                                     "angles": []}
+        }
+    return summary
@@ -0,0 +1,177 @@
+"""
+Downloader tests against a local HTTP server standing in for the object store.
+
+Run with: python -m unittest tests.test_remote
+"""
+
+import hashlib
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import remote
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # Keep connections alive between requests
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == server.etag:
+            self.send_response(304)
+            self.send_header("ETag", server.etag)
+            self.end_headers()
+            return
+        body = server.files[self.path]
+        start, status = 0, 200
+        if "Range" in self.headers and self.headers.get("If-Range") == server.etag:
+            start, status = int(self.headers["Range"].split("=")[1].split("-")[0]), 206
+        self.send_response(status)
+        self.send_header("ETag", server.etag)
+        self.send_header("Content-Length", str(len(body) - start))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+        self.end_headers()
+        if server.cut_after is not None:
+            # Drop the connection partway through the body
+            self.wfile.write(body[start:start + server.cut_after])
+            server.cut_after = None
+            if server.on_cut:
+                server.on_cut()
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RemoteStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.files = {"/a.mp4": os.urandom(300_000), "/b.mp4": os.urandom(200_000)}
+        self.server.etag = '"v1"'
+        self.server.requests = []
+        self.server.connections = 0
+        self.server.cut_after = None
+        self.server.on_cut = None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        self.store = remote.RemoteStore(os.path.join(self.folder, "downloads"), self.folder,
+                                        10 ** 7, ["127.0.0.1"])
+        self._backoff = remote.RETRY_BACKOFF_SECONDS
+        remote.RETRY_BACKOFF_SECONDS = 0
+
+    def tearDown(self):
+        remote.RETRY_BACKOFF_SECONDS = self._backoff
+        self.store.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder)
+
+    def download(self, path, store=None):
+        store = store or self.store
+        download = store.open(self.base + path)
+        self.assertTrue(download.wait(timeout=30))
+        # Let the download thread finish, so the next request doesn't join it
+        deadline = time.monotonic() + 30
+        while store._active and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return download
+
+    def assertDownloaded(self, download, body):
+        self.assertIsNone(download.error)
+        self.assertTrue(download.complete)
+        with open(download.path, "rb") as f:
+            self.assertEqual(f.read(), body)
+        self.assertEqual(download.video_hash, hashlib.sha256(body).hexdigest())
+
+    def test_downloads_reuse_connection(self):
+        first = self.download("/a.mp4")
+        second = self.download("/b.mp4")
+        self.assertDownloaded(first, self.server.files["/a.mp4"])
+        self.assertDownloaded(second, self.server.files["/b.mp4"])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_completed_download_is_reused(self):
+        first = self.download("/a.mp4")
+        second = self.download("/a.mp4")
+        self.assertEqual(second.path, first.path)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_unused_downloads_are_pruned(self):
+        used = self.download("/a.mp4")
+        unused = self.download("/b.mp4")
+        for download in (used, unused):
+            os.utime(download.path, (0, 0))
+        self.download("/a.mp4")
+        self.store.prune()
+        self.assertTrue(os.path.exists(used.path))
+        self.assertFalse(os.path.exists(unused.path))
+        self.assertFalse(os.path.exists(unused.meta_path))
+
+    def test_resumes_with_range(self):
+        self.server.cut_after = 100_000
+        download = self.download("/a.mp4")
+        self.assertDownloaded(download, self.server.files["/a.mp4"])
+        resumed = self.server.requests[1]
+        self.assertEqual(resumed["Range"], "bytes=100000-")
+        self.assertEqual(resumed["If-Range"], '"v1"')
+
+    def test_changed_file_is_fetched_again(self):
+        changed = os.urandom(250_000)
+
+        def change():
+            self.server.files["/a.mp4"] = changed
+            self.server.etag = '"v2"'
+
+        self.server.cut_after = 100_000
+        self.server.on_cut = change
+        download = self.download("/a.mp4")
+        self.assertDownloaded(download, changed)
+        self.assertEqual(self.server.requests[1]["If-Range"], '"v1"')
+
+    def test_changed_file_is_resumed_after_refresh(self):
+        self.download("/a.mp4")
+        changed = os.urandom(250_000)
+        self.server.files["/a.mp4"] = changed
+        self.server.etag = '"v2"'
+        self.server.cut_after = 100_000
+        download = self.store.open(self.base + "/a.mp4", refresh=True)
+        self.assertTrue(download.wait(timeout=30))
+        self.assertDownloaded(download, changed)
+        refresh, resumed = self.server.requests[1:]
+        self.assertEqual(refresh["If-None-Match"], '"v1"')
+        self.assertNotIn("If-None-Match", resumed)
+        self.assertEqual(resumed["Range"], "bytes=100000-")
+        self.assertEqual(resumed["If-Range"], '"v2"')
+
+    def test_refuses_private_addresses(self):
+        store = remote.RemoteStore(os.path.join(self.folder, "any"), self.folder, 10 ** 7, ["*"])
+        download = self.download("/a.mp4", store)
+        self.assertIn("isn't a public address", download.error)
+        self.assertEqual(self.server.requests, [])
+
+    def test_refuses_urls_by_default(self):
+        store = remote.RemoteStore(os.path.join(self.folder, "none"), self.folder, 10 ** 7)
+        with self.assertRaises(remote.DownloadError):
+            store.open(self.base + "/a.mp4")
+        with self.assertRaises(remote.DownloadError):
+            self.store.open("http://localhost:1/a.mp4")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,233 @@
+"""
+Video decoding and encoding through ffmpeg subprocesses.
+
+When only angles are needed, frames don't have to exist at full resolution at
+all. FFmpegReader asks ffmpeg to scale and convert every frame to RGB at the
+inference resolution while decoding, and reads the raw frames from its stdout
+straight into the caller's buffers, so the Python side never touches a
+full-size frame. It mirrors the read/release interface of cv2.VideoCapture so
+the pipeline's decode stage can use either.
+
+Annotated output is written by an encoder from create_writer: FFmpegWriter
+pipes raw frames to ffmpeg's stdin and gets H.264 MP4 files browsers can play
+(with the index up front so playback starts before the download finishes),
+while OpenCVWriter is the cv2.VideoWriter/XVID fallback. Both can write a
+lower-resolution preview rendition next to the full one, and share the
+write/release/isOpened interface of cv2.VideoWriter.
+
+ffmpeg is optional: FFMPEG is None when no binary is found (set FFMPEG_BINARY
+to point at one), and callers fall back to OpenCV.
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+
+import cv2
+import numpy as np
+
+from profiles import inference_size
+
+logger = logging.getLogger(__name__)
+
+# ffmpeg executable used for decoding and encoding, or None if unavailable
+FFMPEG = os.environ.get("FFMPEG_BINARY") or shutil.which("ffmpeg")
+
+# Encoder for annotated output: "h264" (ffmpeg) or "opencv" (XVID)
+VIDEO_ENCODER = os.environ.get("VIDEO_ENCODER") or ("h264" if FFMPEG else "opencv")
+
+# x264 speed/size trade-off, and a target bitrate (e.g. "4M"); without a
+# bitrate the quality is kept constant at VIDEO_CRF
+VIDEO_PRESET = os.environ.get("VIDEO_PRESET", "veryfast")
+VIDEO_BITRATE = os.environ.get("VIDEO_BITRATE") or None
+VIDEO_CRF = int(os.environ.get("VIDEO_CRF", 23))
+
+# Longest side of preview renditions, and their (lower) quality
+PREVIEW_MAX_DIMENSION = int(os.environ.get("PREVIEW_MAX_DIMENSION", 480))
+PREVIEW_CRF = 28
+
+
+class FFmpegReader:
+    """
+    Decode a video to raw frames of a fixed size and pixel format.
+
+    Args:
+        path: Video file to read
+        width: Width of the frames returned
+        height: Height of the frames returned
+        pixel_format: ffmpeg pixel format; "rgb24" or "bgr24"
+        threads: Decoder threads, 0 lets ffmpeg decide
+    """
+
+    def __init__(self, path, width, height, pixel_format="rgb24", threads=0):
+        if FFMPEG is None:
+            raise RuntimeError("ffmpeg is not available")
+        self.width = width
+        self.height = height
+        command = [
+            FFMPEG, "-v", "error", "-nostdin", "-threads", str(threads), "-i", path,
+            # One output frame per decoded frame, whatever the timestamps say
+            "-vsync", "0", "-an", "-sn",
+            "-vf", f"scale={width}:{height}:flags=area",
+            "-pix_fmt", pixel_format, "-f", "rawvideo", "pipe:1"
+        ]
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, bufsize=0)
+
+    def isOpened(self):
+        return self._process is not None and self._process.poll() in (None, 0)
+
+    def read(self, image=None):
+        """
+        Read the next frame, into `image` if it has the right shape.
+
+        Returns:
+            A (success, frame) tuple like cv2.VideoCapture.read
+        """
+        shape = (self.height, self.width, 3)
+        if image is None or image.shape != shape or image.dtype != np.uint8:
+            image = np.empty(shape, dtype=np.uint8)
+        view = memoryview(image).cast("B")
+        filled = 0
+        while filled < len(view):
+            count = self._process.stdout.readinto(view[filled:])
+            if not count:
+                # End of stream; a partial frame is dropped
+                return False, None
+            filled += count
+        return True, image
+
+    def release(self):
+        if self._process is None:
+            return
+        self._process.stdout.close()
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        self._process = None
+
+
+def output_extension(extension, encoder=None):
+    """File extension to give annotated output for an input with `extension`."""
+    return ".mp4" if (encoder or VIDEO_ENCODER) == "h264" else extension
+
+
+def preview_size(width, height):
+    """Size of the preview rendition of a `width` x `height` video (even sides)."""
+    width, height = inference_size(width, height, PREVIEW_MAX_DIMENSION)
+    return max(width - width % 2, 2), max(height - height % 2, 2)
+
+
+def create_writer(path, fps, width, height, encoder=None, preview_path=None,
+                  preset=None, bitrate=None):
+    """
+    Open an encoder for annotated output.
+
+    Args:
+        path: Output file
+        fps: Frame rate
+        width: Frame width
+        height: Frame height
+        encoder: "h264" or "opencv" (default VIDEO_ENCODER); h264 falls back
+            to opencv when ffmpeg isn't available
+        preview_path: Also write a rendition scaled to PREVIEW_MAX_DIMENSION here
+        preset: x264 preset (default VIDEO_PRESET)
+        bitrate: x264 target bitrate (default VIDEO_BITRATE)
+
+    Returns:
+        An FFmpegWriter or OpenCVWriter
+    """
+    encoder = encoder or VIDEO_ENCODER
+    if encoder == "h264" and FFMPEG:
+        return FFmpegWriter(path, fps, width, height, preview_path=preview_path,
+                            preset=preset or VIDEO_PRESET, bitrate=bitrate or VIDEO_BITRATE)
+    if encoder == "h264":
+        logger.warning("ffmpeg is not available, writing annotated output with OpenCV")
+    elif encoder != "opencv":
+        raise ValueError(f"Unknown video encoder: {encoder}")
+    return OpenCVWriter(path, fps, width, height, preview_path=preview_path)
+
+
+def _x264_output(path, preset, bitrate, crf):
+    quality = ["-b:v", bitrate] if bitrate else ["-crf", str(crf)]
+    return (["-c:v", "libx264", "-preset", preset] + quality +
+            ["-pix_fmt", "yuv420p", "-movflags", "+faststart", path])
+
+
+class FFmpegWriter:
+    """
+    Encode BGR frames to H.264 MP4 by piping them to an ffmpeg subprocess.
+
+    ffmpeg encodes in its own process, so a write only costs copying the
+    frame into the pipe. If ffmpeg fails, later frames are dropped and the
+    error is logged on release, as cv2.VideoWriter would drop them silently.
+    """
+
+    def __init__(self, path, fps, width, height, preview_path=None,
+                 preset=VIDEO_PRESET, bitrate=VIDEO_BITRATE):
+        self.shape = (height, width, 3)
+        command = [
+            FFMPEG, "-v", "error", "-y", "-hide_banner",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}",
+            "-r", str(fps), "-i", "pipe:0",
+            # yuv420p needs even sides
+            "-vf", "crop=trunc(iw/2)*2:trunc(ih/2)*2"
+        ] + _x264_output(path, preset, bitrate, VIDEO_CRF)
+        if preview_path:
+            preview_width, preview_height = preview_size(width, height)
+            command += ["-vf", f"scale={preview_width}:{preview_height}:flags=area"]
+            command += _x264_output(preview_path, preset, None, PREVIEW_CRF)
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                         stderr=subprocess.PIPE)
+
+    def isOpened(self):
+        return self._process is not None and self._process.poll() is None
+
+    def write(self, frame):
+        if frame.shape != self.shape:
+            raise ValueError(f"Frame shape {frame.shape} doesn't match {self.shape}")
+        if self._process.poll() is not None:
+            return
+        try:
+            self._process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            pass
+
+    def release(self):
+        if self._process is None:
+            return
+        _, errors = self._process.communicate()
+        if self._process.returncode != 0:
+            logger.warning(f"ffmpeg exited with {self._process.returncode}: "
+                           f"{errors.decode(errors='replace').strip()}")
+        self._process = None
+
+
+class OpenCVWriter:
+    """Encode frames with cv2.VideoWriter (XVID), plus an optional preview."""
+
+    def __init__(self, path, fps, width, height, preview_path=None):
+        fourcc = cv2.VideoWriter_fourcc(*'XVID')
+        self._writer = cv2.VideoWriter(path, fourcc, fps, (width, height))
+        self._preview = None
+        if preview_path:
+            self._preview_size = preview_size(width, height)
+            self._preview = cv2.VideoWriter(preview_path, fourcc, fps, self._preview_size)
+            self._preview_frame = np.empty(self._preview_size[::-1] + (3,), dtype=np.uint8)
+
+    def isOpened(self):
+        return self._writer.isOpened()
+
+    def write(self, frame):
+        self._writer.write(frame)
+        if self._preview is not None:
+            # Scale into the reused preview buffer
+            self._preview_frame = cv2.resize(frame, self._preview_size, dst=self._preview_frame,
+                                             interpolation=cv2.INTER_AREA)
+            self._preview.write(self._preview_frame)
+
+    def release(self):
+        self._writer.release()
+        if self._preview is not None:
+            self._preview.release()